@@ -0,0 +1 @@
+"""Benchmarks driving the translation pipeline with synthetic workloads."""
@@ -0,0 +1,345 @@
+"""Measure throughput, latency and allocations of the MIDI pipeline.
+
+Messages are fed to the same input handler the rtmidi callbacks use and
+translated messages are written to in-process loopback ports, so no MIDI
+hardware or virtual ports are needed.
+
+Usage:
+    python3 -m benchmarks.run [--count=N] [--workloads=a,b]
+                              [--engine=rx|fast|raw|async]
+                              [--output=file.json] [--compare=file.json]
+"""
+from typing import Any, Callable, Dict, List, Tuple
+
+import json
+import platform
+import random
+import subprocess
+import threading
+import time
+import tracemalloc
+
+from mido import Message  # type: ignore
+from mido.ports import MultiPort  # type: ignore
+from rx.subject import Subject  # type: ignore
+
+from midi_mapper import app
+from midi_mapper import utils
+from midi_mapper.async_engine import AsyncPipeline
+from midi_mapper.engine import FastPipeline
+from midi_mapper.logger import QUIET
+from midi_mapper.logger import sink
+from midi_mapper.mappings import Mapping
+from midi_mapper.store import store
+from midi_mapper.utils import get_option
+from midi_mapper.utils import input_message
+from midi_mapper.utils import input_raw
+
+
+CONTROLLER = 'Controller'
+SYNTH = 'Synth'
+ALLOCATION_MESSAGES = 2000
+RESULTS_FOLDER = './benchmarks/results'
+
+# An input handler and the function that shuts its engine down
+Engine = Tuple[Callable[[Any], None], Callable[[], None]]
+
+
+class LoopbackPort:
+    """Output port that counts what the pipeline writes to it.
+
+    It exposes itself as the raw rtmidi handle so writes take the same
+    path as they do with real ports, and like rtmidi it only takes one
+    message per write."""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.closed = False
+        self.writes = 0
+        self.bytes = 0
+        self._rt = self
+
+    def send_message(self, data: bytes) -> None:
+        if len(data) > 3 and data[0] != 0xF0:
+            raise ValueError("'message' longer than 3 bytes but does not "
+                             "start with 0xF0.")
+        self.writes += 1
+        self.bytes += len(data)
+
+    def send(self, midi: Message) -> None:
+        self.send_message(midi.bin())
+
+    def close(self) -> None:
+        self.closed = True
+
+
+def row(**fields: Any) -> Mapping:
+    """Create a mapping from CSV style fields."""
+    defaults = {
+        'input-device': CONTROLLER,
+        'description': 'Encoder',
+        'type': 'control_change',
+        'bank': '0',
+        'channel': '1',
+        'output-device': SYNTH,
+        'o-description': 'Parameter',
+        'o-type': 'control_change',
+        'o-channel': '1',
+        'o-range': '',
+    }
+    return Mapping.from_dict({**defaults, **fields})
+
+
+def cc(channel: int, control: int, value: int) -> Message:
+    return Message(
+        type='control_change', channel=channel, control=control, value=value)
+
+
+def cc_sweep(count: int) -> Tuple[List[Mapping], List[Message]]:
+    """64 encoders swept through their whole range."""
+    mappings = [
+        row(control=str(i), **{'o-control': str(i), 'o-range': '0-100'})
+        for i in range(64)]
+    messages = [cc(0, i % 64, (i // 64) % 128) for i in range(count)]
+    return mappings, messages
+
+
+def nrpn_flood(count: int) -> Tuple[List[Mapping], List[Message]]:
+    """64 encoders translated to NRPN parameters."""
+    mappings = [
+        row(control=str(i), **{'o-control': f'{i // 8}:{i % 8}'})
+        for i in range(64)]
+    messages = [cc(0, i % 64, (i // 64) % 128) for i in range(count)]
+    return mappings, messages
+
+
+def bank_storm(count: int) -> Tuple[List[Mapping], List[Message]]:
+    """Two banks of 64 encoders, switching bank every 8 messages."""
+    mappings = [
+        row(type='note_on', channel='16', control=str(bank), **{
+            'output-device': CONTROLLER,
+            'o-type': 'mm_bank_change',
+            'o-channel': '-',
+            'o-control': str(bank),
+        })
+        for bank in (1, 2)]
+    mappings += [
+        row(bank=str(bank), control=str(i), **{'o-control': str(i)})
+        for bank in (1, 2) for i in range(64)]
+    messages = [
+        Message(type='note_on', channel=15, note=1 + (i // 8) % 2)
+        if i % 8 == 0 else cc(0, i % 64, i % 128)
+        for i in range(count)]
+    return mappings, messages
+
+
+def large_mappings(count: int) -> Tuple[List[Mapping], List[Message]]:
+    """Every control on 16 channels in three banks, hit at random."""
+    mappings = [
+        row(bank=str(bank), channel=str(channel), control=str(control), **{
+            'o-channel': str(channel), 'o-control': str(control)})
+        for bank in range(3)
+        for channel in range(1, 17)
+        for control in range(128)]
+    rand = random.Random(0)
+    messages = [
+        cc(rand.randrange(16), rand.randrange(128), rand.randrange(128))
+        for _ in range(count)]
+    return mappings, messages
+
+
+WORKLOADS: Dict[str, Callable[[int], Tuple[List[Mapping], List[Message]]]] = {
+    'cc_sweep': cc_sweep,
+    'nrpn_flood': nrpn_flood,
+    'bank_storm': bank_storm,
+    'large_mappings': large_mappings,
+}
+
+
+def stop_nothing() -> None:
+    pass
+
+
+def rx_engine() -> Engine:
+    """Return an input handler feeding the Rx pipeline."""
+    midi_stream = Subject()
+    app.create_pipeline(midi_stream)
+    return lambda midi: input_message(midi, midi_stream), stop_nothing
+
+
+def fast_engine() -> Engine:
+    """Return an input handler feeding the fast pipeline."""
+    pipeline = FastPipeline()
+    return lambda midi: input_message(midi, pipeline), stop_nothing
+
+
+def raw_engine() -> Engine:
+    """Return an input handler feeding rtmidi bytes to the fast pipeline."""
+    pipeline = FastPipeline()
+    return lambda data: input_raw(data, pipeline), stop_nothing
+
+
+def async_engine() -> Engine:
+    """Return an input handler feeding rtmidi bytes to the asyncio loop.
+
+    Each call waits until the loop has sent the message so latencies
+    include the hand over from the input thread to the loop. The loop
+    and its thread are shut down by the returned stop function."""
+    pipeline = AsyncPipeline()
+    thread = threading.Thread(target=pipeline.run, daemon=True)
+    thread.start()
+    pipeline.started.wait()
+
+    def feed(data: List[int]) -> None:
+        input_raw(data, pipeline)
+        pipeline.join()
+
+    def stop() -> None:
+        pipeline.stop()
+        thread.join()
+        pipeline.loop.close()
+
+    return feed, stop
+
+
+# Engine factories and whether they take rtmidi bytes instead of messages
+ENGINES: Dict[str, Tuple[Callable[[], Engine], bool]] = {
+    'rx': (rx_engine, False),
+    'fast': (fast_engine, False),
+    'raw': (raw_engine, True),
+    'async': (async_engine, True),
+}
+
+
+def percentile(samples: List[float], p: float) -> float:
+    """Return the p-th percentile of sorted samples in microseconds."""
+    return samples[min(int(len(samples) * p), len(samples) - 1)] * 1e6
+
+
+def run_workload(name: str, count: int, engine: str) -> Dict[str, Any]:
+    """Run a workload and return its measurements."""
+    mappings, messages = WORKLOADS[name](count)
+    ports = [LoopbackPort(n) for n in (CONTROLLER, SYNTH)]
+    utils.nrpn_params.clear()
+    store.update('outports', MultiPort(ports))
+    store.update('mappings', mappings)
+    store.update('active_bank', 1)
+    factory, raw = ENGINES[engine]
+    feed, stop = factory()
+    if raw:
+        messages = [midi.bytes() for midi in messages]
+
+    try:
+        latencies = []
+        perf_counter = time.perf_counter
+        start = perf_counter()
+        for midi in messages:
+            t0 = perf_counter()
+            feed(midi)
+            latencies.append(perf_counter() - t0)
+        elapsed = perf_counter() - start
+
+        sample = messages[:ALLOCATION_MESSAGES]
+        tracemalloc.start()
+        baseline, _ = tracemalloc.get_traced_memory()
+        for midi in sample:
+            feed(midi)
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        stop()
+
+    latencies.sort()
+    return {
+        'mappings': len(mappings),
+        'messages': len(messages),
+        'messages_per_sec': round(len(messages) / elapsed),
+        'latency_us': {
+            'p50': round(percentile(latencies, 0.5), 2),
+            'p99': round(percentile(latencies, 0.99), 2),
+            'max': round(latencies[-1] * 1e6, 2),
+        },
+        'alloc_peak_kib': round((peak - baseline) / 1024, 1),
+        'alloc_retained_bytes_per_msg': round(
+            (current - baseline) / len(sample), 1),
+        'writes': sum(p.writes for p in ports),
+        'bytes_written': sum(p.bytes for p in ports),
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return 'unknown'
+
+
+def run(count: int, workloads: List[str], engine: str) -> Dict[str, Any]:
+    """Run workloads and return the results document."""
+    verbosity, sink.verbosity = sink.verbosity, QUIET
+    try:
+        results = {name: run_workload(name, count, engine)
+                   for name in workloads}
+    finally:
+        sink.verbosity = verbosity
+    return {
+        'commit': git_commit(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'engine': engine,
+        'count': count,
+        'workloads': results,
+    }
+
+
+def report(results: Dict[str, Any]) -> List[str]:
+    """Return a summary line per workload."""
+    formatter = '{:15.15} | {:>9} msg/s | p50 {:>8} us | p99 {:>8} us | ' \
+        'peak {:>7} KiB'
+    return [
+        formatter.format(
+            name, r['messages_per_sec'], r['latency_us']['p50'],
+            r['latency_us']['p99'], r['alloc_peak_kib'])
+        for name, r in results['workloads'].items()]
+
+
+def compare(old: Dict[str, Any], new: Dict[str, Any]) -> List[str]:
+    """Return throughput and p99 changes for workloads in both results."""
+    lines = []
+    formatter = '{:15.15} | {:>9} -> {:>9} msg/s ({:+.1f}%) | ' \
+        'p99 {:>8} -> {:>8} us'
+    for name, r in new['workloads'].items():
+        if name not in old['workloads']:
+            continue
+        o = old['workloads'][name]
+        change = (r['messages_per_sec'] / o['messages_per_sec'] - 1) * 100
+        lines.append(formatter.format(
+            name, o['messages_per_sec'], r['messages_per_sec'], change,
+            o['latency_us']['p99'], r['latency_us']['p99']))
+    return lines
+
+
+def main() -> None:
+    count = int(get_option('count', '20000'))
+    workloads = get_option('workloads', ','.join(WORKLOADS)).split(',')
+    engine = get_option('engine', 'rx')
+    results = run(count, workloads, engine)
+    print('\n'.join(report(results)))
+
+    output = get_option(
+        'output', f'{RESULTS_FOLDER}/{results["commit"]}-{engine}.json')
+    with open(output, 'w') as fd:
+        json.dump(results, fd, indent=2)
+    print(f'\nResults written to {output}')
+
+    previous = get_option('compare', '')
+    if previous:
+        with open(previous) as fd:
+            print('\n' + '\n'.join(compare(json.load(fd), results)))
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main()
@@ -0,0 +1,104 @@
+"""Measure how throughput scales with the number of shard processes.
+
+Each shard runs the fast pipeline in its own process with the mappings
+of its own controller, like shards.Shards does, and translates count
+messages to loopback ports. Shards start together and the total rate is
+the messages of all shards over the time the slowest one took. Bank
+changes are relayed through the main process as they are when running,
+so with bank_storm every shard also applies the changes of the others.
+
+Usage:
+    python3 -m benchmarks.shards [--count=N] [--shards=N]
+                                 [--workload=name]
+"""
+from typing import Any, Dict
+
+import os
+import threading
+import time
+
+from mido.ports import MultiPort  # type: ignore
+
+from benchmarks.run import CONTROLLER
+from benchmarks.run import LoopbackPort
+from benchmarks.run import SYNTH
+from benchmarks.run import WORKLOADS
+from benchmarks.run import fast_engine
+from midi_mapper import stream
+from midi_mapper.logger import QUIET
+from midi_mapper.logger import sink
+from midi_mapper.shards import Shards
+from midi_mapper.shards import apply_changes
+from midi_mapper.store import store
+from midi_mapper.utils import get_option
+
+
+def shard(
+    workload: str, count: int, changes: Any, events: Any, ready: Any,
+    results: Any,
+) -> None:
+    """Translate count messages and put the time taken on results.
+
+    Runs in a shard process until it is terminated."""
+    sink.verbosity = QUIET
+    mappings, messages = WORKLOADS[workload](count)
+    ports = [LoopbackPort(n) for n in (CONTROLLER, SYNTH)]
+    store.update('outports', MultiPort(ports))
+    store.update('mappings', mappings)
+    store.update('active_bank', 1)
+    stream.broadcast = lambda o_type, value: changes.put((o_type, value))
+    applier = threading.Thread(
+        target=apply_changes, args=(events,), daemon=True)
+    applier.start()
+    feed, _ = fast_engine()
+    ready.wait()
+    start = time.perf_counter()
+    for midi in messages:
+        feed(midi)
+    results.put(time.perf_counter() - start)
+    # keep taking changes from shards still running until stopped
+    applier.join()
+
+
+def run(count: int, shards: int, workload: str) -> Dict[str, int]:
+    """Return the total messages per second with shards processes."""
+    relay = Shards(shards)
+    ready = relay.context.Barrier(shards + 1)
+    results = relay.context.SimpleQueue()
+    processes = []
+    for _ in range(shards):
+        events = relay.context.SimpleQueue()
+        relay.events.append(events)
+        processes.append(relay.context.Process(
+            target=shard,
+            args=(workload, count, relay.changes, events, ready, results),
+            daemon=True))
+    for process in processes:
+        process.start()
+    threading.Thread(target=relay.relay_changes, daemon=True).start()
+    ready.wait()
+    times = [results.get() for _ in processes]
+    for process in processes:
+        process.terminate()
+    return {
+        'messages_per_sec': round(shards * count / max(times)),
+        'relayed': relay.relayed,
+    }
+
+
+def main() -> None:
+    count = int(get_option('count', '20000'))
+    shards = int(get_option('shards', str(os.cpu_count() or 1)))
+    workload = get_option('workload', 'cc_sweep')
+    print(f'{workload}, {count} messages per shard')
+    single = 0.0
+    for n in range(1, shards + 1):
+        result = run(count, n, workload)
+        rate = result['messages_per_sec']
+        single = single or rate
+        print(f'{n:2} shards | {rate:>9} msg/s | x{rate / single:.2f} | '
+              f'{result["relayed"]} changes relayed')
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main()
@@ -0,0 +1,84 @@
+"""Measure how long mappings take to load with and without the cache.
+
+A folder of mapping CSV files is generated so the numbers don't depend
+on the mappings checked out. Cold loads parse every file and write the
+cache, warm loads read it back.
+
+Usage:
+    python3 -m benchmarks.startup [--rows=N] [--files=N] [--runs=N]
+"""
+from typing import Callable, Dict, List
+
+import os
+import tempfile
+import time
+
+from midi_mapper import mappings
+from midi_mapper.mappings import import_mappings
+from midi_mapper.utils import get_option
+
+
+HEADER = 'Input Device,Description,Type,Bank,Channel,Control,=>,' \
+    'Output Device,Description,Type,Channel,Control,Range\n'
+
+
+def write_files(folder: str, rows: int, files: int) -> None:
+    """Write rows mappings spread over files CSV files."""
+    for n in range(files):
+        with open(f'{folder}/mappings-{n}.csv', 'w') as fd:
+            fd.write(HEADER)
+            for i in range(n, rows, files):
+                bank, channel, control = i // 2048, i // 128 % 16 + 1, i % 128
+                fd.write(
+                    f'Controller,Encoder {i},control_change,{bank},'
+                    f'{channel},{control},=>,Synth,Parameter {i},'
+                    f'control_change,{channel},{control},0-100\n')
+
+
+def timed(load: Callable[[], List[mappings.Mapping]], runs: int) -> float:
+    """Return the best time of runs loads in milliseconds."""
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        load()
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000
+
+
+def run(rows: int, files: int, runs: int) -> Dict[str, float]:
+    """Return cold, warm and uncached load times in milliseconds."""
+    folder = mappings.MAPPINGS_FOLDER
+    cache = ''
+    with tempfile.TemporaryDirectory() as temp:
+        mappings.MAPPINGS_FOLDER = temp
+        try:
+            write_files(temp, rows, files)
+            cache = f'{temp}/{mappings.CACHE_FILE}'
+
+            def cold() -> List[mappings.Mapping]:
+                if os.path.exists(cache):
+                    os.remove(cache)
+                return import_mappings(cache=True)
+
+            results = {
+                'no_cache': timed(import_mappings, runs),
+                'cold': timed(cold, runs),
+                'warm': timed(lambda: import_mappings(cache=True), runs),
+            }
+        finally:
+            mappings.MAPPINGS_FOLDER = folder
+    return results
+
+
+def main() -> None:
+    rows = int(get_option('rows', '6144'))
+    files = int(get_option('files', '4'))
+    runs = int(get_option('runs', '5'))
+    results = run(rows, files, runs)
+    print(f'{rows} mappings in {files} files, best of {runs}')
+    for name, ms in results.items():
+        print(f'{name:10} | {ms:8.1f} ms')
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main()
@@ -0,0 +1,5 @@
+"""Translate MIDI messages between devices."""
+import time
+
+# When the package started importing, the start of app startup timings
+IMPORT_START = time.perf_counter()
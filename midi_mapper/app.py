@@ -1,50 +1,208 @@
 """Translate midi messages between input/output devices."""
+from typing import TYPE_CHECKING, Any, Dict, Optional, Tuple
+
 import signal
 import sys
 import time
 
-from rx.subject import Subject  # type: ignore
-from rx import operators as ops  # type: ignore
-
+from . import IMPORT_START
+from . import metrics
+from . import stream
+from .decoder import Decoder
+from .decoder import Key
+from .engine import FastPipeline
+from .logger import sink
 from .mappings import import_mappings
+from .monitor import PortMonitor
 from .store import store
-from .stream import get_translations
+from .stream import lookup
 from .stream import log
 from .stream import process_midi
 from .stream import translate_and_send
 from .stream import set_bank
+from .utils import get_option
+from .utils import lane
+from .utils import scheduler
 from .utils import set_io_ports
+from .watcher import MappingWatcher
+from .workers import stats as worker_stats
+
+if TYPE_CHECKING:  # pragma: no cover
+    from rx.subject import Subject  # type: ignore
+
+# Options sharded runs don't support, every shard runs a FastPipeline
+SHARD_UNSUPPORTED = ('--watch', '--hotplug', '--engine', '--quick-start')
 
 
 def signal_handler(*args) -> None:
     """Handle keyboard interrupt and close all ports."""
     print('\033[H\033[J')
     print('Keyboard interrupt detected\n')
-    for port in store.get('inports').ports + store.get('outports').ports:
-        if port.closed is False:  # pragma: no cover
-            print(f'Closing {port}')
-            port.close()
+    for ports in (store.get('inports'), store.get('outports')):
+        for port in [] if ports is None else ports.ports:
+            if port.closed is False:  # pragma: no cover
+                print(f'Closing {port}')
+                port.close()
+    print(f'Log sink: {sink.stats()}')
+    if scheduler.enabled:
+        print(f'Scheduler: {scheduler.stats()}')
+    if lane.source is not None:
+        print(f'Real-time lane: {lane.stats()}')
+    for name, port_stats in worker_stats(store.get('outports')).items():
+        print(f'Worker {name}: {port_stats}')
+    latency_handler()
     sys.exit(0)
 
 
-def run() -> None:
-    """Update store, create streams and run the main loop."""
+def latency_handler(*args) -> None:
+    """Print latency histograms if metrics are enabled."""
+    if metrics.ENABLED:
+        print('\n'.join(metrics.report()))
+
 
-    midi_stream = Subject()
-    store.update('mappings', import_mappings())
-    set_io_ports(midi_stream)
+def create_pipeline(midi_stream: 'Subject') -> None:
+    """Subscribe the translation pipeline to midi_stream.
 
-    midi_stream.pipe(
-        ops.map(lambda x: process_midi(x)),
-        ops.map(lambda x: get_translations(x)),
+    midi_stream carries (message, device) pairs from input_message.
+    Messages become (key, level, device) events, assembled by a Decoder
+    for 14-bit controls and NRPNs, merged with the events the decoder
+    sends once an LSB is overdue. Latency marks are only part of the
+    pipeline when metrics are enabled.
+    """
+    import rx  # type: ignore
+    from rx import operators as ops  # type: ignore
+    from rx.subject import Subject  # type: ignore
+
+    overdue = Subject()
+    decoder = Decoder(lambda *event: overdue.on_next(event))
+    events = rx.merge(
+        midi_stream.pipe(
+            ops.map(lambda x: decode_event(decoder, process_midi(x[0]), x[1])),
+            ops.filter(lambda x: x is not None)),
+        overdue)
+
+    operators = []
+    if metrics.ENABLED:
+        operators.append(ops.do_action(lambda _: metrics.mark('process')))
+    operators.append(ops.map(lambda x: lookup(*x)))
+    if metrics.ENABLED:
+        operators.append(ops.do_action(lambda _: metrics.mark('lookup')))
+    operators += [
         ops.flat_map(lambda x: x),
         ops.map(lambda x: translate_and_send(x)),
-        ops.do_action(lambda x: log(x)),
-    ).subscribe(on_error=lambda x: print(f'ERROR: {x}'))
+    ]
+    if metrics.ENABLED:
+        operators.append(ops.do_action(lambda x: metrics.mark('send', x)))
+    operators.append(ops.do_action(lambda x: log(x)))
+
+    events.pipe(*operators).subscribe(
+        on_error=lambda x: print(f'ERROR: {x}'))
+
+
+def decode_event(
+    decoder: Decoder, data: Dict[str, Any], device: Optional[str]
+) -> Optional[Tuple[Key, Optional[int], Optional[str]]]:
+    """Return the event for processed message data or None if held back."""
+    key = (data['type'], data['channel'], data['status'])
+    event = decoder.feed(key, data['level'], device)
+    if event is None:
+        return None
+    return event[0], event[1], device
+
+
+def lap(timings: Dict[str, float], phase: str, start: float) -> float:
+    """Add the time since start to a startup phase and return the time."""
+    now = time.perf_counter()
+    timings[phase] = timings.get(phase, 0.0) + now - start
+    return now
+
+
+def configure() -> None:
+    """Set logging, latency, reset, rate and real-time lane options.
+
+    --log-level=2 also logs every input message. --clock-in=Name
+    forwards clock and transport from the Name input to the outputs
+    listed in --clock-out=A,B, or to every output."""
+    sink.verbosity = int(get_option('log-level', str(sink.verbosity)))
+    metrics.ENABLED = '--latency' in sys.argv
+    stream.DELTA_RESETS = '--full-resets' not in sys.argv
+    scheduler.configure(get_option('max-rate', '0'))
+    lane.configure(get_option('clock-in', ''), get_option('clock-out', ''))
+
+
+def run() -> None:
+    """Update store, create streams and run the main loop.
+
+    rx and asyncio are only imported by the engines that use them. With
+    --quick-start ports are opened concurrently. The time taken by each
+    startup phase is printed once the initial bank has been sent. With
+    --hotplug ports are reopened when devices are plugged back in. With
+    --shards=N inputs are handled by N processes, see shards.Shards.
+    --shards can't be combined with --watch, --hotplug, --engine or
+    --quick-start and exits with an error if it is.
+    """
+    timings: Dict[str, float] = {}
+    now = lap(timings, 'imports', IMPORT_START)
+
+    configure()
+    cache = '--no-cache' not in sys.argv
+    raw = get_option('input', 'mido') == 'raw'
+    workers = get_option('workers', '') or None
+    queue_size = int(get_option('queue-size', '64'))
+    shards = int(get_option('shards', '0'))
+    if shards > 0:
+        unsupported = [
+            arg for arg in sys.argv[1:]
+            if arg.split('=')[0] in SHARD_UNSUPPORTED]
+        if unsupported:
+            sys.exit("ERROR: --shards can't be used with {}".format(
+                ', '.join(unsupported)))
+        from .shards import Shards
+        Shards(shards, raw, workers, queue_size, cache).run()
+        return
+
+    if '--watch' in sys.argv:
+        watcher = MappingWatcher()
+        store.update('mappings', watcher.load(cache))
+        watcher.start()
+    else:
+        store.update('mappings', import_mappings(cache))
+    print('mappings loaded: {}{}'.format(
+        len(store.get('mappings')), '' if cache else ' (no cache)'))
+    now = lap(timings, 'mappings', now)
+
+    concurrent = '--quick-start' in sys.argv
+    engine = get_option('engine', 'rx')
+    async_pipeline: Any = None
+    midi_stream: Any = None
+    if engine == 'async':
+        from .async_engine import AsyncPipeline
+        now = lap(timings, 'imports', now)
+        async_pipeline = midi_stream = AsyncPipeline(
+            float(get_option('clock', '0')))
+    elif raw or engine == 'fast':
+        midi_stream = FastPipeline()
+    else:
+        from rx.subject import Subject  # type: ignore
+        now = lap(timings, 'imports', now)
+        raw = False
+        midi_stream = Subject()
+        create_pipeline(midi_stream)
+    set_io_ports(midi_stream, raw, workers, queue_size, concurrent, timings)
 
     # send initial bank to reset controller
+    now = time.perf_counter()
     set_bank(1, initial=True)
+    lap(timings, 'bank', now)
+    print('startup: ' + ' | '.join(
+        f'{phase} {seconds * 1000:.1f} ms'
+        for phase, seconds in timings.items()))
+
+    if '--hotplug' in sys.argv:
+        PortMonitor(midi_stream, raw, workers, queue_size).start()
 
+    if async_pipeline is not None:
+        async_pipeline.run()
     while True:
         time.sleep(1)
 
@@ -52,4 +210,6 @@ def run() -> None:
 if __name__ == "__main__":  # pragma: no cover
     """Add keyboard interrupt handler and run application."""
     signal.signal(signal.SIGINT, signal_handler)
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, latency_handler)
     run()
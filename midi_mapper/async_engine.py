@@ -0,0 +1,139 @@
+"""Engine running the translation pipeline on an asyncio event loop.
+
+Kept apart from the other engines so asyncio is only imported when it
+is used.
+"""
+from typing import TYPE_CHECKING, Any, Callable, List, Optional, Tuple
+
+import asyncio
+import queue
+import threading
+
+from . import metrics
+from .decoder import Key
+from .engine import FastPipeline
+from .utils import scheduler
+from .utils import send_buffers
+
+if TYPE_CHECKING:  # pragma: no cover
+    from mido import Message  # type: ignore
+
+# MIDI clock ticks per quarter note
+CLOCK_PPQN = 24
+
+
+class AsyncPipeline(FastPipeline):
+    """Run the pipeline as coroutines on an asyncio event loop.
+
+    on_next and on_raw are called on the rtmidi callback threads and only
+    queue the message for the loop, so messages are translated and sent
+    one at a time in arrival order on the loop's thread. The scheduler is
+    flushed and MIDI clock sent from coroutines on the same loop so all
+    timers live in one place. run() blocks until stop() is called. With
+    metrics enabled each message's start time is queued with it so its
+    latency is measured from when it arrived.
+    """
+
+    def __init__(self, clock_bpm: float = 0) -> None:
+        super().__init__()
+        self.clock_bpm = clock_bpm
+        self.loop = asyncio.new_event_loop()
+        self.started = threading.Event()
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._waiting = False
+        self._wake: Optional[asyncio.Event] = None
+        self._main: Optional[asyncio.Future] = None
+
+    def on_next(self, item: Tuple['Message', Optional[str]]) -> None:
+        self._put(FastPipeline.on_next, item)
+
+    def on_raw(self, data: List[int], device: Optional[str] = None) -> None:
+        self._put(FastPipeline.on_raw, data, device)
+
+    def emit(self, key: Key, level: int, device: Optional[str]) -> None:
+        self._put(FastPipeline.emit, key, level, device)
+
+    def join(self, timeout: Optional[float] = None) -> None:
+        """Block until everything queued so far has been handled.
+
+        Must not be called from the loop's thread."""
+        done = threading.Event()
+        self._put(lambda pipeline: done.set())
+        done.wait(timeout)
+
+    def run(self) -> None:
+        """Run the event loop on this thread until stop() is called."""
+        asyncio.set_event_loop(self.loop)
+        self._main = self.loop.create_task(self.main())
+        try:
+            self.loop.run_until_complete(self._main)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            scheduler.wake = None
+
+    def stop(self) -> None:
+        """Stop run() from any thread."""
+        if self._main is not None:
+            self.loop.call_soon_threadsafe(self._main.cancel)
+
+    async def main(self) -> None:
+        self._wake = asyncio.Event()
+        coroutines = [self.translate()]
+        if scheduler.enabled:
+            coroutines.append(self.flush_scheduler())
+        if self.clock_bpm:
+            coroutines.append(self.clock(self.clock_bpm))
+        self.started.set()
+        await asyncio.gather(*coroutines)
+
+    async def translate(self) -> None:
+        """Handle queued messages in order, yielding to timers between."""
+        pending = self._queue
+        wake = self._wake
+        assert wake is not None
+        while True:
+            try:
+                handler, args, started = pending.get_nowait()
+            except queue.Empty:
+                # flag first so a message queued after the check wakes us
+                self._waiting = True
+                if pending.empty():
+                    await wake.wait()
+                wake.clear()
+                self._waiting = False
+                continue
+            if metrics.ENABLED:
+                metrics.resume(started)
+            handler(self, *args)
+            await asyncio.sleep(0)
+
+    async def flush_scheduler(self) -> None:
+        """Flush the scheduler's ports as they become due."""
+        due = asyncio.Event()
+        scheduler.wake = lambda: self.loop.call_soon_threadsafe(due.set)
+        while True:
+            delay = scheduler.flush_due()
+            try:
+                await asyncio.wait_for(due.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            due.clear()
+
+    async def clock(self, bpm: float) -> None:
+        """Send MIDI clock to all outports at bpm.
+
+        Ticks are timed from the first one so late ticks don't drift.
+        """
+        interval = 60 / (bpm * CLOCK_PPQN)
+        tick = self.loop.time()
+        while True:
+            send_buffers({None: bytearray([0xF8])})
+            tick += interval
+            await asyncio.sleep(max(tick - self.loop.time(), 0))
+
+    def _put(self, handler: Callable[..., None], *args: Any) -> None:
+        started = metrics.context() if metrics.ENABLED else None
+        self._queue.put((handler, args, started))
+        if self._waiting and self._wake is not None:
+            self.loop.call_soon_threadsafe(self._wake.set)
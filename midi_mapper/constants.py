@@ -1,4 +1,6 @@
 """Constants used in the application."""
+from enum import Enum
+
 
 STANDARD_MESSAGES = {
     'note_off': lambda x: (x.note, x.velocity),
@@ -10,8 +12,54 @@ STANDARD_MESSAGES = {
     'pitchwheel': lambda x: (None, x.pitch,),
 }
 
+# Input types with 14-bit levels assembled by decoder.Decoder
+DECODED_TYPES = frozenset(['control_change_14', 'nrpn'])
+
 REAL_TIME_MESSAGES = [
     'clock', 'start', 'continue', 'active_sensing', 'stop', 'reset']
 
 SYSTEM_COMMON_MESSAGES = [
     'sysex', 'quarter_frame', 'songpos', 'song_select', 'tune_request']
+
+
+class OutputType(Enum):
+    """Output types a mapping can produce."""
+
+    NOTE_OFF = 'note_off'
+    NOTE_ON = 'note_on'
+    POLYTOUCH = 'polytouch'
+    CONTROL_CHANGE = 'control_change'
+    PROGRAM_CHANGE = 'program_change'
+    AFTERTOUCH = 'aftertouch'
+    PITCHWHEEL = 'pitchwheel'
+    CLOCK = 'clock'
+    START = 'start'
+    CONTINUE = 'continue'
+    ACTIVE_SENSING = 'active_sensing'
+    STOP = 'stop'
+    RESET = 'reset'
+    MM_BANK_CHANGE = 'mm_bank_change'
+    MM_PROGRAM_CHANGE = 'mm_program_change'
+
+
+MAPPER_TYPES = frozenset([
+    OutputType.MM_BANK_CHANGE, OutputType.MM_PROGRAM_CHANGE])
+
+REAL_TIME_TYPES = frozenset(OutputType(t) for t in REAL_TIME_MESSAGES)
+
+# Status byte of each output type, channel messages without the channel
+STATUS_BYTES = {
+    OutputType.NOTE_OFF: 0x80,
+    OutputType.NOTE_ON: 0x90,
+    OutputType.POLYTOUCH: 0xA0,
+    OutputType.CONTROL_CHANGE: 0xB0,
+    OutputType.PROGRAM_CHANGE: 0xC0,
+    OutputType.AFTERTOUCH: 0xD0,
+    OutputType.PITCHWHEEL: 0xE0,
+    OutputType.CLOCK: 0xF8,
+    OutputType.START: 0xFA,
+    OutputType.CONTINUE: 0xFB,
+    OutputType.STOP: 0xFC,
+    OutputType.ACTIVE_SENSING: 0xFE,
+    OutputType.RESET: 0xFF,
+}
@@ -0,0 +1,224 @@
+"""Decode raw MIDI bytes into mapping index lookups."""
+from typing import Callable, Dict, List, Optional, Tuple
+
+import threading
+import time
+from array import array
+
+from .store import store
+
+
+Key = Tuple[str, int, Optional[int]]
+
+# Seconds a 14-bit MSB waits for its LSB before it is sent on its own
+TIMEOUT = 0.01
+
+# Parts kept per channel: 32 control MSBs, NRPN parameter MSB and LSB
+# and NRPN data MSB
+STRIDE = 35
+NRPN_PARAMETER = 32
+
+# Control changes making up NRPNs, including RPN selects ending them
+NRPN_CONTROLS = frozenset([6, 38, 98, 99, 100, 101])
+
+# Message type by status byte high nibble, None for system messages
+MESSAGE_TYPES: Tuple[Optional[str], ...] = (
+    None, None, None, None, None, None, None, None,
+    'note_off',
+    'note_on',
+    'polytouch',
+    'control_change',
+    'program_change',
+    'aftertouch',
+    'pitchwheel',
+    None,
+)
+
+
+def decode(data: List[int]) -> Optional[Tuple[Key, Optional[int]]]:
+    """Decode a channel message into its index key and level.
+
+    Key and level match what stream.process_midi produces for the same
+    message. System messages and malformed data return None.
+    """
+    try:
+        status = data[0]
+        type_ = MESSAGE_TYPES[status >> 4]
+        if type_ is None:
+            return None
+        channel = (status & 0x0F) + 1
+        if status < 0xC0:
+            return (type_, channel, data[1]), data[2]
+        if status < 0xD0:
+            return (type_, channel, data[1]), None
+        if status < 0xE0:
+            return (type_, channel, None), data[1]
+        return (type_, channel, None), (data[2] << 7 | data[1]) - 8192
+    except IndexError:
+        return None
+
+
+class Decoder:
+    """Assemble 14-bit control changes and NRPNs into single events.
+
+    Mappings with a 'control_change_14' input address the MSB control
+    (0-31) of a pair whose LSB is control + 32. 'nrpn' inputs address the
+    parameter written as 'msb:lsb' and are assembled from CC 99/98 and
+    data entry CC 6/38. Both have 14-bit levels from 0 to 16383. Only
+    controls and channels store.get('decoding') marks for decoding are
+    held back, every other message passes through feed unchanged.
+
+    Parts are kept per input device and channel in an array. A data MSB
+    waits for its LSB, which completes the event. If the LSB doesn't
+    arrive within 'timeout' the MSB is sent on its own by emit(key,
+    level, device) from a timer thread, so an incomplete sequence is
+    never held for longer than that. A newer MSB replaces a waiting one
+    without moving its deadline.
+    """
+
+    def __init__(
+        self,
+        emit: Callable[[Key, int, Optional[str]], None],
+        timeout: float = TIMEOUT,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.timeout = timeout
+        self.assembled = 0
+        self.expired = 0
+        self._emit = emit
+        self._clock = clock
+        self._parts: Dict[Optional[str], array] = {}
+        self._due: Dict[Tuple[Optional[str], int], float] = {}
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def stats(self) -> Dict[str, int]:
+        """Return assembled and expired events and parts still waiting."""
+        return {
+            'assembled': self.assembled,
+            'expired': self.expired,
+            'waiting': len(self._due),
+        }
+
+    def feed(
+        self, key: Key, level: Optional[int], device: Optional[str] = None
+    ) -> Optional[Tuple[Key, Optional[int]]]:
+        """Return the event for a message or None while it is held back."""
+        decoding = store.get('decoding')
+        if decoding is None or key[0] != 'control_change':
+            return key, level
+        channel, control = key[1], key[2] or 0
+        cc14, nrpn = decoding
+        index = ((channel - 1) & 0x0F) * 128 + control
+        if cc14[index]:
+            with self._cond:
+                return self._feed_cc14(channel, control, level or 0, device)
+        if nrpn[(channel - 1) & 0x0F] and control in NRPN_CONTROLS:
+            with self._cond:
+                return self._feed_nrpn(channel, control, level or 0, device)
+        return key, level
+
+    def flush_due(self) -> Optional[float]:
+        """Send MSBs whose LSB is overdue.
+
+        Return the time until the next one is due or None if no parts
+        are waiting.
+        """
+        expired = []
+        with self._cond:
+            now = self._clock()
+            for (device, offset), due in list(self._due.items()):
+                if due <= now:
+                    del self._due[(device, offset)]
+                    expired.append(self._event(device, offset, 0))
+            self.expired += len(expired)
+            delay = min(self._due.values()) - now if self._due else None
+        for event in expired:
+            self._emit(*event)
+        return delay
+
+    def _feed_cc14(
+        self, channel: int, control: int, level: int, device: Optional[str]
+    ) -> Optional[Tuple[Key, Optional[int]]]:
+        parts = self._parts_of(device)
+        offset = (channel - 1) * STRIDE + control % 32
+        if control < 32:
+            parts[offset] = level
+            self._wait(device, offset)
+            return None
+        self._due.pop((device, offset), None)
+        self.assembled += 1
+        return self._event(device, offset, level)[:2]
+
+    def _feed_nrpn(
+        self, channel: int, control: int, level: int, device: Optional[str]
+    ) -> Optional[Tuple[Key, Optional[int]]]:
+        parts = self._parts_of(device)
+        offset = (channel - 1) * STRIDE + NRPN_PARAMETER
+        if control in (98, 99):
+            # a data MSB still waiting is complete once the parameter
+            # changes, as 7-bit NRPNs never send an LSB
+            event = None
+            if self._due.pop((device, offset + 2), None) is not None:
+                self.expired += 1
+                event = self._event(device, offset + 2, 0)[:2]
+            if control == 99:
+                parts[offset], parts[offset + 1] = level, -1
+            else:
+                parts[offset + 1] = level
+            return event
+        if control in (100, 101):
+            # an RPN is selected, its data entry isn't ours
+            parts[offset] = parts[offset + 1] = -1
+            return ('control_change', channel, control), level
+        if parts[offset] < 0 or parts[offset + 1] < 0:
+            return ('control_change', channel, control), level
+        if control == 6:
+            parts[offset + 2] = level
+            self._wait(device, offset + 2)
+            return None
+        self._due.pop((device, offset + 2), None)
+        self.assembled += 1
+        return self._event(device, offset + 2, level)[:2]
+
+    def _event(
+        self, device: Optional[str], offset: int, lsb: int
+    ) -> Tuple[Key, int, Optional[str]]:
+        """Return the event for the MSB at offset completed by lsb."""
+        parts = self._parts[device]
+        channel, part = divmod(offset, STRIDE)
+        level = max(parts[offset], 0) << 7 | lsb
+        if part < 32:
+            return ('control_change_14', channel + 1, part), level, device
+        parameter = parts[offset - 2] << 7 | parts[offset - 1]
+        return ('nrpn', channel + 1, parameter), level, device
+
+    def _parts_of(self, device: Optional[str]) -> array:
+        parts = self._parts.get(device)
+        if parts is None:
+            parts = self._parts[device] = array('h', [-1]) * (16 * STRIDE)
+        return parts
+
+    def _wait(self, device: Optional[str], offset: int) -> None:
+        """Start the LSB deadline of the MSB at offset if not started."""
+        if (device, offset) in self._due:
+            return
+        self._due[(device, offset)] = self._clock() + self.timeout
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name='input-decoder', daemon=True)
+            self._thread.start()
+        self._cond.notify()
+
+    def _run(self) -> None:
+        while True:
+            try:
+                delay = self.flush_due()
+            except Exception as e:  # pragma: no cover
+                print(f'ERROR: {e}')
+                delay = None
+            with self._cond:
+                if delay is None and not self._due:
+                    self._cond.wait()
+                elif delay is not None and delay > 0:
+                    self._cond.wait(delay)
@@ -0,0 +1,85 @@
+"""Engines running the translation pipeline without Rx."""
+from typing import TYPE_CHECKING, List, Optional, Tuple
+
+from . import metrics
+from .decoder import Decoder
+from .decoder import decode
+from .decoder import Key
+from .stream import log
+from .stream import lookup
+from .stream import process_midi
+from .stream import translate_and_send
+
+if TYPE_CHECKING:  # pragma: no cover
+    from mido import Message  # type: ignore
+
+
+class FastPipeline:
+    """Process, look up, translate, send and log in one call per message.
+
+    Produces the same output as the Rx pipeline in app.create_pipeline.
+    It has the on_next method of an Rx Subject so it can be passed to
+    set_io_ports in place of the midi stream, taking (message, device)
+    pairs. on_raw takes rtmidi bytes instead of mido messages. Unlike the
+    Rx pipeline an error is reported and only drops the message that
+    caused it. Control changes go through a Decoder first, which holds
+    back the parts of 14-bit controls and NRPNs and hands over the
+    assembled event.
+    """
+
+    def __init__(self) -> None:
+        self.decoder = Decoder(self.emit)
+
+    def on_next(self, item: Tuple['Message', Optional[str]]) -> None:
+        try:
+            midi, device = item
+            data = process_midi(midi)
+            key = (data['type'], data['channel'], data['status'])
+            self.receive(key, data['level'], device)
+        except Exception as e:
+            print(f'ERROR: {e}')
+
+    def on_raw(self, data: List[int], device: Optional[str] = None) -> None:
+        try:
+            decoded = decode(data)
+            if decoded is not None:
+                self.receive(decoded[0], decoded[1], device)
+        except Exception as e:
+            print(f'ERROR: {e}')
+
+    def emit(self, key: Key, level: int, device: Optional[str]) -> None:
+        """Handle an event the decoder sends after its LSB timed out.
+
+        It is timed from when the decoder stopped waiting for the LSB."""
+        try:
+            if metrics.ENABLED:
+                metrics.start(device or '-')
+            self.handle(key, level, device)
+        except Exception as e:
+            print(f'ERROR: {e}')
+
+    def receive(
+        self, key: Key, level: Optional[int], device: Optional[str]
+    ) -> None:
+        """Pass control changes through the decoder before handling."""
+        if key[0] == 'control_change':
+            event = self.decoder.feed(key, level, device)
+            if event is None:
+                return
+            key, level = event
+        self.handle(key, level, device)
+
+    def handle(
+        self, key: Key, level: Optional[int], device: Optional[str] = None
+    ) -> None:
+        """Translate, send and log the mappings matching key."""
+        if metrics.ENABLED:
+            metrics.mark('process')
+        translations = lookup(key, level, device)
+        if metrics.ENABLED:
+            metrics.mark('lookup')
+        for translation in translations:
+            translate_and_send(translation)
+            if metrics.ENABLED:
+                metrics.mark('send', translation)
+            log(translation)
@@ -0,0 +1,105 @@
+"""Background console logging that keeps formatting off the MIDI path."""
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+import queue
+import threading
+
+
+QUIET = 0
+INFO = 1
+DEBUG = 2
+
+
+class LogSink:
+    """Format and write log records on a background thread.
+
+    emit() only queues the record. A record whose key is still waiting
+    in the queue replaces the waiting one so a busy control produces one
+    line with its latest value. Records are dropped when the queue is
+    full rather than blocking the caller.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 256,
+        verbosity: int = INFO,
+        write: Callable[[str], Any] = print,
+    ) -> None:
+        self.verbosity = verbosity
+        self.dropped = 0
+        self.coalesced = 0
+        self._write = write
+        self._queue: queue.Queue = queue.Queue(maxsize)
+        self._pending: Dict[Hashable, Tuple[str, Tuple[Any, ...]]] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def depth(self) -> int:
+        """Number of records waiting to be written."""
+        return self._queue.qsize()
+
+    def stats(self) -> Dict[str, int]:
+        """Return queue depth and drop counters."""
+        return {
+            'depth': self.depth,
+            'dropped': self.dropped,
+            'coalesced': self.coalesced,
+        }
+
+    def emit(
+        self, level: int, key: Optional[Hashable], template: str, *args: Any
+    ) -> None:
+        """Queue a record to be written as template.format(*args).
+
+        Records above the current verbosity are ignored. Records sharing
+        a key are coalesced while waiting to be written.
+        """
+        if level > self.verbosity:
+            return
+        if self._thread is None:
+            self.start()
+
+        record = (template, args)
+        with self._lock:
+            if key is not None:
+                if key in self._pending:
+                    self._pending[key] = record
+                    self.coalesced += 1
+                    return
+                self._pending[key] = record
+            try:
+                self._queue.put_nowait((key, record))
+            except queue.Full:
+                self._pending.pop(key, None)
+                self.dropped += 1
+
+    def start(self) -> None:
+        """Start the writer thread."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='log-sink', daemon=True)
+                self._thread.start()
+
+    def flush(self) -> None:
+        """Block until every queued record has been written."""
+        if self._thread is not None:
+            self._queue.join()
+
+    def _run(self) -> None:
+        while True:
+            key, record = self._queue.get()
+            if key is not None:
+                with self._lock:
+                    record = self._pending.pop(key, record)
+            template, args = record
+            try:
+                self._write(template.format(*args))
+            except Exception as e:  # pragma: no cover
+                print(f'ERROR: {e}')
+            finally:
+                self._queue.task_done()
+
+
+sink = LogSink()
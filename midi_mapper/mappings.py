@@ -1,23 +1,315 @@
 """Import and process mapping CSV files."""
-from typing import Any, Dict, List
+from typing import Any, Collection, Dict, List, Optional, Tuple
 
 import csv
+import hashlib
+import os
+import pickle
+from array import array
 from os import listdir
 
+from mido.ports import MultiPort  # type: ignore
+
+from .constants import DECODED_TYPES
+from .constants import OutputType
+from .constants import REAL_TIME_TYPES
+from .constants import STATUS_BYTES
+from .scaling import build_table
+from .state import state
+
 
 MAPPINGS_FOLDER = './mappings/'
+# Parsed mappings are cached in this file in the mappings folder
+CACHE_FILE = '.mappings.cache'
+CACHE_VERSION = 3
 
+# Port bound to devices that were unplugged, sending to it writes nothing
+UNPLUGGED = MultiPort([])
 
-def import_mappings() -> List[Dict[str, Any]]:
-    """List and import CSV files in the specified folder."""
-    data: List[Dict[str, Any]] = []
-    files = filter(lambda x: x.endswith('.csv'), listdir(MAPPINGS_FOLDER))
-    for filename in files:
-        csv = csv_dict_list(f'{MAPPINGS_FOLDER}/{filename}')
-        data += csv
+# Mapping attributes holding the fields of its CSV row
+ROW_FIELDS = (
+    'input_device', 'description', 'type', 'bank', 'channel', 'control',
+    'output_device', 'o_description', 'o_type', 'o_channel', 'o_control',
+    'o_range', 'nrpn', 'curve',
+)
+
+
+class Mapping:
+    """A mapping row with its fields parsed once at load time.
+
+    Numeric fields are None when the CSV holds a placeholder such as '-'.
+    """
+
+    __slots__ = (
+        # CSV fields, NRPN input controls are stored as msb * 128 + lsb
+        'input_device', 'description', 'type', 'bank', 'channel', 'control',
+        'output_device', 'o_description', 'o_type', 'o_channel', 'o_control',
+        'o_range',
+        # (msb, lsb) when o-control is written as '1:9'
+        'nrpn',
+        # position of the row's memory in its bank, see State.load
+        'slot',
+        'o_level',
+        # opened ports, see bind_ports
+        'output_port', 'input_port',
+        # output bytes without the value and the number of value bytes
+        'template', 'size',
+        # o-range curve, input level offset so 14-bit pitchwheel indexes
+        # from 0, output bits and the table of output level by input level
+        'curve', 'offset', 'bits', 'scale',
+        # 0-based (channel, control) of resets and lights on the
+        # controller and its position in State.shown, or -1
+        'feedback', 'feedback_index',
+    )
+
+    def __init__(
+        self,
+        input_device: str = '',
+        description: str = '',
+        type: str = '',
+        bank: Optional[int] = None,
+        channel: Optional[int] = None,
+        control: Optional[int] = None,
+        output_device: str = '',
+        o_description: str = '',
+        o_type: Optional[OutputType] = None,
+        o_channel: Optional[int] = None,
+        o_control: Optional[int] = None,
+        o_range: Optional[Tuple[int, int]] = None,
+        nrpn: Optional[Tuple[int, int]] = None,
+        curve: str = 'linear',
+    ) -> None:
+        self.input_device = input_device
+        self.description = description
+        self.type = type
+        self.bank = bank
+        self.channel = channel
+        self.control = control
+        self.output_device = output_device
+        self.o_description = o_description
+        self.o_type = o_type
+        self.o_channel = o_channel
+        self.o_control = o_control
+        self.o_range = o_range
+        self.nrpn = nrpn
+        self.slot = -1
+        self.o_level = 0
+        self.output_port: Any = None
+        self.input_port: Any = None
+        self.template, self.size = output_template(self)
+        self.curve = curve
+        decoded = type in DECODED_TYPES
+        in_bits = 14 if type == 'pitchwheel' or decoded else 7
+        self.offset = 8192 if type == 'pitchwheel' else 0
+        range_ = o_range
+        # 14-bit inputs use the whole range of their output by default,
+        # pitchwheel to pitchwheel passes levels through unchanged
+        through = type == 'pitchwheel' and o_type is OutputType.PITCHWHEEL
+        if range_ is None and in_bits == 14 and not through:
+            wide = o_type is OutputType.PITCHWHEEL or nrpn is not None
+            range_ = (0, 16383) if wide else (0, 127)
+        self.bits = 7
+        out_offset = 0
+        if o_type is OutputType.PITCHWHEEL:
+            # ranges are in 14-bit units with 8192 as the centre
+            self.bits = 14
+            out_offset = 0 if range_ is None else -8192
+        elif nrpn is not None and range_ is not None:
+            self.bits = 14 if max(range_) > 127 else 7
+        self.scale = build_table(range_, curve, in_bits, out_offset)
+        self.feedback: Optional[Tuple[int, int]] = None
+        if channel is not None and control is not None and not decoded:
+            self.feedback = ((channel - 1) & 0x0F, control & 0x7F)
+        self.feedback_index = -1
+        if self.feedback is not None and type == 'control_change':
+            self.feedback_index = self.feedback[0] * 128 + self.feedback[1]
+
+    def __repr__(self) -> str:
+        return (
+            f'Mapping({self.input_device!r}, {self.description!r}, '
+            f'{self.type}, bank={self.bank}, channel={self.channel}, '
+            f'control={self.control} => {self.output_device!r}, '
+            f'{self.o_description!r}, {self.o_type})'
+        )
+
+    @property
+    def memory(self) -> int:
+        try:
+            return state.memory[self.bank][self.slot] if self.slot >= 0 else 0
+        except (KeyError, IndexError):
+            return 0
+
+    @memory.setter
+    def memory(self, level: Optional[int]) -> None:
+        if self.slot >= 0:
+            state.set_memory(self.bank, self.slot, level)
+
+    @classmethod
+    def from_dict(cls, row: Dict[str, Any]) -> 'Mapping':
+        """Create a mapping from a row returned by csv_dict_list."""
+
+        def field(name: str) -> str:
+            return str(row.get(name, '')).strip()
+
+        o_control = field('o-control')
+        control = parse_int(field('control'))
+        parameter = parse_pair(field('control'), ':')
+        if field('type') == 'nrpn' and parameter is not None:
+            control = parameter[0] << 7 | parameter[1]
+        try:
+            o_type: Optional[OutputType] = OutputType(field('o-type'))
+        except ValueError:
+            o_type = None
+        return cls(
+            input_device=field('input-device'),
+            description=field('description'),
+            type=field('type'),
+            bank=parse_int(field('bank')),
+            channel=parse_int(field('channel')),
+            control=control,
+            output_device=field('output-device'),
+            o_description=field('o-description'),
+            o_type=o_type,
+            o_channel=parse_int(field('o-channel')),
+            o_control=parse_int(o_control),
+            o_range=parse_pair(field('o-range'), '-'),
+            nrpn=parse_pair(o_control, ':'),
+            curve=field('o-curve').lower() or 'linear',
+        )
+
+
+def parse_int(value: str) -> Optional[int]:
+    """Return value as an integer or None if it is not a number."""
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+def parse_pair(value: str, separator: str) -> Optional[Tuple[int, int]]:
+    """Parse values like '0-16' or '1:9' into a pair of integers."""
+    parts = value.split(separator)
+    if len(parts) != 2:
+        return None
+    first, second = parse_int(parts[0]), parse_int(parts[1])
+    if first is None or second is None:
+        return None
+    return first, second
+
+
+def output_template(mapping: Mapping) -> Tuple[Optional[bytes], int]:
+    """Return output message bytes without the value and the value size.
+
+    Values match utils.create_midi: note on/off have fixed velocities and
+    aftertouch/pitchwheel are sent on the first channel. Mapper types and
+    NRPN outputs have no template.
+    """
+    if mapping.o_type not in STATUS_BYTES or mapping.nrpn is not None:
+        return None, 0
+    status = STATUS_BYTES[mapping.o_type]
+    if mapping.o_type in REAL_TIME_TYPES:
+        return bytes([status]), 0
+    if mapping.o_type in (OutputType.AFTERTOUCH, OutputType.PITCHWHEEL):
+        size = 2 if mapping.o_type is OutputType.PITCHWHEEL else 1
+        return bytes([status]), size
+
+    if mapping.o_control is None:
+        return None, 0
+    channel = 0 if mapping.o_channel is None else mapping.o_channel - 1
+    template = bytes([status | (channel & 0x0F), mapping.o_control & 0x7F])
+    if mapping.o_type is OutputType.NOTE_ON:
+        return template + bytes([127]), 0
+    if mapping.o_type is OutputType.NOTE_OFF:
+        return template + bytes([0]), 0
+    if mapping.o_type is OutputType.PROGRAM_CHANGE:
+        return template, 0
+    return template, 1
+
+
+def import_mappings(cache: bool = False) -> List[Mapping]:
+    """List and import CSV files in the specified folder.
+
+    With cache set files that haven't changed are loaded from the cache.
+    """
+    data: List[Mapping] = []
+    if cache:
+        for rows in import_cached(mapping_files()).values():
+            data += rows
+        return data
+    for filename in mapping_files():
+        data += import_file(filename)
     return data
 
 
+def mapping_files() -> List[str]:
+    """Return paths of the CSV files in the mappings folder."""
+    files = filter(lambda x: x.endswith('.csv'), listdir(MAPPINGS_FOLDER))
+    return [f'{MAPPINGS_FOLDER}/{filename}' for filename in files]
+
+
+def import_file(filename: str) -> List[Mapping]:
+    """Import the mappings in a CSV file."""
+    return [Mapping.from_dict(row) for row in csv_dict_list(filename)]
+
+
+def import_cached(filenames: List[str]) -> Dict[str, List[Mapping]]:
+    """Import mapping files using the parsed mappings in the cache file.
+
+    Files are looked up in the cache by modification time and size and
+    then by a hash of their contents, so files that were only touched
+    are not parsed again. The cache is rewritten when any file had to be
+    parsed. Mappings are cached before they are bound to ports.
+    """
+    path = f'{MAPPINGS_FOLDER}/{CACHE_FILE}'
+    cached = read_cache(path)
+    entries = {}
+    for filename in filenames:
+        stamp = os.stat(filename)
+        key = (stamp.st_mtime_ns, stamp.st_size)
+        entry = cached.get(filename)
+        if entry is None or entry[0] != key:
+            with open(filename, 'rb') as fd:
+                digest = hashlib.sha1(fd.read()).hexdigest()
+            if entry is None or entry[1] != digest:
+                entry = (key, digest, import_file(filename))
+            else:
+                entry = (key, digest, entry[2])
+        entries[filename] = entry
+    if entries != cached:
+        write_cache(path, entries)
+    return {filename: entry[2] for filename, entry in entries.items()}
+
+
+def read_cache(path: str) -> Dict[str, Tuple[Any, str, List[Mapping]]]:
+    """Return cache entries by filename, empty if the cache can't be used."""
+    try:
+        with open(path, 'rb') as fd:
+            cache = pickle.load(fd)
+        if cache['version'] == (CACHE_VERSION, Mapping.__slots__):
+            return cache['files']
+    except Exception:
+        pass
+    return {}
+
+
+def write_cache(
+    path: str, entries: Dict[str, Tuple[Any, str, List[Mapping]]]
+) -> None:
+    """Write cache entries, replacing the cache file in one step."""
+    cache = {'version': (CACHE_VERSION, Mapping.__slots__), 'files': entries}
+    try:
+        with open(f'{path}.tmp', 'wb') as fd:
+            pickle.dump(cache, fd, pickle.HIGHEST_PROTOCOL)
+        os.replace(f'{path}.tmp', path)
+    except OSError as e:
+        print(f'Mapping cache not written: {e}')
+
+
+def row_key(mapping: Mapping) -> Tuple[Any, ...]:
+    """Return the CSV fields of a mapping to compare rows by."""
+    return tuple(getattr(mapping, field) for field in ROW_FIELDS)
+
+
 def csv_dict_list(filename: str) -> List[Dict[str, Any]]:
     """Read mappings CSV file and convert to a dictionary.
 
@@ -43,3 +335,176 @@ def csv_dict_list(filename: str) -> List[Dict[str, Any]]:
         for key in d.keys():
             d[key] = str(d[key]).strip()
     return data
+
+
+def build_index(
+    mappings: List[Mapping]
+) -> Dict[Tuple[str, int, int], Dict[int, List[Mapping]]]:
+    """Compile mappings into a lookup keyed by (type, channel, control).
+
+    Each key holds per-bank buckets so a message is matched with two
+    dictionary lookups regardless of how many mappings are loaded.
+    Rows whose channel, control or bank are not numeric can never match
+    an incoming message and are left out.
+    """
+    index: Dict[Tuple[str, int, int], Dict[int, List[Mapping]]] = {}
+    for mapping in mappings:
+        if (mapping.channel is None or mapping.control is None
+                or mapping.bank is None):
+            continue
+        key = (mapping.type, mapping.channel, mapping.control)
+        index.setdefault(key, {}).setdefault(mapping.bank, []).append(mapping)
+    return index
+
+
+def update_index(
+    index: Dict[Tuple[str, int, int], Dict[int, List[Mapping]]],
+    removed: List[Mapping],
+    added: List[Mapping],
+) -> Dict[Tuple[str, int, int], Dict[int, List[Mapping]]]:
+    """Return a copy of index without removed and with added mappings.
+
+    Only the buckets of keys that change are copied so the index in use
+    is never modified. Added mappings go after the mappings already in
+    their bucket.
+    """
+    index = dict(index)
+    copied = set()
+
+    def bucket(key: Tuple[str, int, int]) -> Dict[int, List[Mapping]]:
+        if key not in copied:
+            copied.add(key)
+            index[key] = {
+                bank: list(rows) for bank, rows in index.get(key, {}).items()}
+        return index[key]
+
+    for mapping in removed:
+        if (mapping.channel is None or mapping.control is None
+                or mapping.bank is None):
+            continue
+        key = (mapping.type, mapping.channel, mapping.control)
+        banks = bucket(key)
+        rows = banks.get(mapping.bank, [])
+        if mapping in rows:
+            rows.remove(mapping)
+        if not rows:
+            banks.pop(mapping.bank, None)
+    for mapping in added:
+        if (mapping.channel is None or mapping.control is None
+                or mapping.bank is None):
+            continue
+        key = (mapping.type, mapping.channel, mapping.control)
+        bucket(key).setdefault(mapping.bank, []).append(mapping)
+    for key in copied:
+        if not index[key]:
+            del index[key]
+    return index
+
+
+def for_device(
+    mappings: List[Mapping], device: str, devices: Collection[str]
+) -> List[Mapping]:
+    """Return mappings that apply to messages from the device input.
+
+    Rows naming an input device that isn't open apply to every input.
+    """
+    return [
+        mapping for mapping in mappings
+        if mapping.input_device == device
+        or mapping.input_device not in devices]
+
+
+def build_device_indexes(
+    mappings: List[Mapping], devices: Collection[str]
+) -> Dict[str, Dict[Tuple[str, int, int], Dict[int, List[Mapping]]]]:
+    """Compile a mapping index for each open input device.
+
+    Messages are tagged with the input port they came from, so looking
+    them up in their device's index stops a control on one controller
+    from triggering rows meant for another.
+    """
+    return {
+        device: build_index(for_device(mappings, device, devices))
+        for device in devices}
+
+
+def update_device_indexes(
+    indexes: Dict[str, Dict[Tuple[str, int, int], Dict[int, List[Mapping]]]],
+    removed: List[Mapping],
+    added: List[Mapping],
+) -> Dict[str, Dict[Tuple[str, int, int], Dict[int, List[Mapping]]]]:
+    """Return copies of device indexes updated like update_index."""
+    return {
+        device: update_index(
+            index,
+            for_device(removed, device, indexes),
+            for_device(added, device, indexes))
+        for device, index in indexes.items()}
+
+
+def build_decoding(
+    mappings: List[Mapping]
+) -> Optional[Tuple[array, array]]:
+    """Return what decoder.Decoder assembles or None if nothing is.
+
+    The first array flags the MSB and LSB controls of 14-bit control
+    changes by channel * 128 + control, the second the channels with
+    NRPN inputs. Both use 0-based channels.
+    """
+    cc14 = array('b', [0]) * 2048
+    nrpn = array('b', [0]) * 16
+    found = False
+    for mapping in mappings:
+        if mapping.channel is None or mapping.control is None:
+            continue
+        channel = (mapping.channel - 1) & 0x0F
+        if mapping.type == 'control_change_14' and mapping.control < 32:
+            cc14[channel * 128 + mapping.control] = 1
+            cc14[channel * 128 + mapping.control + 32] = 1
+            found = True
+        elif mapping.type == 'nrpn':
+            nrpn[channel] = 1
+            found = True
+    return (cc14, nrpn) if found else None
+
+
+def bind_ports(
+    mappings: List[Mapping],
+    outports: Any,
+    unplugged: Collection[str] = (),
+) -> None:
+    """Bind mapping devices to opened output ports by name.
+
+    'output_port' receives translated messages and 'input_port' receives
+    feedback for the controller, such as bank resets. Devices without an
+    open port are bound to all outports so messages still go somewhere,
+    unless they were unplugged, in which case they are bound to UNPLUGGED
+    until their port is opened again.
+    """
+    if outports is None:
+        ports: Dict[str, Any] = {}
+    else:
+        ports = {port.name: port for port in outports.ports}
+    for name in unplugged:
+        ports.setdefault(name, UNPLUGGED)
+    for mapping in mappings:
+        mapping.output_port = ports.get(mapping.output_device, outports)
+        mapping.input_port = ports.get(mapping.input_device, outports)
+
+
+def build_banks(
+    mappings: List[Mapping]
+) -> Tuple[Dict[int, List[Mapping]], List[Mapping]]:
+    """Return the rows to reset per bank and the bank change controls.
+
+    Bank rows are the ones that can be reset on the controller, in the
+    order of their memory slots.
+    """
+    banks: Dict[int, List[Mapping]] = {}
+    controls = []
+    for mapping in mappings:
+        if mapping.o_type is OutputType.MM_BANK_CHANGE:
+            controls.append(mapping)
+        if mapping.bank is not None and mapping.feedback is not None:
+            banks.setdefault(mapping.bank, []).append(mapping)
+    return banks, controls
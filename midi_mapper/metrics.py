@@ -0,0 +1,132 @@
+"""Optional latency instrumentation for the MIDI pipeline.
+
+Call sites check ENABLED before calling into this module so the
+instrumentation costs a single flag lookup when it is switched off.
+"""
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+import threading
+import time
+from collections import deque
+
+
+ENABLED = False
+SAMPLES = 4096
+
+# Stage names in pipeline order, each measured from the previous stage
+STAGES = ('process', 'lookup', 'send')
+
+_local = threading.local()
+
+
+class Histogram:
+    """Latency samples with percentiles computed when reported."""
+
+    __slots__ = ('samples', 'count', 'max')
+
+    def __init__(self) -> None:
+        self.samples: deque = deque(maxlen=SAMPLES)
+        self.count = 0
+        self.max = 0.0
+
+    def record(self, value: float) -> None:
+        self.samples.append(value)
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+    def summary(self) -> Dict[str, float]:
+        """Return p50/p99/max in milliseconds and the sample count."""
+        samples = sorted(self.samples)
+        if not samples:
+            return {'count': 0, 'p50': 0.0, 'p99': 0.0, 'max': 0.0}
+        return {
+            'count': self.count,
+            'p50': samples[len(samples) // 2] * 1000,
+            'p99': samples[int(len(samples) * 0.99)] * 1000,
+            'max': self.max * 1000,
+        }
+
+
+histograms: Dict[Tuple[str, Hashable], Histogram] = {}
+
+
+def start(device: str) -> None:
+    """Timestamp a message arriving from device on this thread."""
+    _local.device = device
+    _local.start = _local.last = time.perf_counter()
+
+
+def context() -> Optional[Tuple[str, float]]:
+    """Return the device and start time of this thread's message, if any.
+
+    Pass it to resume to carry on timing the message on another thread.
+    """
+    if getattr(_local, 'last', None) is None:
+        return None
+    return _local.device, _local.start
+
+
+def resume(started: Optional[Tuple[str, float]]) -> None:
+    """Time the message started on another thread on this one.
+
+    The first mark includes the time taken to hand the message over."""
+    if started is None:
+        _local.last = None
+    else:
+        _local.device, _local.start = started
+        _local.last = _local.start
+
+
+def mark(stage: str, key: Hashable = None) -> None:
+    """Record time since the previous mark of the current message.
+
+    Samples are grouped by the input device unless a key such as a
+    mapping is given. The 'send' stage also records the total time from
+    input per device.
+    """
+    last = getattr(_local, 'last', None)
+    if last is None:
+        return
+    now = time.perf_counter()
+    device = _local.device
+    _record(stage, device if key is None else key, now - last)
+    if stage == 'send':
+        _record('total', device, now - _local.start)
+    _local.last = now
+
+
+def _record(stage: str, key: Hashable, value: float) -> None:
+    histogram = histograms.get((stage, key))
+    if histogram is None:
+        histogram = histograms.setdefault((stage, key), Histogram())
+    histogram.record(value)
+
+
+def report() -> List[str]:
+    """Return a line per histogram with latencies in milliseconds."""
+    order = {stage: i for i, stage in enumerate(STAGES + ('total',))}
+    lines = []
+    items = sorted(
+        histograms.items(),
+        key=lambda x: (order.get(x[0][0], 0), label(x[0][1])))
+    for (stage, key), histogram in items:
+        s = histogram.summary()
+        lines.append(
+            '{:7.7} | {:40.40} | n={:<7} p50={:.3f} p99={:.3f} '
+            'max={:.3f}'.format(
+                stage, label(key), s['count'], s['p50'], s['p99'], s['max']))
+    return lines
+
+
+def label(key: Any) -> str:
+    """Return a readable name for a device or mapping key."""
+    if isinstance(key, str):
+        return key
+    return '{} / {} => {}'.format(
+        key.input_device, key.description, key.o_description)
+
+
+def reset() -> None:
+    """Forget all recorded samples."""
+    histograms.clear()
@@ -0,0 +1,130 @@
+"""Open and close MIDI ports as devices are plugged in and out."""
+from typing import Any, Callable, List, Optional
+
+import threading
+import time
+
+import mido  # type: ignore
+from mido.ports import MultiPort  # type: ignore
+
+from .logger import INFO
+from .logger import QUIET
+from .logger import sink
+from .state import state
+from .store import ports_by_name
+from .store import store
+from .stream import set_bank
+from .utils import VIRTUAL_PORT
+from .utils import forget_port
+from .utils import open_input
+from .utils import output_port
+from .utils import port_names
+
+
+class PortMonitor:
+    """Poll the port lists and reconnect devices that come and go.
+
+    Only ports whose name appeared or disappeared since the last poll are
+    opened or closed, every other port is left as it is. The changed
+    port lists are swapped into the store, which rebinds mappings to the
+    new handles, and the active bank is sent to reconnected controllers.
+    Rows of unplugged devices are bound to nothing until they are back.
+    Ports are opened and closed on the monitor thread so the MIDI flow
+    is never held up. A port that fails to open is tried again on the
+    next poll.
+    """
+
+    def __init__(
+        self,
+        midi_stream: Any,
+        raw: bool = False,
+        workers: Optional[str] = None,
+        queue_size: int = 64,
+        interval: float = 1.0,
+    ) -> None:
+        self.midi_stream = midi_stream
+        self.raw = raw
+        self.workers = workers
+        self.queue_size = queue_size
+        self.interval = interval
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Poll for changes on a background thread."""
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name='port-monitor', daemon=True)
+            self._thread.start()
+
+    def poll(self) -> bool:
+        """Open new ports and close gone ones, return True if any changed."""
+        try:
+            input_names, output_names = port_names()
+        except Exception as e:
+            sink.emit(QUIET, None, 'ERROR: {}', e)
+            return False
+        inputs = ports_by_name(store.get('inports'))
+        outputs = ports_by_name(store.get('outports'))
+        gone_inputs = [
+            inputs.pop(name) for name in list(inputs)
+            if name not in input_names]
+        gone_outputs = [
+            outputs.pop(name) for name in list(outputs)
+            if name not in output_names and name != VIRTUAL_PORT]
+        new_inputs = self._open(
+            [name for name in input_names if name not in inputs],
+            lambda name: open_input(name, self.midi_stream, self.raw))
+        new_outputs = self._open(
+            [name for name in output_names if name not in outputs],
+            lambda name: output_port(
+                mido.open_output(name), self.workers, self.queue_size))
+        if not (gone_inputs or gone_outputs or new_inputs or new_outputs):
+            return False
+
+        if gone_inputs or new_inputs:
+            store.update(
+                'inports', MultiPort(list(inputs.values()) + new_inputs))
+        if gone_outputs or new_outputs:
+            # rows of unplugged devices send nothing until they are back
+            unplugged = store.get('unplugged').union(
+                p.name for p in gone_outputs)
+            store.update('unplugged', unplugged.difference(
+                p.name for p in new_outputs))
+            store.update(
+                'outports', MultiPort(list(outputs.values()) + new_outputs))
+        for port in gone_inputs + gone_outputs:
+            self._close(port)
+        if new_outputs:
+            set_bank(store.get('active_bank'), initial=True, ports=new_outputs)
+        sink.emit(
+            INFO, None, 'Ports changed: {} connected, {} disconnected',
+            ', '.join(p.name for p in new_inputs + new_outputs) or '-',
+            ', '.join(p.name for p in gone_inputs + gone_outputs) or '-')
+        return True
+
+    def _open(
+        self, names: List[str], opener: Callable[[str], Any]
+    ) -> List[Any]:
+        ports = []
+        for name in names:
+            try:
+                ports.append(opener(name))
+            except Exception as e:
+                sink.emit(QUIET, None, 'ERROR: {} not opened: {}', name, e)
+        return ports
+
+    def _close(self, port: Any) -> None:
+        forget_port(port)
+        state.forget(port)
+        try:
+            port.close()
+        except Exception as e:  # pragma: no cover
+            sink.emit(QUIET, None, 'ERROR: {} not closed: {}', port.name, e)
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.poll()
+            except Exception as e:  # pragma: no cover
+                sink.emit(QUIET, None, 'ERROR: {}', e)
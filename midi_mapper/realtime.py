@@ -0,0 +1,91 @@
+"""Forward MIDI clock and transport from one input to chosen outputs."""
+from typing import Any, Callable, Dict, List, Optional
+
+import time
+
+from .metrics import Histogram
+from .store import store
+from .workers import PortWorker
+
+
+# Clock, start, continue and stop status bytes and their raw messages
+LANE_MESSAGES = {status: bytes([status]) for status in (
+    0xF8, 0xFA, 0xFB, 0xFC)}
+CLOCK = 0xF8
+
+
+class RealTimeLane:
+    """Pass clock, start, continue and stop from 'source' to 'outputs'.
+
+    Messages are written as soon as they arrive on the source's callback
+    thread, without going through the mapping lookup, the pipeline, the
+    scheduler, port workers or the log. They only wait for a write to
+    the same port already in progress, see utils.write_now. Outputs are
+    looked up by name in the store's outports when they change, every
+    outport if 'outputs' is empty.
+
+    'latency' records the time taken to forward each message and
+    'jitter' how much each clock interval, as sent, differs from the one
+    before it.
+    """
+
+    def __init__(self, write: Callable[[Any, bytes], None]) -> None:
+        self.source: Optional[str] = None
+        self.outputs: List[str] = []
+        self.forwarded = 0
+        self.latency = Histogram()
+        self.jitter = Histogram()
+        self._write = write
+        self._outports: Any = None
+        self._targets: List[Any] = []
+        self._last_tick = 0.0
+        self._last_interval = 0.0
+
+    def configure(self, source: str, outputs: str = '') -> None:
+        """Forward from the input named source to comma separated outputs.
+
+        An empty source turns the lane off."""
+        self.source = source or None
+        self.outputs = [name.strip() for name in outputs.split(',')
+                        if name.strip()]
+        self._outports = None
+
+    def stats(self) -> Dict[str, Any]:
+        """Return forwarded messages with latency and jitter in ms."""
+        return {
+            'forwarded': self.forwarded,
+            'latency': self.latency.summary(),
+            'jitter': self.jitter.summary(),
+        }
+
+    def forward(self, status: int) -> None:
+        """Write the real-time message with status to the outputs."""
+        start = time.perf_counter()
+        outports = store.get('outports')
+        if outports is not self._outports:
+            self._bind(outports)
+        data = LANE_MESSAGES[status]
+        for port in self._targets:
+            self._write(port, data)
+        sent = time.perf_counter()
+        self.forwarded += 1
+        self.latency.record(sent - start)
+        if status != CLOCK:
+            # transport changes restart the clock
+            self._last_tick = self._last_interval = 0.0
+            return
+        if self._last_tick:
+            interval = sent - self._last_tick
+            if self._last_interval:
+                self.jitter.record(abs(interval - self._last_interval))
+            self._last_interval = interval
+        self._last_tick = sent
+
+    def _bind(self, outports: Any) -> None:
+        """Find the output ports, bypassing their worker queues."""
+        self._outports = outports
+        ports = [] if outports is None else outports.ports
+        self._targets = [
+            port.port if isinstance(port, PortWorker) else port
+            for port in ports
+            if not self.outputs or port.name in self.outputs]
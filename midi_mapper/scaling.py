@@ -0,0 +1,54 @@
+"""Lookup tables scaling input levels to output ranges."""
+from typing import Callable, Dict, Optional, Tuple
+
+import math
+from functools import lru_cache
+
+
+# Response curves map a normalised input 0-1 to a normalised output 0-1
+CURVES: Dict[str, Callable[[float], float]] = {
+    'linear': lambda x: x,
+    'invert': lambda x: 1 - x,
+    'log': lambda x: math.log10(1 + 9 * x),
+    'exp': lambda x: (10 ** x - 1) / 9,
+}
+
+# Highest input level by number of input bits
+INPUT_MAX = {7: 127, 14: 16383}
+
+
+@lru_cache(maxsize=None)
+def build_table(
+    range_: Optional[Tuple[int, int]],
+    curve: str = 'linear',
+    bits: int = 7,
+    offset: int = 0,
+) -> Tuple[int, ...]:
+    """Return the output level for every input level.
+
+    Tables are shared between mappings with the same arguments. 14-bit
+    inputs are indexed from 0 so pitchwheel levels need 8192 added.
+    Without a range a linear table passes levels through unchanged,
+    pitchwheel levels included. offset is added to every output level.
+    The linear curve matches stream.calculate_range.
+    """
+    in_max = INPUT_MAX[bits]
+    in_offset = 8192 if bits == 14 else 0
+    function = CURVES.get(curve, CURVES['linear'])
+
+    if range_ is None:
+        if function is CURVES['linear']:
+            return tuple(
+                level - in_offset + offset for level in range(in_max + 1))
+        range_ = (0, in_max)
+    low, high = range_
+
+    if function is CURVES['linear']:
+        levels = (
+            int(level * ((high - low) / in_max) + low)
+            for level in range(in_max + 1))
+    else:
+        levels = (
+            int(round(low + (high - low) * function(level / in_max)))
+            for level in range(in_max + 1))
+    return tuple(level + offset for level in levels)
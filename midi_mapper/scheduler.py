@@ -0,0 +1,177 @@
+"""Coalesce and rate limit continuous output values per port."""
+from typing import Any, Callable, Dict, Hashable, Optional
+
+import threading
+import time
+
+
+class Scheduler:
+    """Send continuous values to each port at most 'rate' times a second.
+
+    Values are queued per port by a key naming the destination control,
+    such as the output template of a control change. A queued value is
+    replaced by a newer one for the same key, so the latest value always
+    gets sent. Pending values are flushed together as one write, right
+    away if the port's interval has passed or otherwise by a background
+    thread when it has.
+
+    Messages that must keep their order, like notes and program changes,
+    go through write() which flushes the port's pending values first.
+    Values are either raw bytes or objects turned into bytes by encode
+    when flushed. Ports with a rate of 0 are not limited and 'enabled'
+    is only set once configure() has set a rate.
+
+    Setting 'wake' replaces the background thread with the caller's own
+    timer: wake is called when a port has values waiting for its interval
+    and the caller calls flush_due() at the time it returns.
+    """
+
+    def __init__(
+        self,
+        write: Callable[[Any, bytes], None],
+        encode: Callable[[Any, Any], bytes],
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.enabled = False
+        self.rate = 0.0
+        self.rates: Dict[str, float] = {}
+        self.pending: Dict[Any, Dict[Hashable, Any]] = {}
+        self.coalesced = 0
+        self.flushes = 0
+        self._write = write
+        self._encode = encode
+        self._clock = clock
+        self._intervals: Dict[Any, float] = {}
+        self._last: Dict[Any, float] = {}
+        self._due: Dict[Any, float] = {}
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self.wake: Optional[Callable[[], Any]] = None
+
+    def configure(self, spec: str) -> None:
+        """Set rates from a spec like '100' or '100,Volca=30'.
+
+        A bare number is the default rate for every port, 'name=rate'
+        entries set the rate of the port with that name.
+        """
+        rate, rates = 0.0, {}
+        for entry in filter(None, (e.strip() for e in spec.split(','))):
+            name, _, value = entry.rpartition('=')
+            if name:
+                rates[name] = float(value)
+            else:
+                rate = float(value)
+        with self._cond:
+            self.rate, self.rates = rate, rates
+            self.enabled = bool(rate or rates)
+            self._intervals = {}
+
+    def stats(self) -> Dict[str, int]:
+        """Return coalesced values, flushes and values still pending."""
+        return {
+            'coalesced': self.coalesced,
+            'flushes': self.flushes,
+            'pending': sum(len(p) for p in list(self.pending.values())),
+        }
+
+    def interval(self, port: Any) -> float:
+        """Return the minimum time between writes to port."""
+        interval = self._intervals.get(port)
+        if interval is None:
+            rate = self.rates.get(getattr(port, 'name', ''), self.rate)
+            interval = 1 / rate if rate > 0 else 0.0
+            self._intervals[port] = interval
+        return interval
+
+    def send(self, port: Any, key: Hashable, value: Any) -> None:
+        """Queue value for the control named key and flush when due."""
+        interval = self.interval(port)
+        with self._cond:
+            pending = self.pending.get(port)
+            if pending is None:
+                pending = self.pending[port] = {}
+            if key in pending:
+                self.coalesced += 1
+            pending[key] = value
+            if port in self._due:
+                return
+            now = self._clock()
+            due = self._last.get(port, -interval) + interval
+            if now >= due:
+                self._flush(port, now)
+                return
+            self._due[port] = due
+            if self.wake is not None:
+                self.wake()
+                return
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='output-scheduler', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def write(self, port: Any, data: bytes) -> None:
+        """Write data after flushing values pending for port."""
+        with self._cond:
+            self._due.pop(port, None)
+            self._flush(port, self._clock())
+            self._write(port, data)
+
+    def flush(self, port: Any = None) -> None:
+        """Flush values pending for port, or for every port if None."""
+        with self._cond:
+            for p in list(self.pending) if port is None else [port]:
+                self._due.pop(p, None)
+                self._flush(p, self._clock())
+
+    def forget(self, port: Any) -> None:
+        """Drop values pending for port and its rate, e.g. once closed."""
+        with self._cond:
+            self.pending.pop(port, None)
+            self._due.pop(port, None)
+            self._last.pop(port, None)
+            self._intervals.pop(port, None)
+
+    def flush_due(self) -> Optional[float]:
+        """Flush ports whose interval has passed.
+
+        Return the time until the next port is due or None if no values
+        are waiting.
+        """
+        with self._cond:
+            now = self._clock()
+            for port, due in list(self._due.items()):
+                if due <= now:
+                    del self._due[port]
+                    self._flush(port, now)
+            if not self._due:
+                return None
+            return min(self._due.values()) - now
+
+    def _flush(self, port: Any, now: float) -> None:
+        pending = self.pending.pop(port, None)
+        if not pending:
+            return
+        data = b''.join(
+            value if isinstance(value, bytes) else self._encode(port, value)
+            for value in pending.values())
+        self._last[port] = now
+        self.flushes += 1
+        self._write(port, data)
+
+    def _run(self) -> None:
+        with self._cond:
+            while True:
+                if not self._due:
+                    self._cond.wait()
+                    continue
+                port = min(self._due, key=self._due.__getitem__)
+                delay = self._due[port] - self._clock()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                del self._due[port]
+                try:
+                    self._flush(port, self._clock())
+                except Exception as e:  # pragma: no cover
+                    print(f'ERROR: {e}')
@@ -0,0 +1,181 @@
+"""Handle groups of input ports in separate processes."""
+from typing import Any, Collection, List, Optional, Set
+
+import multiprocessing
+import signal
+
+from . import stream
+from .constants import OutputType
+from .engine import FastPipeline
+from .logger import INFO
+from .logger import sink
+from .mappings import Mapping
+from .mappings import import_mappings
+from .store import store
+from .utils import VIRTUAL_PORT
+from .utils import port_names
+from .utils import set_io_ports
+
+
+class Shards:
+    """Run input ports in shard processes so each gets its own core.
+
+    Input ports are dealt out to count shards. Each shard opens its own
+    inputs and every output, and translates with the fast pipeline
+    using only the mappings for its inputs. Only the first shard creates
+    the virtual output port, so it handles every device with rows that
+    send to it.
+
+    Bank and program changes are not applied by the shard that receives
+    them. They are sent over a pipe to this process, which relays them
+    to every shard, including the sender, in one order. All shards apply
+    the same changes in the same order, so they never disagree about
+    the active bank, and each shard resets the controls of its own
+    controllers. A bank is valid if any mapping changes to it, so shards
+    without bank controls of their own follow the others.
+    """
+
+    def __init__(
+        self,
+        count: int,
+        raw: bool = False,
+        workers: Optional[str] = None,
+        queue_size: int = 64,
+        cache: bool = True,
+    ) -> None:
+        self.count = count
+        self.raw = raw
+        self.workers = workers
+        self.queue_size = queue_size
+        self.cache = cache
+        self.active_bank = 1
+        self.relayed = 0
+        self.processes: List[Any] = []
+        self.context = multiprocessing.get_context('spawn')
+        self.changes = self.context.SimpleQueue()
+        self.events: List[Any] = []
+
+    def start(self) -> None:
+        """Start a process for each group of input ports."""
+        inputs, _ = port_names()
+        virtual = {
+            mapping.input_device for mapping in import_mappings(self.cache)
+            if mapping.output_device == VIRTUAL_PORT}
+        groups = split(inputs, self.count, virtual)
+        for index, devices in enumerate(groups):
+            events = self.context.SimpleQueue()
+            process = self.context.Process(
+                target=run_shard,
+                name=f'shard-{index}',
+                args=(index, devices, inputs, self.changes, events,
+                      self.raw, self.workers, self.queue_size, self.cache),
+                daemon=True)
+            process.start()
+            self.events.append(events)
+            self.processes.append(process)
+        print('shards ready: {}'.format(' | '.join(
+            f'{process.name} {devices}'
+            for process, devices in zip(self.processes, groups))))
+
+    def relay(self, o_type: OutputType, value: int) -> None:
+        """Send a bank or program change to every shard."""
+        if o_type is OutputType.MM_BANK_CHANGE:
+            self.active_bank = value
+        self.relayed += 1
+        for events in self.events:
+            events.put((o_type, value))
+
+    def relay_changes(self) -> None:  # pragma: no cover
+        """Relay changes sent by shards forever."""
+        while True:
+            self.relay(*self.changes.get())
+
+    def run(self) -> None:  # pragma: no cover
+        """Start the shards and relay changes between them."""
+        self.start()
+        self.relay_changes()
+
+
+def split(
+    names: List[str], count: int, first: Collection[str] = ()
+) -> List[List[str]]:
+    """Deal names out to at most count groups, leaving out empty ones.
+
+    Names in first all go to the first group."""
+    rest = [name for name in names if name not in first]
+    groups = [rest[i::count] for i in range(count)]
+    groups[0] = [name for name in names if name in first] + groups[0]
+    return [group for group in groups if group]
+
+
+def shard_mappings(
+    mappings: List[Mapping],
+    devices: Collection[str],
+    inputs: Collection[str],
+    first: bool,
+) -> List[Mapping]:
+    """Return the mappings of a shard handling devices.
+
+    Rows for devices that aren't open only go to the first shard, so
+    their bank and program changes aren't made once per shard. They only
+    match the inputs of the first shard. Rows sending to the virtual
+    port only go to the first shard, which is the only one that has it,
+    instead of falling back to every output.
+    """
+    return [
+        mapping for mapping in mappings
+        if (mapping.input_device in devices
+            or first and mapping.input_device not in inputs)
+        and (first or mapping.output_device != VIRTUAL_PORT)]
+
+
+def bank_numbers(mappings: List[Mapping]) -> Set[int]:
+    """Return the banks the bank change mappings switch to."""
+    return {
+        mapping.o_control for mapping in mappings
+        if mapping.o_type is OutputType.MM_BANK_CHANGE
+        and mapping.o_control is not None}
+
+
+def run_shard(
+    index: int,
+    devices: List[str],
+    inputs: List[str],
+    changes: Any,
+    events: Any,
+    raw: bool,
+    workers: Optional[str],
+    queue_size: int,
+    cache: bool,
+) -> None:  # pragma: no cover
+    """Translate messages from devices and apply relayed changes.
+
+    Runs in the shard process, interrupts are handled by the main
+    process which stops the shards when it exits.
+    """
+    from .app import configure
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    configure()
+    mappings = import_mappings(cache)
+    banks = bank_numbers(mappings)
+    mappings = shard_mappings(mappings, devices, inputs, index == 0)
+    store.update('mappings', mappings)
+    stream.broadcast = lambda o_type, value: changes.put((o_type, value))
+    set_io_ports(
+        FastPipeline(), raw, workers, queue_size,
+        devices=devices, virtual=index == 0)
+    stream.set_bank(1, initial=True, banks=banks)
+    sink.emit(INFO, None, 'shard-{}: {} mappings', index, len(mappings))
+    apply_changes(events, banks)
+
+
+def apply_changes(
+    events: Any, banks: Optional[Collection[int]] = None
+) -> None:  # pragma: no cover
+    """Apply bank and program changes relayed to a shard forever.
+
+    banks are the banks of every shard's mappings."""
+    while True:
+        o_type, value = events.get()
+        stream.apply_change(o_type, value, banks)
@@ -0,0 +1,151 @@
+"""Mutable state updated for every message from the callback threads."""
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional
+
+import queue
+import threading
+from array import array
+
+
+class State:
+    """Active bank and per-bank memory that can be updated in place.
+
+    Memory for each bank is a compact array indexed by the slot of each
+    mapping in its bank. Updates take a lock, reads don't need one as
+    values and arrays are only ever replaced whole. Bank switches and
+    reloads never copy the rest of the state. Subscribers are notified
+    of changes on a separate thread.
+
+    'shown' tracks the level each controller port is showing for every
+    channel and control, -1 when unknown, so resets can skip controls
+    that already show the right value.
+    """
+
+    def __init__(self) -> None:
+        self.active_bank = 0
+        self.memory: Dict[Hashable, array] = {}
+        self.shown: Dict[Any, array] = {}
+        self._lock = threading.Lock()
+        self._subscribers: List[Callable[[str, Any], None]] = []
+        self._notifications: queue.SimpleQueue = queue.SimpleQueue()
+
+    def load(
+        self,
+        mappings: Iterable[Any],
+        keep: bool = False,
+        removed: Iterable[Any] = (),
+    ) -> None:
+        """Give each mapping a slot in its bank and allocate memory.
+
+        With keep set, mappings that already have a slot keep their memory
+        in their new slot. Removed mappings lose their slot so late
+        updates to them are ignored. Slots and memory are swapped under
+        the lock so updates never land in the wrong slot.
+        """
+        mappings = list(mappings)
+        counts: Dict[Hashable, int] = {}
+        slots = []
+        for mapping in mappings:
+            slot = counts.get(mapping.bank, 0)
+            counts[mapping.bank] = slot + 1
+            slots.append(slot)
+        memory = {bank: array('i', [0]) * n for bank, n in counts.items()}
+        with self._lock:
+            old = self.memory
+            for mapping, slot in zip(mappings, slots):
+                if keep and mapping.slot >= 0:
+                    try:
+                        memory[mapping.bank][slot] = \
+                            old[mapping.bank][mapping.slot]
+                    except (KeyError, IndexError):
+                        pass
+                mapping.slot = slot
+            for mapping in removed:
+                mapping.slot = -1
+            self.memory = memory
+        self._notify('memory', memory)
+
+    def get_memory(self, bank: Hashable, slot: int) -> int:
+        try:
+            return self.memory[bank][slot]
+        except (KeyError, IndexError):
+            return 0
+
+    def set_memory(
+        self, bank: Hashable, slot: int, level: Optional[int]
+    ) -> None:
+        """Remember level in a bank slot, levels of None are stored as 0."""
+        with self._lock:
+            try:
+                self.memory[bank][slot] = level or 0
+            except (KeyError, IndexError):
+                return
+
+    def remember(
+        self, mappings: Iterable[Any], level: Optional[int], shown: bool = True
+    ) -> None:
+        """Remember level for every mapping under a single lock.
+
+        With shown set, mappings with a feedback index also record the
+        level as shown on their controller, since the controller sent it.
+        """
+        level = level or 0
+        with self._lock:
+            memory = self.memory
+            for mapping in mappings:
+                if mapping.slot < 0:
+                    continue
+                try:
+                    memory[mapping.bank][mapping.slot] = level
+                except (KeyError, IndexError):
+                    continue
+                if shown and mapping.feedback_index >= 0:
+                    self.shown_on(mapping.input_port)[
+                        mapping.feedback_index] = level
+
+    def show(self, port: Any, index: int, level: Optional[int]) -> None:
+        """Record level as shown on port at channel * 128 + control."""
+        self.shown_on(port)[index] = level or 0
+
+    def shown_on(self, port: Any) -> array:
+        """Return levels shown on port indexed by channel * 128 + control."""
+        shown = self.shown.get(port)
+        if shown is None:
+            shown = self.shown.setdefault(port, array('h', [-1]) * 2048)
+        return shown
+
+    def forget(self, port: Any = None) -> None:
+        """Forget what port, or every port if None, is showing."""
+        if port is None:
+            self.shown = {}
+        else:
+            self.shown.pop(port, None)
+
+    def set_bank(self, bank: int) -> None:
+        with self._lock:
+            self.active_bank = bank
+        self._notify('active_bank', bank)
+
+    def subscribe(self, on_change: Callable[[str, Any], None]) -> None:
+        """Call on_change(key, value) on the notifier thread."""
+        with self._lock:
+            if not self._subscribers:
+                threading.Thread(
+                    target=self._run, name='state-notifier', daemon=True,
+                ).start()
+            self._subscribers.append(on_change)
+
+    def _notify(self, key: str, value: Any) -> None:
+        if self._subscribers:
+            self._notifications.put((key, value))
+
+    def _run(self) -> None:
+        while True:
+            key, value = self._notifications.get()
+            for on_change in list(self._subscribers):
+                try:
+                    on_change(key, value)
+                except Exception as e:  # pragma: no cover
+                    print(f'ERROR: {e}')
+
+
+state = State()
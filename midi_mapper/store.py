@@ -1,25 +1,124 @@
-"""Store used for holding state and globals that don't change."""
-from typing import Any
+"""Store used for holding state and globals that don't change often."""
+from typing import Any, Dict, List
 
-from rx.subject import BehaviorSubject  # type: ignore
+from .mappings import Mapping
+from .mappings import bind_ports
+from .mappings import build_banks
+from .mappings import build_decoding
+from .mappings import build_device_indexes
+from .mappings import build_index
+from .mappings import update_device_indexes
+from .mappings import update_index
+from .state import state
 
 
-class Store(BehaviorSubject):
-    """Simple immutable store."""
+class Store:
+    """Simple immutable store.
+
+    'value' is replaced by a new dictionary on every update, never
+    changed in place, so readers always see a consistent set of values.
+    The active bank changes too often to copy the store for it and is
+    kept in the mutable state instead, under the same key.
+    """
+
+    def __init__(self, value: Dict[str, Any]) -> None:
+        self.value = value
+
+    def on_next(self, value: Dict[str, Any]) -> None:
+        """Replace the stored values."""
+        self.value = value
 
     def get(self, key: str) -> Any:
         """Short method to get values from the store."""
+        if key == 'active_bank':
+            return state.active_bank
         return self.value[key]
 
     def update(self, key: str, value: Any) -> None:
-        """Immutable way to update the store."""
-        if key in self.value:
-            self.on_next({**self.value, **dict({key: value})})
+        """Immutable way to update the store.
+
+        Updating mappings also rebuilds the mapping index and bank
+        resets in the same step so readers never see them out of step.
+        Mappings are bound to output ports whenever mappings or outports
+        change and get fresh memory in the state, and output ports are
+        also kept by name. Devices named in 'unplugged' are bound to
+        nothing, see mappings.bind_ports, so it is updated before the
+        outports. Per input device indexes are rebuilt whenever mappings
+        or inports change and the controls to decode whenever mappings do.
+        """
+        if key == 'active_bank':
+            state.set_bank(value)
+        elif key in self.value:
+            values = {key: value}
+            if key == 'mappings':
+                state.load(value)
+                bind_ports(
+                    value, self.value['outports'], self.value['unplugged'])
+                values['index'] = build_index(value)
+                values['banks'], values['bank_controls'] = build_banks(value)
+                values['device_index'] = build_device_indexes(
+                    value, self.value['device_index'])
+                values['decoding'] = build_decoding(value)
+            elif key == 'outports':
+                bind_ports(
+                    self.value['mappings'], value, self.value['unplugged'])
+                values['ports_by_name'] = ports_by_name(value)
+            elif key == 'inports':
+                values['device_index'] = build_device_indexes(
+                    self.value['mappings'], port_names(value))
+            self.on_next({**self.value, **values})
+
+    def reload_mappings(
+        self,
+        mappings: List[Mapping],
+        removed: List[Mapping],
+        added: List[Mapping],
+    ) -> None:
+        """Swap in mappings after rows were removed and added.
+
+        Mappings still loaded keep their memory. Only added mappings are
+        bound to ports and only the index buckets of changed rows are
+        rebuilt.
+        """
+        state.load(mappings, keep=True, removed=removed)
+        bind_ports(added, self.value['outports'], self.value['unplugged'])
+        banks, bank_controls = build_banks(mappings)
+        self.on_next({
+            **self.value,
+            'mappings': mappings,
+            'index': update_index(self.value['index'], removed, added),
+            'device_index': update_device_indexes(
+                self.value['device_index'], removed, added),
+            'decoding': build_decoding(mappings),
+            'banks': banks,
+            'bank_controls': bank_controls,
+        })
+
+
+def ports_by_name(ports: Any) -> Dict[str, Any]:
+    """Return the ports in a MultiPort, if any, by name."""
+    if ports is None:
+        return {}
+    return {port.name: port for port in ports.ports}
+
+
+def port_names(ports: Any) -> List[str]:
+    """Return the names of the ports in a MultiPort, if any."""
+    if ports is None:
+        return []
+    return [port.name for port in ports.ports]
 
 
 store = Store({
-    'active_bank': 0,
     'mappings': [],
+    'index': {},
+    'device_index': {},
+    'decoding': None,
+    'banks': {},
+    'bank_controls': [],
     'inports': None,
     'outports': None,
+    'ports_by_name': {},
+    # names of output devices unplugged since they were opened
+    'unplugged': frozenset(),
 })
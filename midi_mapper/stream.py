@@ -1,15 +1,36 @@
 """Functions used in the main appplication streams."""
-from typing import Any, Dict, List
+from typing import TYPE_CHECKING, Any, Callable, Collection, Dict, List
+from typing import Optional, Tuple
 
-from mido import Message  # type: ignore
-
-from .constants import REAL_TIME_MESSAGES
+from .constants import MAPPER_TYPES
+from .constants import OutputType
+from .constants import REAL_TIME_TYPES
 from .constants import STANDARD_MESSAGES
+from .logger import INFO
+from .logger import sink
+from .mappings import Mapping
+from .state import state
 from .store import store
+from .utils import send_buffers
 from .utils import send_message
+from .utils import send_messages
+from .utils import send_template
+
+if TYPE_CHECKING:  # pragma: no cover
+    from mido import Message  # type: ignore
+
+
+# Only reset controls that don't already show their memory value
+DELTA_RESETS = True
+
+# Called with bank and program changes from mappings instead of applying
+# them, shards use it to apply them in every process in the same order
+broadcast: Optional[Callable[[OutputType, int], None]] = None
+
+LOG_FORMAT = '[{}] | {:12.12} | {:10.10} | => | {:12.12} | {:25.25} | {:>3}'
 
 
-def process_midi(midi: Message) -> Dict[str, Any]:
+def process_midi(midi: 'Message') -> Dict[str, Any]:
     """Process incoming message."""
     try:
         channel = midi.channel + 1
@@ -27,169 +48,234 @@ def process_midi(midi: Message) -> Dict[str, Any]:
     }
 
 
-def get_translations(data: Dict[str, Any]) -> List[Dict[str, Any]]:
+def get_translations(data: Dict[str, Any]) -> List[Mapping]:
     """Check incoming message for matches in mappings."""
+    key = (data['type'], data['channel'], data['status'])
+    return lookup(key, data['level'], data.get('device'))
 
-    def set_memory(mapping):
-        mapping['memory'] = data['level']
-        return mapping
-
-    def check(mapping):
-        return (
-            mapping['type'] == data['type']
-            and int(mapping['channel']) == data['channel']
-            and int(mapping['control']) == data['status']
-            and (
-                int(mapping['bank']) == 0
-                or int(mapping['bank']) == store.get('active_bank')
-            )
-        )
 
-    mappings = store.get('mappings')
-    return [set_memory(m) for m in mappings if check(m)]
+def lookup(
+    key: Tuple[str, int, Optional[int]],
+    level: Optional[int],
+    device: Optional[str] = None,
+) -> List[Mapping]:
+    """Return mappings matching key and remember level in them.
+
+    Matches come from the mapping index: bank 0 mappings always apply,
+    mappings in other banks only when their bank is active. Messages
+    from a known input device only match that device's index, and its
+    control changes are recorded as shown on the device whether they
+    match or not.
+    """
+    index = store.get('index')
+    if device is not None:
+        index = store.get('device_index').get(device, index)
+        if key[0] == 'control_change' and key[1] is not None:
+            port = store.get('ports_by_name').get(
+                device, store.get('outports'))
+            state.show(port, (key[1] - 1) * 128 + (key[2] or 0), level)
+    banks = index.get(key)
+    if banks is None:
+        return []
 
+    active_bank = store.get('active_bank')
+    matches = banks.get(0, [])
+    if active_bank != 0 and active_bank in banks:
+        matches = matches + banks[active_bank]
 
-def translate_and_send(translation: Dict[str, Any]) -> Dict[str, Any]:
+    state.remember(matches, level, shown=device is None)
+    return matches
+
+
+def translate_and_send(translation: Mapping) -> Mapping:
     """Translate messages and send."""
-    if translation['o-type'].startswith('mm_'):
+    if translation.o_type in MAPPER_TYPES:
         process_mapper_types(translation)
-    elif translation['o-type'] in REAL_TIME_MESSAGES:
+    elif translation.o_type in REAL_TIME_TYPES:
         process_real_time_types(translation)
-    else:
+    elif translation.o_type is not None:
         process_standard_types(translation)
     return translation
 
 
-def log(translation: Dict[str, Any]) -> None:
-    """Log messages to console."""
-    formatter = '[{}] | {:12.12} | {:10.10} | => | {:12.12} | {:25.25} | {:>3}'
-    print(formatter.format(
+def log(translation: Mapping) -> None:
+    """Log messages to console.
+
+    Formatting and printing happen on the log sink's writer thread.
+    """
+    sink.emit(
+        INFO,
+        translation,
+        LOG_FORMAT,
         store.get('active_bank'),
-        translation['input-device'],
-        translation['description'],
-        translation['output-device'],
-        translation['o-description'],
-        translation['o-level'],
-    ))
-
-
-def process_standard_types(translation: Dict[str, Any]) -> None:
-    """Process standard type messages."""
-    level = calculate_range(translation['o-range'], translation['memory'])
-    send_message({
-        'type': translation['o-type'],
-        'channel': int(translation['o-channel']) - 1,
-        'status': translation['o-control'],
-        'level': level,
-        'port': translation['output-device'],
-    })
-    translation['o-level'] = level
+        translation.input_device,
+        translation.description,
+        translation.output_device,
+        translation.o_description,
+        translation.o_level,
+    )
+
+
+def process_standard_types(translation: Mapping) -> None:
+    """Process standard type messages.
+
+    Levels are scaled through the mapping's table and sent with its
+    output template. NRPN outputs are sent as NRPN messages.
+    """
+    level = translation.memory
+    if level is not None:
+        level = translation.scale[level + translation.offset]
+
+    if translation.template is not None:
+        # inputs without a level, such as program changes, send 0
+        send_template(translation, level or 0)
+    elif translation.nrpn is not None:
+        send_message({
+            'type': 'control_change',
+            'channel': to_midi_channel(translation.o_channel),
+            'status': translation.nrpn,
+            'level': level,
+            'port': translation.output_port,
+            'bits': translation.bits,
+        })
+    translation.o_level = level
 
 
-def process_real_time_types(translation: Dict[str, Any]) -> None:
+def process_real_time_types(translation: Mapping) -> None:
     """Process real time messages."""
-    send_message({
-        'type': translation['o-type'],
-        'channel': None,
-        'status': None,
-        'level': None,
-        'port': translation['output-device'],
-    })
+    send_template(translation, 0)
 
 
-def process_mapper_types(translation: Dict[str, Any]) -> None:
+def process_mapper_types(translation: Mapping) -> None:
     """Process midi mapper special type messages.
 
     These are:
         mm_bank_change    : where o-control is set to the bank number
         mm_program_change : where o-channel/o-control are set appropriately
     """
-    if translation['o-type'] == 'mm_bank_change':
-        set_bank(int(translation['o-control']))
-    elif translation['o-type'] == 'mm_program_change':
-        set_program(int(translation['o-control']))
+    if translation.o_type is None or translation.o_control is None:
+        return
+    if broadcast is not None:
+        broadcast(translation.o_type, translation.o_control)
+    else:
+        apply_change(translation.o_type, translation.o_control)
+
 
+def apply_change(
+    o_type: OutputType, value: int, banks: Optional[Collection[int]] = None
+) -> None:
+    """Set the bank or program of a bank or program change.
 
-def set_bank(active_bank: int, initial=False) -> None:
+    banks are the banks that can be set, see set_bank."""
+    if o_type is OutputType.MM_BANK_CHANGE:
+        set_bank(value, banks=banks)
+    elif o_type is OutputType.MM_PROGRAM_CHANGE:
+        set_program(value)
+
+
+def set_bank(
+    active_bank: int,
+    initial=False,
+    force=False,
+    ports: Optional[Collection[Any]] = None,
+    banks: Optional[Collection[int]] = None,
+) -> None:
     """Set active bank, turn all bank buttons off and turn on the active bank.
 
-    Reset controls to their memory value.
+    Reset controls to their memory value. Only the rows of the new bank
+    are touched and all messages are sent as one batch per port. Controls
+    already showing their memory value are skipped unless force or
+    initial is set or DELTA_RESETS is off. With ports set only those
+    ports are sent to, e.g. to resync a controller that was plugged back
+    in. banks are the banks that can be set, those of the bank controls
+    by default.
     """
-    mappings = store.get('mappings')
-    controls = [m for m in mappings if 'mm_bank_change' in m['o-type']]
+    controls = store.get('bank_controls')
+    if banks is None:
+        banks = [c.o_control for c in controls]
     # Check if passed bank is valid
-    if not [c for c in controls if (int(c['o-control']) == active_bank)]:
+    if active_bank not in banks:
         return
 
     store.update('active_bank', active_bank)
 
+    buffers: Dict[Any, bytearray] = {}
     for control in controls:
-        channel, status = int(control['channel']) - 1, int(control['control'])
-        if int(control['o-control']) != active_bank:
-            send_message({
-                'type': 'note_off',
-                'channel': channel,
-                'status': status,
-                'level': 0,
-                'port': control['output-device'],
-            })
+        if control.feedback is None:
+            continue
+        channel, status = control.feedback
+        if control.o_control != active_bank:
+            data = bytes([0x80 | channel, status, 0])
         elif initial:
-            send_message({
-                'type': 'note_on',
-                'channel': channel,
-                'status': status,
-                'level': 127,
-                'port': control['output-device'],
-            })
+            data = bytes([0x90 | channel, status, 127])
+        else:
+            continue
+        if ports is not None and control.output_port not in ports:
+            continue
+        buffers.setdefault(control.output_port, bytearray()).extend(data)
 
-    resets = [m for m in mappings if int(m['bank']) == active_bank]
-    for reset in resets:
-        send_message({
-            'type': 'control_change',
-            'channel': int(reset['channel']) - 1,
-            'status': int(reset['control']),
-            'level': int(reset['memory']),
-            'port': reset['input-device'],
-        })
+    force = force or initial or not DELTA_RESETS
+    memory = state.memory.get(active_bank, ())
+    for reset in store.get('banks').get(active_bank, ()):
+        if ports is not None and reset.input_port not in ports:
+            continue
+        channel, status = reset.feedback
+        level = min(memory[reset.slot], 127)
+        shown = state.shown_on(reset.input_port)
+        index = channel * 128 + status
+        if shown[index] == level and not force:
+            continue
+        shown[index] = level
+        buffers.setdefault(reset.input_port, bytearray()).extend(
+            bytes([0xB0 | channel, status, level]))
+    send_buffers(buffers)
 
 
 def set_program(active_program: int) -> None:
-    """Send program_change messaage along with resets and light on."""
+    """Send program_change messaage along with resets and light on.
+
+    All messages are sent as one batch per port."""
     mappings = store.get('mappings')
-    controls = [m for m in mappings if 'mm_program_change' in m['o-type']]
+    controls = [
+        m for m in mappings if m.o_type is OutputType.MM_PROGRAM_CHANGE]
+    msgs: List[Dict[str, Any]] = []
     for control in controls:
-        channel, status = int(control['channel']) - 1, int(control['control'])
-        if int(control['o-control']) != active_program:
-            send_message({
+        channel, status = to_midi_channel(control.channel), control.control
+        if control.o_control != active_program:
+            msgs.append({
                 'type': 'note_off',
                 'channel': channel,
                 'status': status,
                 'level': 0,
-                'port': control['output-device'],
+                'port': control.output_port,
             })
         else:
-            send_message({
+            msgs.append({
                 'type': 'note_on',
                 'channel': channel,
                 'status': status,
                 'level': 127,
-                'port': control['output-device'],
+                'port': control.output_port,
             })
             # Send program_change
-            send_message({
+            msgs.append({
                 'type': 'program_change',
-                'channel': int(control['o-channel']) - 1,
-                'status': int(control['o-control']),
+                'channel': to_midi_channel(control.o_channel),
+                'status': control.o_control,
                 'level': None,
-                'port': control['output-device'],
+                'port': control.output_port,
             })
+    send_messages(msgs)
 
 
-def calculate_range(range_: str, level: int) -> int:
+def calculate_range(range_: Optional[Tuple[int, int]], level: int) -> int:
     """Calculate range and apply to level."""
-    if (range_ is not None and type(range_) == str
-            and len(range_.split('-')) == 2):
-        low, high = range_.split('-')
-        new_level = level * ((int(high) - int(low)) / 127) + int(low)
-        return int(new_level)
+    if range_ is not None:
+        low, high = range_
+        return int(level * ((high - low) / 127) + low)
     return level
+
+
+def to_midi_channel(channel: Optional[int]) -> Optional[int]:
+    """Convert a 1-based mapping channel to a 0-based MIDI channel."""
+    return None if channel is None else channel - 1
@@ -1,21 +1,77 @@
 """Utility functions."""
-from typing import Any, Dict, List
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 import mido  # type: ignore
 from mido.ports import MultiPort  # type: ignore
 from mido import Message
 
-from rx.subject import Subject  # type: ignore
-
+from . import metrics
 from .constants import REAL_TIME_MESSAGES
 from .constants import SYSTEM_COMMON_MESSAGES
+from .logger import DEBUG
+from .logger import sink
+from .mappings import Mapping
+from .realtime import LANE_MESSAGES
+from .realtime import RealTimeLane
+from .scheduler import Scheduler
 from .store import store
+from .workers import PortWorker
+
+
+# Send the NRPN parameter select (CC99/98) with every NRPN message
+NRPN_RESELECT = False
+
+# Ports that are never opened, Raspberry Pi's 'Midi Through' and our own
+BAD_PORT = 'Midi Through'
+VIRTUAL_PORT = 'PythonMidi'
+
+# Message types forwarded by the real-time lane
+LANE_TYPES = frozenset(['clock', 'start', 'continue', 'stop'])
+
+# Input messages logged at DEBUG verbosity
+INPUT_FORMAT = '[in] | {:12.12} | {}'
+
+# Single data bytes for filling in output templates
+DATA_BYTES = [bytes([value]) for value in range(128)]
+
+# Length of a message by its status byte, stray data bytes count as one
+MESSAGE_SIZES = [1] * 128 + [
+    2 if status & 0xF0 in (0xC0, 0xD0) or status in (0xF1, 0xF3)
+    else 1 if status >= 0xF4 or status == 0xF0
+    else 3
+    for status in range(0x80, 0x100)]
+
+# A lock per rtmidi port, so the real-time lane, port workers and input
+# callback threads never write to the same port at once
+port_locks: Dict[Any, threading.Lock] = {}
+
+# Last NRPN parameter sent per (port, channel)
+nrpn_params: Dict[Tuple[int, int], Tuple[int, int]] = {}
 
 
-def input_message(midi: Message, midi_stream: Subject) -> None:
-    """Emit valid messages onto midi_stream."""
+def get_option(name: str, default: str) -> str:
+    """Return the value of a '--name=value' command line option."""
+    prefix = f'--{name}='
+    for arg in sys.argv[1:]:
+        if arg.startswith(prefix):
+            return arg[len(prefix):]
+    return default
+
+
+def input_message(
+    midi: Message, midi_stream: Any, device: Optional[str] = None
+) -> None:
+    """Emit valid messages onto midi_stream as (message, device) pairs.
+
+    midi_stream is an Rx Subject or any object with an on_next method,
+    such as engine.FastPipeline. device names the input port. Messages
+    are logged at DEBUG verbosity."""
     if midi.type in SYSTEM_COMMON_MESSAGES:
         return
     if midi.type in REAL_TIME_MESSAGES:
@@ -24,58 +80,315 @@ def input_message(midi: Message, midi_stream: Subject) -> None:
     if '-v' in sys.argv:  # pragma: no cover
         print('{:35.35}> | {}'.format(100 * '=', midi))
     else:
-        midi_stream.on_next(midi)
+        if sink.verbosity >= DEBUG:
+            sink.emit(DEBUG, None, INPUT_FORMAT, device or '-', midi)
+        midi_stream.on_next((midi, device))
 
 
-def set_io_ports(midi_stream: Subject) -> None:
-    """Create input/output ports and add incoming messages to the stream.
+def input_raw(
+    data: List[int], midi_stream: Any, device: Optional[str] = None
+) -> None:
+    """Pass raw channel messages to midi_stream's on_raw method.
 
-    Create virtual output port.
+    A mido message is only created when printing in debug mode or
+    logging at DEBUG verbosity."""
+    if data[0] >= 0xF0:
+        return
 
-    Ignore Raspberyy Pi's 'Midi Through' port."""
-    BAD_PORT = 'Midi Through'
-    VIRTUAL_PORT = 'PythonMidi'
+    if '-v' in sys.argv:  # pragma: no cover
+        print('{:35.35}> | {}'.format(100 * '=', Message.from_bytes(data)))
+    else:
+        if sink.verbosity >= DEBUG:
+            sink.emit(DEBUG, None, INPUT_FORMAT, device or '-',
+                      Message.from_bytes(data))
+        midi_stream.on_raw(data, device)
 
-    def input_message_passer(midi: Message):  # pragma: no cover
-        """Pass midi_stream to input_message."""
-        input_message(midi, midi_stream)
 
-    input_names = [n for n in mido.get_input_names() if BAD_PORT not in n]
-    output_names = [n for n in mido.get_output_names() if BAD_PORT not in n]
+def set_io_ports(
+    midi_stream: Any,
+    raw: bool = False,
+    workers: Optional[str] = None,
+    queue_size: int = 64,
+    concurrent: bool = False,
+    timings: Optional[Dict[str, float]] = None,
+    devices: Optional[List[str]] = None,
+    virtual: bool = True,
+) -> None:
+    """Create input/output ports and add incoming messages to the stream.
+
+    Create virtual output port. With raw set, inputs pass rtmidi bytes to
+    midi_stream.on_raw instead of creating mido messages. With workers
+    set to a workers.POLICIES policy each output port is written to from
+    its own thread through a queue of queue_size writes. With concurrent
+    set all ports are opened at the same time. The time taken to list
+    and open ports is added to timings under 'enumerate' and 'open'.
+    With devices set only those inputs are opened and the virtual output
+    port is only created with virtual set."""
+    start = time.perf_counter()
+    input_names, output_names = port_names()
+    if devices is not None:
+        input_names = [n for n in input_names if n in devices]
     print(f'input_names: {input_names}')
     print(f'output_names: {output_names}')
-    inports = MultiPort(
-        [mido.open_input(
-            device, callback=input_message_passer) for device in input_names])
-    virtual_port = mido.open_output(VIRTUAL_PORT, virtual=True)
-    outports = MultiPort(
-        [virtual_port] + [mido.open_output(device) for device in output_names])
+    enumerated = time.perf_counter()
+
+    openers: List[Callable[[], Any]] = [
+        partial(open_input, device, midi_stream, raw)
+        for device in input_names]
+    if virtual:
+        openers.append(
+            partial(mido.open_output, VIRTUAL_PORT, virtual=True))
+    openers += [partial(mido.open_output, device) for device in output_names]
+    if concurrent and len(openers) > 1:
+        with ThreadPoolExecutor(len(openers)) as executor:
+            ports = list(executor.map(lambda opener: opener(), openers))
+    else:
+        ports = [opener() for opener in openers]
+    inports = MultiPort(ports[:len(input_names)])
+    outputs = ports[len(input_names):]
+    if timings is not None:
+        timings['enumerate'] = enumerated - start
+        timings['open'] = time.perf_counter() - enumerated
+    outputs = [output_port(port, workers, queue_size) for port in outputs]
+    outports = MultiPort(outputs)
     print('ports ready\n\tin: {}\n\tout: {}'.format(
         len(inports.ports), len(outports.ports)))
     store.update('inports', inports)
     store.update('outports', outports)
 
 
+def port_names() -> Tuple[List[str], List[str]]:
+    """Return the names of the input and output ports that can be opened.
+
+    Raspberry Pi's 'Midi Through' and our own virtual port are left out."""
+    return (
+        [n for n in mido.get_input_names()
+         if BAD_PORT not in n and VIRTUAL_PORT not in n],
+        [n for n in mido.get_output_names()
+         if BAD_PORT not in n and VIRTUAL_PORT not in n],
+    )
+
+
+def open_input(device: str, midi_stream: Any, raw: bool = False) -> Any:
+    """Open the device input port and pass its messages to midi_stream.
+
+    With raw set the port's rtmidi callback passes bytes to input_raw
+    instead of creating mido messages."""
+    if not raw:
+        return mido.open_input(
+            device, callback=input_message_passer(device, midi_stream))
+    port = mido.open_input(device)
+    port._rt.cancel_callback()
+    port._rt.set_callback(input_raw_passer(device, midi_stream))
+    return port
+
+
+def output_port(port: Any, workers: Optional[str], queue_size: int) -> Any:
+    """Return port, or a PortWorker writing to it if workers is set."""
+    if workers is None:
+        return port
+    return PortWorker(port, write_now, workers, queue_size)
+
+
+def input_message_passer(
+    device: str, midi_stream: Any
+) -> Callable[[Message], None]:
+    """Create a callback passing device messages to input_message.
+
+    Clock and transport from the real-time lane's source are forwarded
+    by the lane instead."""
+    forward = device == lane.source
+
+    def passer(midi: Message) -> None:
+        if forward and midi.type in LANE_TYPES:
+            lane.forward(midi.bytes()[0])
+            return
+        if metrics.ENABLED:
+            metrics.start(device)
+        input_message(midi, midi_stream, device)
+
+    return passer
+
+
+def input_raw_passer(
+    device: str, midi_stream: Any
+) -> Callable[[Any, Any], None]:
+    """Create an rtmidi callback passing device bytes to input_raw.
+
+    Clock and transport from the real-time lane's source are forwarded
+    by the lane instead."""
+    forward = device == lane.source
+
+    def passer(event: Any, _: Any) -> None:
+        data = event[0]
+        if forward and data[0] in LANE_MESSAGES:
+            lane.forward(data[0])
+            return
+        if metrics.ENABLED:
+            metrics.start(device)
+        input_raw(data, midi_stream, device)
+
+    return passer
+
+
 def send_message(msg: Dict[str, Any]) -> None:
     """Send MIDI or NRPN message.
 
-    Look up message's port in outports and use if it exists,
-    otherwise send message to all outports."""
-    if store.get('outports') is None:
+    Use the message's port as bound by mappings.bind_ports, otherwise
+    send message to all outports."""
+    send_messages([msg])
+
+
+def send_messages(msgs: List[Dict[str, Any]]) -> None:
+    """Send messages as one raw byte buffer per port.
+
+    Messages keep their order within each port. NRPN messages skip the
+    CC99/98 parameter select when the parameter is already active on the
+    port's channel and go through the scheduler when it is enabled."""
+    outports = store.get('outports')
+    if outports is None:
+        return
+
+    buffers: Dict[Any, bytearray] = {}
+    for msg in msgs:
+        outport = msg.get('port')
+        if outport is None:
+            outport = outports
+        nrpn = isinstance(msg['status'], tuple)
+        if nrpn and scheduler.enabled:
+            schedule(outport, (msg['channel'],) + msg['status'], msg)
+            continue
+        buffer = buffers.setdefault(outport, bytearray())
+        if nrpn:
+            buffer += nrpn_bytes(outport, msg)
+        else:
+            buffer += create_midi(msg).bin()
+    send_buffers(buffers)
+
+
+def send_buffers(buffers: Dict[Any, bytearray]) -> None:
+    """Write a raw byte buffer per port, None meaning all outports."""
+    outports = store.get('outports')
+    if outports is None:
         return
+    for outport, buffer in buffers.items():
+        write(outports if outport is None else outport, bytes(buffer))
+
+
+def send_template(mapping: Mapping, level: int) -> None:
+    """Send the mapping's output template with level as its value.
+
+    Templates with a value go through the scheduler when it is enabled,
+    keyed by the template so each destination control is coalesced."""
+    template = mapping.template
+    outport = mapping.output_port
+    if outport is None:
+        outport = store.get('outports')
+    if template is None or outport is None:
+        return
+
+    if mapping.size == 1:
+        template += DATA_BYTES[level]
+    elif mapping.size == 2:
+        value = level + 8192
+        template += bytes([value & 0x7F, value >> 7])
+    else:
+        write(outport, template)
+        return
+    if scheduler.enabled:
+        schedule(outport, mapping.template, template)
+    else:
+        write(outport, template)
+
 
-    outport = store.get('outports')
-    try:
-        # TODO: move this lookup to mappings so it's only done once
-        outport = [x for x in outport.ports if x.name == msg['port']][0]
-    except Exception:
-        pass
+def schedule(outport: Any, key: Any, value: Any) -> None:
+    """Queue a value for the control named key on the scheduler."""
+    if isinstance(outport, MultiPort):
+        for port in outport.ports:
+            scheduler.send(port, key, value)
+    else:
+        scheduler.send(outport, key, value)
+
+
+def write(outport: Any, data: bytes) -> None:
+    """Write raw MIDI bytes to a port.
+
+    Values still pending on the scheduler for the port are written first
+    so messages are never reordered."""
+    if isinstance(outport, MultiPort):
+        for port in outport.ports:
+            write(port, data)
+    elif outport in scheduler.pending:
+        scheduler.write(outport, data)
+    else:
+        write_now(outport, data)
 
-    if type(msg['status']) == str and len(msg['status'].split(':')) == 2:
-        for midi in create_nrpn(msg):
+
+def write_now(outport: Any, data: bytes) -> None:
+    """Write raw MIDI bytes to a single port.
+
+    Buffers are built per port but rtmidi only takes one message per
+    call, so they are written a message at a time. Port workers queue
+    the whole buffer as one entry so a burst such as an NRPN is never
+    split up, coalesced or dropped in part. Ports without an rtmidi
+    handle (e.g. in tests) only accept mido messages. rtmidi isn't
+    thread safe so writes to a port hold its lock."""
+    rt = getattr(outport, '_rt', None)
+    if rt is None:
+        for midi in mido.parse_all(data):
             outport.send(midi)
+        return
+    if isinstance(rt, PortWorker):
+        rt.send_message(data)
+        return
+    lock = port_locks.get(outport)
+    if lock is None:
+        lock = port_locks.setdefault(outport, threading.Lock())
+    size = len(data)
+    start = 0
+    with lock:
+        while start < size:
+            end = start + MESSAGE_SIZES[data[start]]
+            rt.send_message(data[start:end])
+            start = end
+
+
+def nrpn_bytes(outport: Any, msg: Dict[str, Any]) -> bytes:
+    """Return raw bytes for an NRPN message sent to outport.
+
+    The parameter select is left out if the last NRPN sent on the same
+    port and channel used the same parameter, unless NRPN_RESELECT is set.
+    14-bit levels are split over the data entry MSB and LSB.
+    """
+    msb, lsb = msg['status']
+    status = 0xB0 | msg['channel']
+    level = msg['level']
+    if msg.get('bits') == 14:
+        level, fine = level >> 7, level & 0x7F
     else:
-        outport.send(create_midi(msg))
+        fine = 0
+    data = bytes([status, 6, level, status, 38, fine])
+    key = (id(outport), msg['channel'])
+    if NRPN_RESELECT or nrpn_params.get(key) != (msb, lsb):
+        nrpn_params[key] = (msb, lsb)
+        data = bytes([status, 99, msb, status, 98, lsb]) + data
+    return data
+
+
+# Coalesces continuous values, see scheduler.Scheduler
+scheduler = Scheduler(write_now, nrpn_bytes)
+
+# Forwards clock and transport, see realtime.RealTimeLane
+lane = RealTimeLane(write_now)
+
+
+def forget_port(outport: Any) -> None:
+    """Drop what the send path remembers about a closed output port."""
+    scheduler.forget(outport)
+    port_locks.pop(getattr(outport, 'port', outport), None)
+    for key in list(nrpn_params):
+        if key[0] == id(outport):
+            nrpn_params.pop(key, None)
 
 
 def create_midi(msg: Dict[str, Any]) -> Message:
@@ -136,21 +449,21 @@ def create_nrpn(msg: Dict[str, Any]) -> List[Message]:
         MIDI # 16 CC 6 = level
         MIDI # 16 CC 38 = 0
 
-        Note that control is formatted like: '1:9'
+        Note that control is the (msb, lsb) pair parsed from '1:9'
     """
-    status = msg['status'].split(':')
+    status = msg['status']
     return [
         create_midi({
             'type': msg['type'],
             'channel': msg['channel'],
             'status': 99,
-            'level': int(status[0]),
+            'level': status[0],
         }),
         create_midi({
             'type': msg['type'],
             'channel': msg['channel'],
             'status': 98,
-            'level': int(status[1]),
+            'level': status[1],
         }),
         create_midi({
             'type': msg['type'],
@@ -0,0 +1,138 @@
+"""Reload mapping CSV files when they change."""
+from typing import Dict, List, Optional, Tuple
+
+import os
+import threading
+import time
+
+from .logger import INFO
+from .logger import QUIET
+from .logger import sink
+from .mappings import Mapping
+from .mappings import import_cached
+from .mappings import import_file
+from .mappings import mapping_files
+from .mappings import row_key
+from .store import store
+
+
+class MappingWatcher:
+    """Poll the mappings folder and reload the files that change.
+
+    Files are compared by modification time and size, so only files
+    whose stat changed are parsed again. Rows that are the same as
+    before keep their mapping, and with it their memory, while the rest
+    are swapped in with Store.reload_mappings. A file that fails to parse
+    keeps its previous mappings and the error is reported on the log.
+    """
+
+    def __init__(self, interval: float = 1.0) -> None:
+        self.interval = interval
+        self.files: Dict[str, List[Mapping]] = {}
+        self._stats: Dict[str, Tuple[int, int]] = {}
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def mappings(self) -> List[Mapping]:
+        """All mappings in file order."""
+        return [mapping for rows in self.files.values() for mapping in rows]
+
+    def load(self, cache: bool = False) -> List[Mapping]:
+        """Import every file and return all mappings.
+
+        With cache set files that haven't changed are loaded from the
+        mapping cache.
+        """
+        filenames = mapping_files()
+        for filename in filenames:
+            self._stats[filename] = stat(filename)
+        if cache:
+            self.files = import_cached(filenames)
+        else:
+            self.files = {
+                filename: import_file(filename) for filename in filenames}
+        return self.mappings
+
+    def start(self) -> None:
+        """Poll for changes on a background thread."""
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name='mapping-watcher', daemon=True)
+            self._thread.start()
+
+    def poll(self) -> bool:
+        """Reload files that changed, return True if any were reloaded."""
+        try:
+            filenames = mapping_files()
+        except OSError as e:
+            sink.emit(QUIET, None, 'ERROR: {}', e)
+            return False
+        changed = [
+            filename for filename in filenames
+            if self._stats.get(filename) != stat(filename)]
+        deleted = [
+            filename for filename in self.files if filename not in filenames]
+        if not changed and not deleted:
+            return False
+
+        start = time.perf_counter()
+        removed: List[Mapping] = []
+        added: List[Mapping] = []
+        for filename in deleted:
+            removed += self.files.pop(filename)
+            del self._stats[filename]
+        for filename in changed:
+            self._stats[filename] = stat(filename)
+            try:
+                rows = import_file(filename)
+            except Exception as e:
+                sink.emit(QUIET, None, 'ERROR: {} not reloaded: {}',
+                          filename, e)
+                continue
+            self._reuse(filename, rows, removed, added)
+        if not removed and not added:
+            return False
+        store.reload_mappings(self.mappings, removed, added)
+        sink.emit(
+            INFO, None, 'Reloaded {} in {:.1f} ms: {} added, {} removed',
+            ', '.join(os.path.basename(f) for f in changed + deleted),
+            (time.perf_counter() - start) * 1000, len(added), len(removed))
+        return True
+
+    def _reuse(
+        self,
+        filename: str,
+        rows: List[Mapping],
+        removed: List[Mapping],
+        added: List[Mapping],
+    ) -> None:
+        """Replace new rows that match old rows with the old mapping."""
+        unchanged: Dict[Tuple, List[Mapping]] = {}
+        for mapping in self.files.get(filename, []):
+            unchanged.setdefault(row_key(mapping), []).append(mapping)
+        for i, mapping in enumerate(rows):
+            matches = unchanged.get(row_key(mapping))
+            if matches:
+                rows[i] = matches.pop(0)
+            else:
+                added.append(mapping)
+        for matches in unchanged.values():
+            removed += matches
+        self.files[filename] = rows
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.poll()
+            except Exception as e:  # pragma: no cover
+                sink.emit(QUIET, None, 'ERROR: {}', e)
+
+
+def stat(filename: str) -> Tuple[int, int]:
+    """Return modification time and size of a file, or zeros if it's gone."""
+    try:
+        result = os.stat(filename)
+    except OSError:
+        return 0, 0
+    return result.st_mtime_ns, result.st_size
@@ -0,0 +1,169 @@
+"""Output port workers writing to each port on its own thread."""
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+import threading
+from collections import deque
+
+
+# What a worker does when its queue is full
+DROP_OLDEST = 'drop-oldest'
+COALESCE = 'coalesce'
+BLOCK = 'block'
+POLICIES = (DROP_OLDEST, COALESCE, BLOCK)
+
+# Data entry, increment/decrement and (N)RPN parameter select controls
+PARAMETER_CONTROLS = frozenset([6, 38, 96, 97, 98, 99, 100, 101])
+
+
+class PortWorker:
+    """Stand-in for an output port that writes from a worker thread.
+
+    Raw writes are queued and written to the port in order by the
+    worker so a slow device only holds up its own messages. The worker
+    exposes itself as the rtmidi handle, utils.write_now queues each
+    buffer whole so bursts such as NRPNs stay together.
+
+    When the queue is full 'drop-oldest' drops the oldest write and
+    'block' waits for space. 'coalesce' replaces a queued value of the
+    same control with the new one and waits for space otherwise. Values
+    are never moved before a note or other message queued after them.
+    """
+
+    def __init__(
+        self,
+        port: Any,
+        write: Callable[[Any, bytes], None],
+        policy: str = BLOCK,
+        maxsize: int = 64,
+    ) -> None:
+        if policy not in POLICIES:
+            raise ValueError(f'Unknown worker policy: {policy}')
+        self.port = port
+        self.name = port.name
+        self.policy = policy
+        self.maxsize = maxsize
+        self.closed = False
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.max_depth = 0
+        self._rt = self
+        self._write = write
+        self._queue: deque = deque()
+        self._keys: Dict[Hashable, List[Any]] = {}
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(
+            target=self._run, name=f'port-{self.name}', daemon=True)
+        self._thread.start()
+
+    def __repr__(self) -> str:
+        return f'PortWorker({self.port!r}, {self.policy!r})'
+
+    @property
+    def depth(self) -> int:
+        """Number of writes waiting in the queue."""
+        return len(self._queue)
+
+    def stats(self) -> Dict[str, int]:
+        """Return queue depth and counters."""
+        return {
+            'depth': self.depth,
+            'max_depth': self.max_depth,
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'coalesced': self.coalesced,
+        }
+
+    def send(self, midi: Any) -> None:
+        """Queue a mido message."""
+        self.send_message(midi.bytes())
+
+    def send_message(self, data: Any) -> None:
+        """Queue raw bytes to be written to the port."""
+        data = bytes(data)
+        key = coalesce_key(data) if self.policy == COALESCE else None
+        with self._cond:
+            if self.closed:
+                return
+            if key is not None:
+                entry = self._keys.get(key)
+                if entry is not None:
+                    entry[0] = data
+                    self.coalesced += 1
+                    return
+            elif self._keys:
+                self._keys = {}
+            while len(self._queue) >= self.maxsize and not self.closed:
+                if self.policy == DROP_OLDEST:
+                    self._forget(self._queue.popleft())
+                    self.dropped += 1
+                else:
+                    self._cond.wait()
+            if self.closed:
+                return
+            entry = [data, key]
+            self._queue.append(entry)
+            if key is not None:
+                self._keys[key] = entry
+            if len(self._queue) > self.max_depth:
+                self.max_depth = len(self._queue)
+            self._cond.notify_all()
+
+    def close(self) -> None:
+        """Write what is queued, stop the worker and close the port."""
+        with self._cond:
+            if self.closed:
+                return
+            self.closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        self.port.close()
+
+    def _forget(self, entry: List[Any]) -> None:
+        key = entry[1]
+        if key is not None and self._keys.get(key) is entry:
+            del self._keys[key]
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._queue and not self.closed:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                entry = self._queue.popleft()
+                self._forget(entry)
+                self._cond.notify_all()
+            try:
+                self._write(self.port, entry[0])
+                self.sent += 1
+            except Exception as e:  # pragma: no cover
+                print(f'ERROR: {e}')
+
+
+def coalesce_key(data: bytes) -> Optional[Hashable]:
+    """Return the control a single continuous message sets, or None.
+
+    Control change and poly aftertouch are keyed by status and control,
+    channel aftertouch and pitchwheel by status. Data entry and
+    parameter selects are never coalesced as their meaning depends on
+    the messages around them.
+    """
+    if len(data) == 3 and data[0] & 0xF0 == 0xB0:
+        return None if data[1] in PARAMETER_CONTROLS else (data[0], data[1])
+    if len(data) == 3 and data[0] & 0xF0 == 0xA0:
+        return data[0], data[1]
+    if len(data) == 3 and data[0] & 0xF0 == 0xE0:
+        return data[0]
+    if len(data) == 2 and data[0] & 0xF0 == 0xD0:
+        return data[0]
+    return None
+
+
+def stats(ports: Any) -> Dict[str, Dict[str, int]]:
+    """Return stats for each worker in ports by port name."""
+    return {
+        port.name: port.stats()
+        for port in getattr(ports, 'ports', ())
+        if isinstance(port, PortWorker)
+    }
@@ -3,9 +3,36 @@ import pytest
 
 from mido import Message
 
+from midi_mapper.mappings import Mapping
 from midi_mapper.utils import REAL_TIME_MESSAGES
 
 
+class RecordingPort:
+    """Port that records the bytes written to it and whether it was closed.
+
+    Like rtmidi it only takes one message per write."""
+
+    def __init__(self, name, callback=None):
+        self.name = name
+        self.closed = False
+        self.data = []
+        self._rt = self
+
+    def send_message(self, data):
+        if len(data) > 3 and data[0] != 0xF0:
+            raise ValueError("'message' longer than 3 bytes but does not "
+                             "start with 0xF0.")
+        self.data.append(bytes(data))
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture()
+def recording_port():
+    return RecordingPort
+
+
 @pytest.fixture()
 def control_change():
     return Message(type='control_change', channel=0, control=64, value=64)
@@ -46,7 +73,7 @@ def real_time(request):
 
 @pytest.fixture(params=REAL_TIME_MESSAGES)
 def mappings_real_time(request):
-    return [dict([
+    return [Mapping.from_dict(dict([
         ('input-device', 'TestStart'),
         ('description', 'Button1'),
         ('type', 'note_on'),
@@ -60,7 +87,7 @@ def mappings_real_time(request):
         ('o-channel', '-'),
         ('o-control', '-'),
         ('o-range', ''),
-        ('memory', 0)])
+        ('memory', 0)]))
     ]
 
     return Message(type=request.param)
@@ -98,7 +125,7 @@ def mappings_bank0():
         ('o-control', '23'),
         ('o-range', ''),
         ('memory', 0)])
-    return [e1, e2]
+    return [Mapping.from_dict(e) for e in (e1, e2)]
 
 
 @pytest.fixture()
@@ -133,7 +160,7 @@ def mappings_bank1():
         ('o-control', '45'),
         ('o-range', ''),
         ('memory', 0)])
-    return [e1, e2]
+    return [Mapping.from_dict(e) for e in (e1, e2)]
 
 
 @pytest.fixture()
@@ -198,7 +225,7 @@ def mappings_bank_set():
         ('o-control', '89'),
         ('o-range', '100-110'),
         ('memory', 0)])
-    return [e1, e2, e3, e4]
+    return [Mapping.from_dict(e) for e in (e1, e2, e3, e4)]
 
 
 @pytest.fixture()
@@ -233,4 +260,4 @@ def mappings_set_program():
         ('o-control', '2'),
         ('o-range', ''),
         ('memory', 0)])
-    return [e1, e2]
+    return [Mapping.from_dict(e) for e in (e1, e2)]
@@ -10,14 +10,29 @@ from midi_mapper.store import Store
 
 
 @patch('time.sleep', side_effect=InterruptedError)
-@patch('midi_mapper.app.set_io_ports', lambda _: [])
-@patch('midi_mapper.app.import_mappings', lambda: [])
+@patch('midi_mapper.app.set_io_ports', lambda *args: [])
+@patch('midi_mapper.app.import_mappings', lambda *args: [])
 def test_main_loop(mocked_sleep):
     with pytest.raises(InterruptedError):
         app.run()
         app.store.update('active_bank', 0)
 
 
+@patch('midi_mapper.shards.Shards.run')
+def test_shards_options(mocked_run, monkeypatch):
+    monkeypatch.setattr(
+        'sys.argv', ['app', '--shards=2', '--engine=async', '--hotplug'])
+    with pytest.raises(SystemExit) as e:
+        app.run()
+    assert str(e.value) == (
+        "ERROR: --shards can't be used with --engine=async, --hotplug")
+    mocked_run.assert_not_called()
+
+    monkeypatch.setattr('sys.argv', ['app', '--shards=2', '--no-cache'])
+    app.run()
+    mocked_run.assert_called_once()
+
+
 store = Store({
     'active_bank': 0,
     'mappings': [],
@@ -0,0 +1,39 @@
+"""Test the benchmark harness with small workloads."""
+import threading
+
+from benchmarks import run
+from benchmarks import shards
+from benchmarks import startup
+
+
+def test_run_workloads():
+    results = run.run(200, list(run.WORKLOADS), 'rx')
+    assert set(results['workloads']) == set(run.WORKLOADS)
+    for name, result in results['workloads'].items():
+        assert result['messages'] == 200
+        assert result['messages_per_sec'] > 0
+        assert result['writes'] > 0
+    assert results['workloads']['large_mappings']['mappings'] == 6144
+    assert len(run.report(results)) == len(run.WORKLOADS)
+    assert len(run.compare(results, results)) == len(run.WORKLOADS)
+
+
+def test_engines_stop():
+    threads = threading.active_count()
+    for engine in run.ENGINES:
+        results = run.run(50, ['nrpn_flood', 'bank_storm'], engine)
+        # each NRPN is four writes, in the timed and the allocation run
+        assert results['workloads']['nrpn_flood']['writes'] == 2 * 4 * 50
+    assert threading.active_count() == threads
+
+
+def test_startup():
+    results = startup.run(64, 2, 1)
+    assert set(results) == {'no_cache', 'cold', 'warm'}
+    assert all(ms > 0 for ms in results.values())
+
+
+def test_shards():
+    results = shards.run(200, 2, 'bank_storm')
+    assert results['messages_per_sec'] > 0
+    assert results['relayed'] > 0
@@ -0,0 +1,120 @@
+"""Test functions related to raw MIDI decoding."""
+import threading
+
+from mido import Message
+
+from midi_mapper.decoder import Decoder
+from midi_mapper.decoder import decode
+from midi_mapper.mappings import Mapping
+from midi_mapper.store import store
+from midi_mapper.stream import process_midi
+
+
+class Clock:
+    """Clock that only moves when told to."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def cc(channel, control, level):
+    return ('control_change', channel, control), level
+
+
+def decoding_store(*rows):
+    store.update('mappings', [
+        Mapping.from_dict({'type': type_, 'channel': '1', 'control': control})
+        for type_, control in rows])
+
+
+def test_decode_matches_process_midi(
+        control_change, midi_notes, polytouch, program_change):
+    messages = [
+        control_change,
+        midi_notes,
+        polytouch,
+        program_change,
+        Message(type='aftertouch', channel=3, value=64),
+        Message(type='pitchwheel', channel=15, pitch=-8192),
+        Message(type='pitchwheel', channel=0, pitch=8191),
+    ]
+    for midi in messages:
+        data = process_midi(midi)
+        key = (data['type'], data['channel'], data['status'])
+        assert decode(midi.bytes()) == (key, data['level'])
+
+
+def test_decode_ignores_system_messages(real_time):
+    assert decode(real_time.bytes()) is None
+    assert decode(Message(type='sysex', data=[1, 2]).bytes()) is None
+    assert decode([0x90, 1]) is None
+    assert decode([]) is None
+
+
+def test_decoder_cc14():
+    decoding_store(('control_change_14', '7'))
+    emitted = []
+    decoder = Decoder(lambda *event: emitted.append(event), clock=Clock())
+    assert decoder.feed(*cc(1, 7, 100), 'In') is None
+    assert decoder.feed(*cc(1, 39, 5), 'In') == (
+        ('control_change_14', 1, 7), 100 << 7 | 5)
+    # other controls and channels pass through
+    assert decoder.feed(*cc(1, 8, 1), 'In') == cc(1, 8, 1)
+    assert decoder.feed(*cc(2, 7, 1), 'In') == cc(2, 7, 1)
+    assert decoder.feed(('note_on', 1, 7), 1, 'In') == (('note_on', 1, 7), 1)
+    # parts are kept per device
+    assert decoder.feed(*cc(1, 7, 1), 'Other') is None
+    assert decoder.feed(*cc(1, 39, 0), 'In') == (
+        ('control_change_14', 1, 7), 100 << 7)
+    assert decoder.stats() == {'assembled': 2, 'expired': 0, 'waiting': 1}
+    assert emitted == []
+    store.update('mappings', [])
+
+
+def test_decoder_timeout():
+    decoding_store(('control_change_14', '7'))
+    emitted = []
+    clock = Clock()
+    decoder = Decoder(lambda *event: emitted.append(event), clock=clock)
+    assert decoder.feed(*cc(1, 7, 3), 'In') is None
+    clock.now = 0.005
+    assert decoder.feed(*cc(1, 7, 4), 'In') is None
+    assert decoder.flush_due() == 0.005
+    assert emitted == []
+    # a newer MSB doesn't move the deadline
+    clock.now = 0.01
+    assert decoder.flush_due() is None
+    assert emitted == [(('control_change_14', 1, 7), 4 << 7, 'In')]
+    assert decoder.stats()['expired'] == 1
+    store.update('mappings', [])
+
+
+def test_decoder_nrpn():
+    decoding_store(('nrpn', '1:9'))
+    emitted = []
+    decoder = Decoder(lambda *event: emitted.append(event), clock=Clock())
+    # data entry without a parameter passes through
+    assert decoder.feed(*cc(1, 6, 1)) == cc(1, 6, 1)
+    for control, level in ((99, 1), (98, 9), (6, 64)):
+        assert decoder.feed(*cc(1, control, level)) is None
+    assert decoder.feed(*cc(1, 38, 1)) == (('nrpn', 1, 137), 64 << 7 | 1)
+    # a 7-bit NRPN is sent once the next parameter is selected
+    assert decoder.feed(*cc(1, 6, 2)) is None
+    assert decoder.feed(*cc(1, 99, 2)) == (('nrpn', 1, 137), 2 << 7)
+    # RPN selects end the NRPN
+    assert decoder.feed(*cc(1, 101, 0)) == cc(1, 101, 0)
+    assert decoder.feed(*cc(1, 6, 3)) == cc(1, 6, 3)
+    assert emitted == []
+    store.update('mappings', [])
+
+
+def test_decoder_thread():
+    decoding_store(('control_change_14', '7'))
+    done = threading.Event()
+    decoder = Decoder(lambda *event: done.set(), timeout=0.001)
+    assert decoder.feed(*cc(1, 7, 3)) is None
+    assert done.wait(1)
+    store.update('mappings', [])
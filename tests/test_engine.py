@@ -0,0 +1,174 @@
+"""Test functions related to the pipeline engines."""
+import threading
+import time
+
+from unittest.mock import patch
+
+from mido import Message
+from mido.ports import MultiPort
+from rx.subject import Subject
+
+from midi_mapper import app
+from midi_mapper.async_engine import AsyncPipeline
+from midi_mapper.engine import FastPipeline
+from midi_mapper.mappings import Mapping
+from midi_mapper.store import store
+from midi_mapper.utils import input_raw
+from midi_mapper.utils import scheduler
+
+
+def run_pipeline(pipeline, mappings, messages, port):
+    store.update('outports', MultiPort([port]))
+    store.update('mappings', mappings)
+    store.update('active_bank', 0)
+    for midi in messages:
+        pipeline.on_next((midi, None))
+    store.update('outports', None)
+    return port.data, [m.memory for m in mappings]
+
+
+def test_fast_pipeline_matches_rx(mappings_bank_set, recording_port):
+    messages = [
+        Message(type='control_change', channel=6, control=77, value=64),
+        Message(type='note_on', channel=4, note=55, velocity=127),
+        Message(type='control_change', channel=6, control=77, value=78),
+        Message(type='note_on', channel=5, note=66, velocity=127),
+        Message(type='control_change', channel=7, control=88, value=89),
+        Message(type='clock'),
+    ]
+    midi_stream = Subject()
+    app.create_pipeline(midi_stream)
+    expected = run_pipeline(
+        midi_stream, mappings_bank_set, messages,
+        recording_port('TestControllerOut'))
+    for mapping in mappings_bank_set:
+        mapping.memory = 0
+    result = run_pipeline(
+        FastPipeline(), mappings_bank_set, messages,
+        recording_port('TestControllerOut'))
+    assert result == expected
+    assert len(result[0]) == 6
+
+    for mapping in mappings_bank_set:
+        mapping.memory = 0
+    pipeline = RawPipeline()
+    result = run_pipeline(
+        pipeline, mappings_bank_set, messages,
+        recording_port('TestControllerOut'))
+    assert result == expected
+
+
+def test_fast_pipeline_decodes(recording_port):
+    mappings = [Mapping.from_dict({
+        'type': 'control_change_14', 'bank': '0', 'channel': '1',
+        'control': '7', 'o-type': 'control_change', 'o-channel': '2',
+        'o-control': '70'})]
+    messages = [
+        Message(type='control_change', channel=0, control=7, value=64),
+        Message(type='control_change', channel=0, control=39, value=127),
+        Message(type='control_change', channel=0, control=7, value=127),
+        Message(type='control_change', channel=0, control=39, value=127),
+    ]
+    result = run_pipeline(
+        FastPipeline(), mappings, messages, recording_port('Synth'))
+    assert result == ([b'\xb1\x46\x40', b'\xb1\x46\x7f'], [16383])
+
+    midi_stream = Subject()
+    app.create_pipeline(midi_stream)
+    assert run_pipeline(
+        midi_stream, mappings, messages, recording_port('Synth')) == result
+    store.update('mappings', [])
+
+
+class RawPipeline(FastPipeline):
+    """Feed messages to the fast pipeline as rtmidi bytes."""
+
+    def on_next(self, item):
+        input_raw(item[0].bytes(), self)
+
+
+@patch('midi_mapper.engine.print')
+@patch('midi_mapper.engine.lookup', side_effect=ValueError)
+def test_fast_pipeline_error(lookup_mock, print_mock):
+    pipeline = FastPipeline()
+    midi = Message(type='control_change', channel=6, control=77, value=64)
+    pipeline.on_next((midi, None))
+    pipeline.on_next((midi, None))
+    assert lookup_mock.call_count == 2
+    assert print_mock.call_count == 2
+
+
+def test_async_pipeline_matches_fast(mappings_bank_set, recording_port):
+    messages = [
+        Message(type='control_change', channel=6, control=77, value=64),
+        Message(type='note_on', channel=4, note=55, velocity=127),
+        Message(type='control_change', channel=7, control=88, value=89),
+    ]
+    expected = run_pipeline(
+        FastPipeline(), mappings_bank_set, messages,
+        recording_port('TestControllerOut'))
+    for mapping in mappings_bank_set:
+        mapping.memory = 0
+
+    pipeline = AsyncPipeline()
+    thread = threading.Thread(target=pipeline.run)
+    thread.start()
+    pipeline.started.wait()
+    port = recording_port('TestControllerOut')
+    store.update('outports', MultiPort([port]))
+    store.update('mappings', mappings_bank_set)
+    store.update('active_bank', 0)
+    for midi in messages:
+        pipeline.on_raw(midi.bytes())
+    pipeline.join(1)
+    pipeline.stop()
+    thread.join(1)
+    store.update('outports', None)
+    assert (port.data, [m.memory for m in mappings_bank_set]) == expected
+    assert not thread.is_alive()
+
+
+def test_async_clock(recording_port):
+    port = recording_port('Clock')
+    store.update('outports', MultiPort([port]))
+    pipeline = AsyncPipeline(clock_bpm=6000)
+    thread = threading.Thread(target=pipeline.run)
+    thread.start()
+    pipeline.started.wait()
+    time.sleep(0.05)
+    pipeline.stop()
+    thread.join(1)
+    store.update('outports', None)
+    # a tick every 0.4 ms
+    assert len(port.data) > 10
+    assert set(port.data) == {b'\xF8'}
+
+
+def test_async_scheduler(mappings_bank_set, recording_port):
+    port = recording_port('TestControllerOut')
+    store.update('outports', MultiPort([port]))
+    store.update('mappings', mappings_bank_set)
+    store.update('active_bank', 1)
+    scheduler.configure('50')
+    pipeline = AsyncPipeline()
+    thread = threading.Thread(target=pipeline.run)
+    thread.start()
+    pipeline.started.wait()
+    try:
+        for value in (1, 64, 127):
+            pipeline.on_raw([0xB6, 77, value])
+        pipeline.join(1)
+        assert port.data == [bytes([0xB7, 78, 0])]
+        # the last value is flushed by the loop once the interval passes
+        for _ in range(100):
+            if len(port.data) == 2:
+                break
+            time.sleep(0.01)
+        assert port.data[1] == bytes([0xB7, 78, 16])
+        assert scheduler.wake is not None
+    finally:
+        pipeline.stop()
+        thread.join(1)
+        scheduler.configure('0')
+        store.update('outports', None)
+    assert scheduler.wake is None
@@ -0,0 +1,42 @@
+"""Test functions related to the log sink."""
+import threading
+
+from midi_mapper.logger import DEBUG
+from midi_mapper.logger import INFO
+from midi_mapper.logger import LogSink
+
+
+def test_emit():
+    lines = []
+    sink = LogSink(write=lines.append)
+    sink.emit(INFO, None, '{} | {:>3}', 'a', 1)
+    sink.emit(DEBUG, None, '{}', 'ignored')
+    sink.flush()
+    assert lines == ['a |   1']
+    assert sink.stats() == {'depth': 0, 'dropped': 0, 'coalesced': 0}
+
+
+def test_coalesce_and_drop():
+    lines = []
+    release = threading.Event()
+
+    def write(line):
+        release.wait()
+        lines.append(line)
+
+    sink = LogSink(maxsize=2, write=write)
+    # first record is taken by the writer which then waits
+    sink.emit(INFO, 'first', '{}', 0)
+    while sink.depth:
+        pass
+    sink.emit(INFO, 'control', '{}', 1)
+    sink.emit(INFO, 'control', '{}', 2)
+    sink.emit(INFO, None, '{}', 3)
+    sink.emit(INFO, None, '{}', 4)
+    assert sink.depth == 2
+    assert sink.coalesced == 1
+    assert sink.dropped == 1
+
+    release.set()
+    sink.flush()
+    assert lines == ['0', '2', '3']
@@ -3,8 +3,21 @@ import os
 
 import pytest
 
+from types import SimpleNamespace
+
+from mido import Message
+from mido.ports import MultiPort
+
 from midi_mapper import mappings
+from midi_mapper.constants import OutputType
+from midi_mapper.mappings import bind_ports
+from midi_mapper.mappings import build_decoding
+from midi_mapper.mappings import build_device_indexes
+from midi_mapper.mappings import build_index
 from midi_mapper.mappings import import_mappings
+from midi_mapper.mappings import Mapping
+from midi_mapper.mappings import update_device_indexes
+from midi_mapper.mappings import update_index
 
 
 def test_import_mappings_success():
@@ -30,11 +43,198 @@ def test_import_mappings_dummy_csv():
 
     data = import_mappings()
     os.remove(dummy_file_path)
-    assert data[0]['input-device'] == 'DeviceIn'
-    assert data[0]['channel'] == '1'
-    assert data[0]['output-device'] == 'DeviceOut'
-    assert data[0]['o-channel'] == '11'
-    assert data[0]['memory'] == '0'
-    assert data[1]['channel'] == '2'
-    assert data[1]['o-channel'] == '12'
-    assert data[1]['memory'] == '0'
+    assert data[0].input_device == 'DeviceIn'
+    assert data[0].channel == 1
+    assert data[0].output_device == 'DeviceOut'
+    assert data[0].o_channel == 11
+    assert data[0].memory == 0
+    assert data[1].channel == 2
+    assert data[1].o_channel == 12
+    assert data[1].memory == 0
+
+
+def test_import_mappings_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(mappings, 'MAPPINGS_FOLDER', str(tmp_path))
+    path = tmp_path / 'test.csv'
+    path.write_text('input-device,channel,output-device,channel\n'
+                    'DeviceIn,1,DeviceOut,11\n')
+    parsed = []
+    import_file = mappings.import_file
+    monkeypatch.setattr(
+        mappings, 'import_file',
+        lambda filename: parsed.append(filename) or import_file(filename))
+
+    assert import_mappings(cache=True)[0].o_channel == 11
+    assert len(parsed) == 1
+    # unchanged and touched files come from the cache
+    assert import_mappings(cache=True)[0].o_channel == 11
+    os.utime(path, ns=(1, 1))
+    assert import_mappings(cache=True)[0].o_channel == 11
+    assert len(parsed) == 1
+
+    path.write_text('input-device,channel,output-device,channel\n'
+                    'DeviceIn,1,DeviceOut,12\n')
+    assert import_mappings(cache=True)[0].o_channel == 12
+    assert len(parsed) == 2
+
+    # a broken cache is rebuilt
+    (tmp_path / mappings.CACHE_FILE).write_bytes(b'broken')
+    assert import_mappings(cache=True)[0].o_channel == 12
+    assert len(parsed) == 3
+
+
+def test_mapping_from_dict():
+    mapping = Mapping.from_dict({
+        'input-device': ' DeviceIn ',
+        'type': 'control_change',
+        'bank': '1',
+        'channel': '2',
+        'control': '3',
+        'o-type': 'control_change',
+        'o-channel': '-',
+        'o-control': '1:9',
+        'o-range': '10-20',
+    })
+    assert mapping.input_device == 'DeviceIn'
+    assert (mapping.bank, mapping.channel, mapping.control) == (1, 2, 3)
+    assert mapping.o_type is OutputType.CONTROL_CHANGE
+    assert mapping.o_channel is None
+    assert mapping.o_control is None
+    assert mapping.nrpn == (1, 9)
+    assert mapping.o_range == (10, 20)
+
+    mapping = Mapping.from_dict({'o-type': 'unknown', 'o-control': '5'})
+    assert mapping.o_type is None
+    assert mapping.o_control == 5
+    assert mapping.nrpn is None
+    assert mapping.o_range is None
+
+
+def test_decoded_inputs():
+    mapping = Mapping.from_dict({
+        'type': 'nrpn', 'channel': '2', 'control': '1:9',
+        'o-type': 'control_change', 'o-channel': '1', 'o-control': '5'})
+    assert mapping.control == 137
+    assert mapping.feedback is None
+    assert mapping.scale[0] == 0
+    assert mapping.scale[16383] == 127
+    # 14-bit outputs take the whole level
+    mapping = Mapping.from_dict({
+        'type': 'control_change_14', 'channel': '1', 'control': '7',
+        'o-type': 'control_change', 'o-control': '1:9'})
+    assert mapping.bits == 14
+    assert mapping.scale[16383] == 16383
+    mapping = Mapping.from_dict({
+        'type': 'control_change_14', 'channel': '1', 'control': '7',
+        'o-type': 'pitchwheel'})
+    assert (mapping.scale[0], mapping.scale[16383]) == (-8192, 8191)
+
+    cc14, nrpn = build_decoding([
+        Mapping.from_dict({
+            'type': 'control_change_14', 'channel': '3', 'control': '7'}),
+        Mapping.from_dict({
+            'type': 'nrpn', 'channel': '16', 'control': '1:9'}),
+    ])
+    assert [i for i, flag in enumerate(cc14) if flag] == [263, 295]
+    assert [i for i, flag in enumerate(nrpn) if flag] == [15]
+    assert build_decoding([Mapping.from_dict({'type': 'note_on'})]) is None
+
+
+def test_build_index(mappings_bank_set):
+    mappings_bank_set.append(Mapping.from_dict({
+        'type': 'control_change', 'channel': '-', 'control': '1',
+        'bank': '1'}))
+    index = build_index(mappings_bank_set)
+    assert len(index) == 4
+    assert index[('note_on', 5, 55)] == {0: [mappings_bank_set[0]]}
+    assert index[('control_change', 7, 77)] == {1: [mappings_bank_set[2]]}
+    assert index[('control_change', 8, 88)] == {2: [mappings_bank_set[3]]}
+
+
+def test_update_index(mappings_bank_set):
+    first, second, wheel1, wheel2 = mappings_bank_set
+    index = build_index([first, wheel1, wheel2])
+    moved = Mapping.from_dict({
+        'type': 'control_change', 'channel': '7', 'control': '77',
+        'bank': '1'})
+    updated = update_index(index, [wheel2], [second, moved])
+    assert updated == build_index([first, wheel1, second, moved])
+    # buckets in use are left alone
+    assert index[('control_change', 7, 77)] == {1: [wheel1]}
+    assert ('control_change', 8, 88) in index
+    assert updated[('note_on', 5, 55)] is index[('note_on', 5, 55)]
+
+
+def test_build_device_indexes():
+    rows = [
+        Mapping.from_dict({
+            'input-device': device, 'type': 'control_change',
+            'channel': '1', 'control': '22', 'bank': '0'})
+        for device in ('Left', 'Right', 'Unplugged')]
+    left, right, unplugged = rows
+    indexes = build_device_indexes(rows, ['Left', 'Right'])
+    key = ('control_change', 1, 22)
+    assert indexes['Left'][key] == {0: [left, unplugged]}
+    assert indexes['Right'][key] == {0: [right, unplugged]}
+
+    updated = update_device_indexes(indexes, [left], [])
+    assert updated['Left'][key] == {0: [unplugged]}
+    assert updated['Right'] == indexes['Right']
+    assert indexes['Left'][key] == {0: [left, unplugged]}
+
+
+def test_bind_ports(mappings_bank_set):
+    bank = SimpleNamespace(name='Bank')
+    controller = SimpleNamespace(name='TestControllerIn')
+    outports = MultiPort([bank, controller])
+
+    bind_ports(mappings_bank_set, outports)
+    assert mappings_bank_set[0].output_port is bank
+    assert mappings_bank_set[0].input_port is controller
+    # unknown devices are bound to all outports
+    assert mappings_bank_set[2].output_port is outports
+
+    bind_ports(mappings_bank_set, None)
+    assert mappings_bank_set[0].output_port is None
+    assert mappings_bank_set[0].input_port is None
+
+
+def test_output_template():
+    outputs = [
+        ('control_change', '5', '7', Message(
+            type='control_change', channel=4, control=7, value=64)),
+        ('note_on', '1', '60', Message(
+            type='note_on', channel=0, note=60, velocity=127)),
+        ('note_off', '2', '60', Message(
+            type='note_off', channel=1, note=60, velocity=0)),
+        ('polytouch', '16', '1', Message(
+            type='polytouch', channel=15, note=1, value=64)),
+        ('program_change', '3', '9', Message(
+            type='program_change', channel=2, program=9)),
+        ('aftertouch', '4', '-', Message(type='aftertouch', value=64)),
+        ('clock', '-', '-', Message(type='clock')),
+    ]
+    for o_type, o_channel, o_control, expected in outputs:
+        mapping = Mapping.from_dict({
+            'o-type': o_type, 'o-channel': o_channel, 'o-control': o_control})
+        data = mapping.template + bytes([64] * mapping.size)
+        assert data == expected.bin()
+
+    mapping = Mapping.from_dict({'o-type': 'pitchwheel', 'o-channel': '1'})
+    assert mapping.template == bytes([0xE0])
+    assert mapping.size == 2
+
+    for o_type, o_control in (('control_change', '1:2'),
+                              ('mm_bank_change', '1'),
+                              ('note_on', '-')):
+        mapping = Mapping.from_dict({
+            'o-type': o_type, 'o-channel': '1', 'o-control': o_control})
+        assert mapping.template is None
+
+
+def test_scale_table():
+    mapping = Mapping.from_dict({'o-range': '100-110'})
+    assert mapping.scale[0] == 100
+    assert mapping.scale[127] == 110
+    assert mapping.scale is Mapping.from_dict({'o-range': '100-110'}).scale
+    assert Mapping.from_dict({}).scale == tuple(range(128))
@@ -0,0 +1,90 @@
+"""Test functions related to latency metrics."""
+import pytest
+import threading
+
+from mido import Message
+from rx.subject import Subject
+
+from midi_mapper import app
+from midi_mapper import metrics
+from midi_mapper.async_engine import AsyncPipeline
+from midi_mapper.engine import FastPipeline
+from midi_mapper.store import store
+
+
+@pytest.fixture()
+def enabled(monkeypatch):
+    monkeypatch.setattr(metrics, 'ENABLED', True)
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+def test_histogram():
+    histogram = metrics.Histogram()
+    assert histogram.summary()['count'] == 0
+    for value in range(1, 101):
+        histogram.record(value / 1000)
+    summary = histogram.summary()
+    assert summary['count'] == 100
+    assert summary['p50'] == pytest.approx(51)
+    assert summary['p99'] == pytest.approx(100)
+    assert summary['max'] == pytest.approx(100)
+
+
+def test_mark_without_start():
+    metrics.reset()
+    metrics.mark('process')
+    assert metrics.histograms == {}
+
+
+def test_pipeline_marks(enabled, mappings_bank0):
+    store.update('mappings', mappings_bank0)
+    store.update('active_bank', 0)
+    midi_stream = Subject()
+    app.create_pipeline(midi_stream)
+
+    metrics.start('TestControllerIn')
+    midi_stream.on_next((
+        Message(type='control_change', channel=1, control=22, value=64),
+        None))
+
+    keys = set(metrics.histograms)
+    assert ('process', 'TestControllerIn') in keys
+    assert ('lookup', 'TestControllerIn') in keys
+    assert ('send', mappings_bank0[1]) in keys
+    assert ('total', 'TestControllerIn') in keys
+    lines = metrics.report()
+    assert len(lines) == 4
+    assert lines[0].startswith('process | TestControllerIn')
+    assert 'Wheel 1 => CC Test' in lines[2]
+
+
+def test_async_pipeline_marks(enabled, mappings_bank0):
+    store.update('mappings', mappings_bank0)
+    store.update('active_bank', 0)
+    pipeline = AsyncPipeline()
+    thread = threading.Thread(target=pipeline.run)
+    thread.start()
+    pipeline.started.wait()
+
+    # timed from the callback thread, handled on the loop's thread
+    metrics.start('TestControllerIn')
+    pipeline.on_raw([0xB1, 22, 64], 'TestControllerIn')
+    pipeline.join(1)
+    pipeline.stop()
+    thread.join(1)
+    assert ('send', mappings_bank0[1]) in metrics.histograms
+    assert ('total', 'TestControllerIn') in metrics.histograms
+
+
+def test_decoder_timeout_marks(enabled, mappings_bank0):
+    store.update('mappings', mappings_bank0)
+    store.update('active_bank', 0)
+    # emitted from the decoder's timer thread, where nothing was started
+    thread = threading.Thread(
+        target=FastPipeline().emit,
+        args=(('control_change', 2, 22), 64, 'TestControllerIn'))
+    thread.start()
+    thread.join(1)
+    assert ('total', 'TestControllerIn') in metrics.histograms
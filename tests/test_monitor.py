@@ -0,0 +1,75 @@
+"""Test functions related to reconnecting ports."""
+import mido
+
+from mido.ports import MultiPort
+
+from midi_mapper import utils
+from midi_mapper.logger import LogSink
+from midi_mapper.mappings import UNPLUGGED
+from midi_mapper.mappings import Mapping
+from midi_mapper.monitor import PortMonitor
+from midi_mapper.state import state
+from midi_mapper.store import store
+from midi_mapper.stream import set_bank
+
+
+def test_poll(monkeypatch, recording_port):
+    names = {'in': ['Controller'], 'out': ['Controller', 'Synth']}
+    monkeypatch.setattr(mido, 'get_input_names', lambda: names['in'])
+    monkeypatch.setattr(mido, 'get_output_names', lambda: names['out'])
+    monkeypatch.setattr(mido, 'open_input', recording_port)
+    monkeypatch.setattr(mido, 'open_output', recording_port)
+    monkeypatch.setattr('midi_mapper.monitor.sink', LogSink(write=print))
+    virtual = recording_port(utils.VIRTUAL_PORT)
+    controller_in = recording_port('Controller')
+    controller, synth = recording_port('Controller'), recording_port('Synth')
+    store.update('inports', MultiPort([controller_in]))
+    store.update('outports', MultiPort([virtual, controller, synth]))
+    mapping = Mapping.from_dict({
+        'input-device': 'Controller', 'type': 'control_change', 'bank': '1',
+        'channel': '1', 'control': '1', 'output-device': 'Synth',
+        'o-type': 'control_change', 'o-channel': '1', 'o-control': '10'})
+    bank = Mapping.from_dict({
+        'input-device': 'Controller', 'type': 'note_on', 'bank': '0',
+        'channel': '1', 'control': '5', 'output-device': 'Controller',
+        'o-type': 'mm_bank_change', 'o-channel': '0', 'o-control': '1'})
+    store.update('mappings', [mapping, bank])
+    store.update('active_bank', 1)
+    mapping.memory = 42
+    state.shown_on(controller)[mapping.feedback_index] = 42
+
+    monitor = PortMonitor(None)
+    assert not monitor.poll()
+
+    # controller unplugged
+    names['in'], names['out'] = [], ['Synth']
+    assert monitor.poll()
+    assert controller_in.closed and controller.closed
+    assert not synth.closed
+    assert store.get('inports').ports == []
+    assert store.get('outports').ports == [virtual, synth]
+    assert controller not in state.shown
+    # the controller's rows send nothing rather than to every port
+    assert store.get('unplugged') == {'Controller'}
+    assert mapping.input_port is UNPLUGGED
+    assert mapping.output_port is synth
+    set_bank(1, initial=True)
+    assert virtual.data == [] and synth.data == []
+
+    # plugged back in, only the controller is opened and gets the bank
+    names['in'], names['out'] = ['Controller'], ['Controller', 'Synth']
+    assert monitor.poll()
+    replugged = store.get('outports').ports[-1]
+    assert replugged is not controller
+    assert store.get('outports').ports[:2] == [virtual, synth]
+    assert [p.name for p in store.get('inports').ports] == ['Controller']
+    assert mapping.input_port is replugged
+    assert store.get('unplugged') == set()
+    assert replugged.data == [b'\x90\x05\x7f', b'\xb0\x01\x2a']
+    assert synth.data == []
+    assert not monitor.poll()
+
+    store.update('inports', None)
+    store.update('outports', None)
+    store.update('mappings', [])
+    store.update('unplugged', frozenset())
@@ -0,0 +1,102 @@
+"""Test functions related to forwarding clock and transport."""
+import threading
+
+from mido import Message
+from mido.ports import MultiPort
+
+from midi_mapper import utils
+from midi_mapper.realtime import RealTimeLane
+from midi_mapper.store import store
+from midi_mapper.utils import input_message_passer
+from midi_mapper.utils import input_raw_passer
+from midi_mapper.utils import write_now
+from midi_mapper.workers import PortWorker
+
+
+class Stream:
+    """Midi stream recording what the pipeline would get."""
+
+    def __init__(self):
+        self.items = []
+
+    def on_next(self, item):
+        self.items.append(item)
+
+    def on_raw(self, data, device):
+        self.items.append((data, device))
+
+
+def test_forward(recording_port):
+    slave1, slave2, synth = (
+        recording_port(name) for name in ('Slave 1', 'Slave 2', 'Synth'))
+    worker = PortWorker(slave2, write_now)
+    store.update('outports', MultiPort([slave1, worker, synth]))
+    lane = RealTimeLane(write_now)
+    lane.configure('Master', 'Slave 1, Slave 2')
+    for status in (0xFA, 0xF8, 0xF8, 0xF8, 0xFC):
+        lane.forward(status)
+    expected = [b'\xfa', b'\xf8', b'\xf8', b'\xf8', b'\xfc']
+    assert slave1.data == expected
+    # worker queues are bypassed
+    assert slave2.data == expected
+    assert worker.stats()['sent'] == 0
+    assert synth.data == []
+    stats = lane.stats()
+    assert stats['forwarded'] == 5
+    assert stats['latency']['count'] == 5
+    # two clock intervals give one jitter sample
+    assert stats['jitter']['count'] == 1
+
+    # outports are looked up again when they change
+    store.update('outports', MultiPort([synth]))
+    lane.configure('Master')
+    lane.forward(0xF8)
+    assert synth.data == [b'\xf8']
+    store.update('outports', None)
+
+
+def test_forward_waits_for_port(recording_port):
+    port = recording_port('Slave')
+    worker = PortWorker(port, write_now)
+    store.update('outports', MultiPort([worker]))
+    lane = RealTimeLane(write_now)
+    lane.configure('Master')
+    lane.forward(0xF8)
+    # a write by the worker holds the port's lock until it is done
+    lock = utils.port_locks[port]
+    with lock:
+        forward = threading.Thread(target=lane.forward, args=(0xF8,))
+        forward.start()
+        forward.join(0.05)
+        assert forward.is_alive()
+        assert port.data == [b'\xf8']
+    forward.join(1)
+    assert port.data == [b'\xf8', b'\xf8']
+    worker.close()
+    utils.forget_port(worker)
+    assert port not in utils.port_locks
+    store.update('outports', None)
+
+
+def test_passers(monkeypatch, recording_port):
+    port = recording_port('Slave')
+    store.update('outports', MultiPort([port]))
+    lane = RealTimeLane(write_now)
+    lane.configure('Master')
+    monkeypatch.setattr(utils, 'lane', lane)
+    stream = Stream()
+
+    raw = input_raw_passer('Master', stream)
+    raw(([0xF8], 0.0), None)
+    raw(([0xB0, 1, 2], 0.0), None)
+    input_raw_passer('Other', stream)(([0xF8], 0.0), None)
+    assert port.data == [b'\xf8']
+    assert stream.items == [([0xB0, 1, 2], 'Master')]
+
+    passer = input_message_passer('Master', stream)
+    passer(Message(type='start'))
+    passer(Message(type='songpos'))
+    input_message_passer('Other', stream)(Message(type='stop'))
+    assert port.data == [b'\xf8', b'\xfa']
+    assert len(stream.items) == 1
+    store.update('outports', None)
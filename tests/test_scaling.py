@@ -0,0 +1,66 @@
+"""Test functions related to scaling tables."""
+from midi_mapper.mappings import Mapping
+from midi_mapper.scaling import build_table
+from midi_mapper.stream import calculate_range
+
+
+def test_linear_matches_calculate_range():
+    for range_ in (None, (0, 16), (100, 110), (127, 0), (0, 16383)):
+        table = build_table(range_)
+        assert len(table) == 128
+        for level in range(128):
+            assert table[level] == calculate_range(range_, level)
+
+
+def test_curves():
+    invert = build_table(None, 'invert')
+    assert (invert[0], invert[127]) == (127, 0)
+
+    for curve in ('log', 'exp'):
+        table = build_table((10, 20), curve)
+        assert (table[0], table[127]) == (10, 20)
+        assert list(table) == sorted(table)
+    assert build_table(None, 'log')[32] > 32 > build_table(None, 'exp')[32]
+
+    assert build_table(None, 'unknown') == build_table(None)
+
+
+def test_14_bit():
+    table = build_table(None, bits=14)
+    assert len(table) == 16384
+    assert (table[0], table[8192], table[16383]) == (-8192, 0, 8191)
+    table = build_table((0, 127), bits=14)
+    assert (table[0], table[16383]) == (0, 127)
+
+
+def test_mapping_scale():
+    # pitchwheel input to control change output
+    mapping = Mapping.from_dict({
+        'type': 'pitchwheel', 'o-type': 'control_change', 'o-range': '0-127'})
+    assert mapping.scale[-8192 + mapping.offset] == 0
+    assert mapping.scale[8191 + mapping.offset] == 127
+
+    # without a range 14-bit inputs cover the whole 7-bit output
+    for o_type in ('control_change', 'polytouch', 'aftertouch'):
+        mapping = Mapping.from_dict({'type': 'pitchwheel', 'o-type': o_type})
+        assert (min(mapping.scale), max(mapping.scale)) == (0, 127)
+    mapping = Mapping.from_dict({'type': 'pitchwheel', 'o-control': '1:2'})
+    assert (mapping.scale[0], mapping.scale[16383]) == (0, 16383)
+    assert mapping.bits == 14
+    mapping = Mapping.from_dict({'type': 'pitchwheel', 'o-type': 'pitchwheel'})
+    assert mapping.scale[-8192 + mapping.offset] == -8192
+
+    # control change input to a full pitchwheel range
+    mapping = Mapping.from_dict({
+        'type': 'control_change', 'o-type': 'pitchwheel',
+        'o-range': '0-16383'})
+    assert (mapping.scale[0], mapping.scale[127]) == (-8192, 8191)
+    assert mapping.bits == 14
+
+    mapping = Mapping.from_dict({
+        'o-type': 'control_change', 'o-control': '1:2',
+        'o-range': '0-16383', 'o-curve': 'Exp'})
+    assert mapping.bits == 14
+    assert mapping.curve == 'exp'
+    mapping = Mapping.from_dict({'o-control': '1:2', 'o-range': '0-127'})
+    assert mapping.bits == 7
@@ -0,0 +1,79 @@
+"""Test functions related to the output scheduler."""
+import time
+
+from midi_mapper.scheduler import Scheduler
+
+
+class Clock:
+    """Clock that only moves when told to."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def create_scheduler(clock):
+    writes = []
+    scheduler = Scheduler(
+        lambda port, data: writes.append((port, data)),
+        lambda port, value: bytes(value),
+        clock=clock,
+    )
+    scheduler.configure('10,slow=2')
+    return scheduler, writes
+
+
+def test_configure():
+    scheduler, _ = create_scheduler(Clock())
+    assert scheduler.enabled
+    assert scheduler.rate == 10
+    assert scheduler.rates == {'slow': 2}
+    assert scheduler.interval('fast') == 0.1
+    scheduler.configure('')
+    assert not scheduler.enabled
+
+
+def test_coalesce():
+    clock = Clock()
+    scheduler, writes = create_scheduler(clock)
+    # first value goes straight out, later ones wait for the interval
+    scheduler.send('port', 1, b'\xB0\x01\x00')
+    scheduler.send('port', 1, b'\xB0\x01\x01')
+    scheduler.send('port', 2, [0xB0, 2, 5])
+    scheduler.send('port', 1, b'\xB0\x01\x02')
+    assert writes == [('port', b'\xB0\x01\x00')]
+    assert scheduler.stats() == {'coalesced': 1, 'flushes': 1, 'pending': 2}
+
+    # latest value wins and pending values are written together
+    clock.now = 0.1
+    scheduler.flush()
+    assert writes[1] == ('port', b'\xB0\x01\x02\xB0\x02\x05')
+    assert scheduler.pending == {}
+
+
+def test_write_keeps_order():
+    clock = Clock()
+    scheduler, writes = create_scheduler(clock)
+    scheduler.send('port', 1, b'\xB0\x01\x00')
+    scheduler.send('port', 1, b'\xB0\x01\x7F')
+    scheduler.write('port', b'\x90\x3C\x7F')
+    assert writes == [
+        ('port', b'\xB0\x01\x00'),
+        ('port', b'\xB0\x01\x7F'),
+        ('port', b'\x90\x3C\x7F'),
+    ]
+
+
+def test_background_flush():
+    writes = []
+    scheduler = Scheduler(lambda port, data: writes.append(data), bytes)
+    scheduler.configure('1000')
+    scheduler.send('port', 1, b'\xB0\x01\x00')
+    scheduler.send('port', 1, b'\xB0\x01\x7F')
+    for _ in range(1000):
+        if len(writes) == 2:
+            break
+        time.sleep(0.001)
+    assert writes == [b'\xB0\x01\x00', b'\xB0\x01\x7F']
@@ -0,0 +1,98 @@
+"""Test functions related to running inputs in shard processes."""
+from midi_mapper import stream
+from midi_mapper.constants import OutputType
+from midi_mapper.mappings import Mapping
+from midi_mapper.shards import Shards
+from midi_mapper.shards import bank_numbers
+from midi_mapper.shards import shard_mappings
+from midi_mapper.shards import split
+from midi_mapper.utils import VIRTUAL_PORT
+
+
+class Events:
+    """Queue recording what is put on it."""
+
+    def __init__(self):
+        self.items = []
+
+    def put(self, item):
+        self.items.append(item)
+
+
+def test_split():
+    assert split(['a', 'b', 'c'], 2) == [['a', 'c'], ['b']]
+    assert split(['a'], 3) == [['a']]
+    assert split([], 2) == []
+    # devices sending to the virtual port all go to the first shard
+    assert split(['a', 'b', 'c', 'd'], 2, {'b', 'd'}) == [
+        ['b', 'd', 'a'], ['c']]
+    assert split(['a', 'b', 'c'], 2, {'c'}) == [['c', 'a'], ['b']]
+
+
+def test_shard_mappings():
+    rows = [
+        Mapping.from_dict({'input-device': device})
+        for device in ('Left', 'Right', 'Unplugged')]
+    left, right, unplugged = rows
+    inputs = ['Left', 'Right']
+    assert shard_mappings(rows, ['Left'], inputs, True) == [left, unplugged]
+    assert shard_mappings(rows, ['Right'], inputs, False) == [right]
+
+    # only the first shard has the virtual port
+    virtual = Mapping.from_dict({
+        'input-device': 'Right', 'output-device': VIRTUAL_PORT})
+    rows.append(virtual)
+    assert shard_mappings(rows, ['Right'], inputs, False) == [right]
+    assert shard_mappings(rows, ['Right'], inputs, True) == [
+        right, unplugged, virtual]
+
+
+def test_relay():
+    shards = Shards(2)
+    shards.events = [Events(), Events()]
+    shards.relay(OutputType.MM_BANK_CHANGE, 2)
+    shards.relay(OutputType.MM_PROGRAM_CHANGE, 5)
+    assert shards.active_bank == 2
+    assert shards.relayed == 2
+    for events in shards.events:
+        assert events.items == [
+            (OutputType.MM_BANK_CHANGE, 2), (OutputType.MM_PROGRAM_CHANGE, 5)]
+
+
+def test_broadcast(monkeypatch):
+    changes = []
+    monkeypatch.setattr(
+        stream, 'broadcast', lambda *change: changes.append(change))
+    bank = Mapping.from_dict({
+        'o-type': 'mm_bank_change', 'o-channel': '0', 'o-control': '2'})
+    stream.translate_and_send(bank)
+    assert changes == [(OutputType.MM_BANK_CHANGE, 2)]
+    assert stream.store.get('active_bank') != 2
+
+
+def test_bank_without_bank_controls():
+    rows = [
+        Mapping.from_dict({
+            'input-device': 'Left', 'type': 'note_on', 'bank': '0',
+            'channel': '1', 'control': str(bank),
+            'o-type': 'mm_bank_change', 'o-channel': '-',
+            'o-control': str(bank)})
+        for bank in (1, 2)]
+    right = Mapping.from_dict({
+        'input-device': 'Right', 'type': 'control_change', 'bank': '2',
+        'channel': '1', 'control': '7', 'o-type': 'control_change',
+        'o-channel': '1', 'o-control': '7'})
+    banks = bank_numbers(rows + [right])
+    assert banks == {1, 2}
+
+    # the shard of 'Right' has no bank controls but follows the others
+    stream.store.update('mappings', [right])
+    stream.store.update('active_bank', 0)
+    stream.set_bank(1, initial=True, banks=banks)
+    assert stream.store.get('active_bank') == 1
+    stream.apply_change(OutputType.MM_BANK_CHANGE, 2, banks)
+    assert stream.store.get('active_bank') == 2
+    assert stream.lookup(('control_change', 1, 7), 5, 'Right') == [right]
+    stream.apply_change(OutputType.MM_BANK_CHANGE, 3, banks)
+    assert stream.store.get('active_bank') == 2
+    stream.store.update('mappings', [])
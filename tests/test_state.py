@@ -0,0 +1,61 @@
+"""Test functions related to the mutable state."""
+import queue
+
+from midi_mapper.state import State
+from midi_mapper.store import store
+
+
+def test_load(mappings_bank_set):
+    state = State()
+    state.load(mappings_bank_set)
+    assert [m.slot for m in mappings_bank_set] == [0, 1, 0, 0]
+    assert {bank: len(a) for bank, a in state.memory.items()} == {
+        0: 2, 1: 1, 2: 1}
+
+    state.set_memory(1, 0, 78)
+    state.set_memory(2, 0, None)
+    assert state.get_memory(1, 0) == 78
+    assert state.get_memory(2, 0) == 0
+    assert state.get_memory(3, 0) == 0
+    state.set_memory(3, 0, 1)
+    assert 3 not in state.memory
+
+
+def test_load_keep(mappings_bank_set):
+    state = State()
+    state.load(mappings_bank_set)
+    state.set_memory(1, 0, 78)
+    state.set_memory(2, 0, 89)
+    first, second, wheel1, wheel2 = mappings_bank_set
+    state.load([wheel1, first, second], keep=True, removed=[wheel2])
+    assert state.memory[1][wheel1.slot] == 78
+    assert 2 not in state.memory
+    assert wheel2.slot == -1
+    # updates to removed mappings are ignored
+    state.remember([wheel2], 1)
+    assert state.memory[1][0] == 78
+
+
+def test_mapping_memory(mappings_bank_set):
+    store.update('mappings', mappings_bank_set)
+    mappings_bank_set[2].memory = 64
+    assert mappings_bank_set[2].memory == 64
+    assert mappings_bank_set[3].memory == 0
+
+    # mappings that are not loaded have no memory
+    store.update('mappings', [])
+    mappings_bank_set[2].slot = -1
+    mappings_bank_set[2].memory = 1
+    assert mappings_bank_set[2].memory == 0
+
+
+def test_subscribe():
+    changes = queue.Queue()
+    state = State()
+    state.set_bank(1)
+    state.subscribe(lambda key, value: changes.put((key, value)))
+    state.set_bank(2)
+    state.load([])
+    assert changes.get(timeout=1) == ('active_bank', 2)
+    assert changes.get(timeout=1) == ('memory', {})
+    assert state.active_bank == 2
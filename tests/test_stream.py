@@ -1,13 +1,21 @@
 """Test functions related to midi stream."""
+from types import SimpleNamespace
 from unittest.mock import call, patch
 
 from mido import Message
 
+from mido.ports import MultiPort
+
+from midi_mapper.logger import LogSink
+from midi_mapper.mappings import Mapping
 from midi_mapper.stream import get_translations
 from midi_mapper.stream import calculate_range
 from midi_mapper.stream import log
+from midi_mapper.stream import lookup
 from midi_mapper.stream import process_midi
 from midi_mapper.stream import set_bank
+from midi_mapper.stream import set_program
+from midi_mapper.stream import state
 from midi_mapper.stream import store
 from midi_mapper.stream import translate_and_send
 
@@ -82,18 +90,17 @@ def test_process_real_time(real_time):
     }
 
 
-@patch('midi_mapper.stream.send_message')
-def test_real_time1(send_message_mock, mappings_real_time):
+@patch('midi_mapper.stream.send_template')
+def test_real_time1(send_template_mock, mappings_real_time):
     store.update('mappings', mappings_real_time)
 
     midi = Message(type='note_on', channel=0, note=1, velocity=127)
     send_midi_through_the_stream(midi)
-    assert send_message_mock.called is True
-    assert send_message_mock.call_count == 1
-    cmd = mappings_real_time[0]['o-type']
-    expected = call(
-        {'type': cmd, 'channel': None, 'status': None, 'level': None})
-    assert send_message_mock.call_args == expected
+    assert send_template_mock.called is True
+    assert send_template_mock.call_count == 1
+    assert send_template_mock.call_args == call(mappings_real_time[0], 0)
+    cmd = mappings_real_time[0].o_type.value
+    assert mappings_real_time[0].template == Message(type=cmd).bin()
 
 
 def test_real_time2(mappings_real_time):
@@ -143,6 +150,27 @@ def test_get_translations_bank0(mappings_bank0):
     assert len(ret) == 1
 
 
+def test_get_translations_device(mappings_bank0):
+    other = Mapping.from_dict({
+        'input-device': 'OtherController', 'type': 'note_on',
+        'channel': '1', 'control': '11', 'bank': '0'})
+    store.update('mappings', mappings_bank0 + [other])
+    store.update('inports', MultiPort([
+        SimpleNamespace(name='TestControllerIn'),
+        SimpleNamespace(name='OtherController')]))
+    store.update('active_bank', 0)
+
+    data = process_midi(
+        Message(type='note_on', channel=0, note=11, velocity=0))
+    assert get_translations(dict(data, device='TestControllerIn')) == \
+        [mappings_bank0[0]]
+    assert get_translations(dict(data, device='OtherController')) == [other]
+    # messages from unknown ports match every mapping
+    assert len(get_translations(dict(data, device='Unknown'))) == 2
+    assert len(get_translations(data)) == 2
+    store.update('inports', None)
+
+
 def test_get_translations_bank1(mappings_bank1):
     # Ensure mappings are set for these tests
     store.update('mappings', mappings_bank1)
@@ -164,7 +192,6 @@ def test_get_translations_bank1(mappings_bank1):
     assert len(ret) == 1
 
 
-@patch('midi_mapper.stream.print', lambda _: [])
 def test_check_log(mappings_bank1):
     store.update('mappings', mappings_bank1)
     store.update('active_bank', 1)
@@ -172,7 +199,13 @@ def test_check_log(mappings_bank1):
     midi = Message(type='note_on', channel=2, note=33, velocity=0)
     ret = get_translations(process_midi(midi))
     assert len(ret) == 1
-    log(translate_and_send(ret[0]))
+
+    lines = []
+    with patch('midi_mapper.stream.sink', LogSink(write=lines.append)) as sink:
+        log(translate_and_send(ret[0]))
+        sink.flush()
+    assert len(lines) == 1
+    assert lines[0].startswith('[1] | TestControll | Button1')
 
 
 def test_translate_and_send0(mappings_bank0):
@@ -184,9 +217,9 @@ def test_translate_and_send0(mappings_bank0):
     assert len(ret) == 1
 
     ret = translate_and_send(ret[0])
-    assert ret['type'] == midi.type
-    assert int(ret['channel']) == midi.channel + 1
-    assert int(ret['control']) == midi.note
+    assert ret.type == midi.type
+    assert ret.channel == midi.channel + 1
+    assert ret.control == midi.note
 
     store.update('active_bank', 1)
 
@@ -195,9 +228,9 @@ def test_translate_and_send0(mappings_bank0):
     assert len(ret) == 1
 
     ret = translate_and_send(ret[0])
-    assert ret['type'] == midi.type
-    assert int(ret['channel']) == midi.channel + 1
-    assert int(ret['control']) == midi.note
+    assert ret.type == midi.type
+    assert ret.channel == midi.channel + 1
+    assert ret.control == midi.note
 
 
 def test_translate_and_send1(mappings_bank1):
@@ -215,9 +248,9 @@ def test_translate_and_send1(mappings_bank1):
     assert len(ret) == 1
 
     ret = translate_and_send(ret[0])
-    assert ret['type'] == midi.type
-    assert int(ret['channel']) == midi.channel + 1
-    assert int(ret['control']) == midi.note
+    assert ret.type == midi.type
+    assert ret.channel == midi.channel + 1
+    assert ret.control == midi.note
 
 
 def send_midi_through_the_stream(midi):
@@ -250,8 +283,8 @@ def test_check_memory(mappings_bank_set):
 
     bank1_element = 2
     bank2_element = 3
-    assert store.get('mappings')[bank1_element]['memory'] == 0
-    assert store.get('mappings')[bank2_element]['memory'] == 0
+    assert store.get('mappings')[bank1_element].memory == 0
+    assert store.get('mappings')[bank2_element].memory == 0
 
     # no bank selected the next messages should be ignored
     midi = Message(type='control_change', channel=6, control=77, value=64)
@@ -259,8 +292,8 @@ def test_check_memory(mappings_bank_set):
     midi = Message(type='control_change', channel=7, control=88, value=89)
     send_midi_through_the_stream(midi)
     assert store.get('active_bank') == 0
-    assert store.get('mappings')[bank1_element]['memory'] == 0
-    assert store.get('mappings')[bank2_element]['memory'] == 0
+    assert store.get('mappings')[bank1_element].memory == 0
+    assert store.get('mappings')[bank2_element].memory == 0
 
     # change to bank 1
     midi = Message(type='note_on', channel=4, note=55, velocity=0)
@@ -271,8 +304,8 @@ def test_check_memory(mappings_bank_set):
     send_midi_through_the_stream(midi)
     midi = Message(type='control_change', channel=7, control=88, value=89)
     send_midi_through_the_stream(midi)
-    assert store.get('mappings')[bank1_element]['memory'] == 78
-    assert store.get('mappings')[bank2_element]['memory'] == 0
+    assert store.get('mappings')[bank1_element].memory == 78
+    assert store.get('mappings')[bank2_element].memory == 0
 
     # change to bank 2
     midi = Message(type='note_on', channel=5, note=66, velocity=0)
@@ -283,8 +316,8 @@ def test_check_memory(mappings_bank_set):
     send_midi_through_the_stream(midi)
     midi = Message(type='control_change', channel=7, control=88, value=89)
     send_midi_through_the_stream(midi)
-    assert store.get('mappings')[bank1_element]['memory'] == 78
-    assert store.get('mappings')[bank2_element]['memory'] == 89
+    assert store.get('mappings')[bank1_element].memory == 78
+    assert store.get('mappings')[bank2_element].memory == 89
 
     # change to bank 1
     midi = Message(type='note_on', channel=4, note=55, velocity=0)
@@ -295,8 +328,8 @@ def test_check_memory(mappings_bank_set):
     send_midi_through_the_stream(midi)
     midi = Message(type='control_change', channel=7, control=88, value=89)
     send_midi_through_the_stream(midi)
-    assert store.get('mappings')[bank1_element]['memory'] == 127
-    assert store.get('mappings')[bank2_element]['memory'] == 89
+    assert store.get('mappings')[bank1_element].memory == 127
+    assert store.get('mappings')[bank2_element].memory == 89
 
 
 def test_calculate_range(mappings_bank_set):
@@ -305,19 +338,19 @@ def test_calculate_range(mappings_bank_set):
 
     midi = Message(type='control_change', channel=6, control=77, value=17)
     ret = send_midi_through_the_stream(midi)
-    expected = calculate_range(ret['o-range'], 17)
-    assert ret['o-level'] == expected
+    expected = calculate_range(ret.o_range, 17)
+    assert ret.o_level == expected
 
     midi = Message(type='control_change', channel=6, control=77, value=101)
     ret = send_midi_through_the_stream(midi)
-    expected = calculate_range(ret['o-range'], 101)
-    assert ret['o-level'] == expected
+    expected = calculate_range(ret.o_range, 101)
+    assert ret.o_level == expected
 
     store.update('active_bank', 2)
     midi = Message(type='control_change', channel=7, control=88, value=89)
     ret = send_midi_through_the_stream(midi)
-    expected = calculate_range(ret['o-range'], 89)
-    assert ret['o-level'] == expected
+    expected = calculate_range(ret.o_range, 89)
+    assert ret.o_level == expected
 
 
 def test_set_bank(mappings_bank_set):
@@ -354,38 +387,108 @@ def test_set_program1(set_program_mock, mappings_set_program):
     send_midi_through_the_stream(midi)
     assert set_program_mock.called is True
     assert set_program_mock.call_count == 1
-    expected = int(mappings_set_program[0]['o-control'])
+    expected = mappings_set_program[0].o_control
     set_program_mock.assert_called_with(expected)
     # Program change 2
     midi = Message(type='note_on', channel=9, note=111, velocity=127)
     send_midi_through_the_stream(midi)
-    expected = int(mappings_set_program[1]['o-control'])
+    expected = mappings_set_program[1].o_control
     set_program_mock.assert_called_with(expected)
     assert set_program_mock.call_count == 2
 
 
-@patch('midi_mapper.stream.send_message')
-def test_set_program2(send_message_mock, mappings_set_program):
+@patch('midi_mapper.stream.send_messages')
+def test_set_program2(send_messages_mock, mappings_set_program):
     store.update('mappings', mappings_set_program)
     store.update('active_bank', 0)
 
-    assert send_message_mock.called is False
-    assert send_message_mock.call_count == 0
+    assert send_messages_mock.called is False
+    assert send_messages_mock.call_count == 0
 
-    # Program change 1
+    # Program change 1, sent as one batch
     midi = Message(type='note_on', channel=8, note=99, velocity=127)
     send_midi_through_the_stream(midi)
-    assert send_message_mock.called is True
-    assert send_message_mock.call_count == 3
-    calls = send_message_mock.call_args_list
-    assert calls[0][0][0]['type'] == 'note_on'
-    assert calls[1][0][0]['type'] == 'program_change'
-    assert calls[2][0][0]['type'] == 'note_off'
+    assert send_messages_mock.called is True
+    assert send_messages_mock.call_count == 1
+    msgs = send_messages_mock.call_args[0][0]
+    assert [m['type'] for m in msgs] == [
+        'note_on', 'program_change', 'note_off']
     # Program change 2
     midi = Message(type='note_on', channel=9, note=111, velocity=127)
     send_midi_through_the_stream(midi)
-    assert send_message_mock.call_count == 6
-    calls = send_message_mock.call_args_list
-    assert calls[3][0][0]['type'] == 'note_off'
-    assert calls[4][0][0]['type'] == 'note_on'
-    assert calls[5][0][0]['type'] == 'program_change'
+    assert send_messages_mock.call_count == 2
+    msgs = send_messages_mock.call_args[0][0]
+    assert [m['type'] for m in msgs] == [
+        'note_off', 'note_on', 'program_change']
+
+
+def test_set_program_batch(mappings_set_program, recording_port):
+    port = recording_port('Program Change')
+    store.update('mappings', mappings_set_program)
+    store.update('outports', MultiPort([port]))
+
+    set_program(2)
+    assert port.data == [
+        bytes([0x88, 99, 0]), bytes([0x99, 111, 127]), bytes([0xCF, 2])]
+    store.update('outports', None)
+
+
+def test_set_bank_resets(mappings_bank_set, recording_port):
+    controller = recording_port('TestControllerIn')
+    bank = recording_port('Bank')
+    store.update('mappings', mappings_bank_set)
+    store.update('outports', MultiPort([controller, bank]))
+    mappings_bank_set[2].memory = 78
+
+    set_bank(1, initial=True)
+    # button for bank 1 on and bank 2 off
+    assert bank.data == [bytes([0x94, 55, 127]), bytes([0x85, 66, 0])]
+    assert controller.data == [bytes([0xB6, 77, 78])]
+
+    set_bank(2)
+    assert bank.data[2:] == [bytes([0x84, 55, 0])]
+    assert controller.data[1:] == [bytes([0xB7, 88, 0])]
+    store.update('outports', None)
+
+
+def test_set_bank_delta_resets(mappings_bank_set, recording_port):
+    controller = recording_port('TestControllerIn')
+    bank = recording_port('Bank')
+    store.update('mappings', mappings_bank_set)
+    store.update('outports', MultiPort([controller, bank]))
+    mappings_bank_set[2].memory = 78
+
+    set_bank(1, initial=True)
+    set_bank(2)
+    assert len(controller.data) == 2
+    # bank 1 control still shows 78 so nothing is resent
+    set_bank(1)
+    assert len(controller.data) == 2
+    # control moved on the controller while bank 2 was active
+    state.shown_on(controller)[6 * 128 + 77] = 5
+    set_bank(1)
+    assert controller.data[2] == bytes([0xB6, 77, 78])
+    set_bank(1, force=True)
+    assert controller.data[3] == bytes([0xB6, 77, 78])
+    # initial implies force
+    set_bank(1, initial=True)
+    assert controller.data[4] == bytes([0xB6, 77, 78])
+    store.update('outports', None)
+
+
+def test_set_bank_shown_unmatched(mappings_bank_set, recording_port):
+    controller = recording_port('TestControllerIn')
+    bank = recording_port('Bank')
+    store.update('mappings', mappings_bank_set)
+    store.update('outports', MultiPort([controller, bank]))
+    key = ('control_change', 8, 88)
+
+    set_bank(2, initial=True)
+    assert lookup(key, 50, 'TestControllerIn') == [mappings_bank_set[3]]
+    set_bank(1)
+    # knob turned while bank 1 is active, where no row matches it
+    assert lookup(key, 100, 'TestControllerIn') == []
+    controller.data = []
+    set_bank(2)
+    assert controller.data == [bytes([0xB7, 88, 50])]
+    store.update('outports', None)
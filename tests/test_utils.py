@@ -1,19 +1,40 @@
 """Test functions related to midi utils."""
 import pytest
 
+from types import SimpleNamespace
 from unittest.mock import patch
 
 import mido
 from mido import Message
+from mido.ports import MultiPort
 
 from rx.subject import Subject
 
+from midi_mapper import utils
+from midi_mapper.logger import DEBUG
+from midi_mapper.logger import LogSink
+from midi_mapper.mappings import Mapping
 from midi_mapper.store import store
 from midi_mapper.utils import create_midi
 from midi_mapper.utils import create_nrpn
 from midi_mapper.utils import input_message
+from midi_mapper.utils import input_raw
 from midi_mapper.utils import set_io_ports
 from midi_mapper.utils import send_message
+from midi_mapper.utils import send_messages
+from midi_mapper.utils import send_template
+from midi_mapper.utils import write
+
+
+class MessagePort:
+    """Output port that only accepts mido messages."""
+
+    def __init__(self):
+        self.name = 'MessagePort'
+        self.messages = []
+
+    def send(self, midi):
+        self.messages.append(midi)
 
 
 @pytest.fixture()
@@ -37,6 +58,26 @@ def test_set_io_ports(no_io):
     assert len(store.get('outports').ports) == 1
 
 
+@patch('midi_mapper.utils.print', lambda _: [])
+def test_set_io_ports_concurrent(monkeypatch):
+    monkeypatch.setattr(mido, 'get_input_names', lambda: ['In 1', 'In 2'])
+    monkeypatch.setattr(
+        mido, 'get_output_names', lambda: ['Out', 'Midi Through'])
+    monkeypatch.setattr(
+        mido, 'open_input', lambda name, callback: SimpleNamespace(name=name))
+    monkeypatch.setattr(
+        mido, 'open_output',
+        lambda name, virtual=False: SimpleNamespace(name=name))
+    timings = {}
+    set_io_ports(Subject(), concurrent=True, timings=timings)
+    assert [p.name for p in store.get('inports').ports] == ['In 1', 'In 2']
+    assert [p.name for p in store.get('outports').ports] == [
+        'PythonMidi', 'Out']
+    assert set(timings) == {'enumerate', 'open'}
+    store.update('inports', None)
+    store.update('outports', None)
+
+
 def test_input_message():
     result = []
 
@@ -50,19 +91,37 @@ def test_input_message():
 
     input_message(Message(type='clock'), midi_stream)
     assert result == []
-    input_message(midi, midi_stream)
+    input_message(midi, midi_stream, 'TestController')
     input_message(Message(type='start'), midi_stream)
-    assert result == [midi]
+    assert result == [(midi, 'TestController')]
+
     input_message(Message(type='stop'), midi_stream)
-    assert result == [midi]
+    assert result == [(midi, 'TestController')]
     input_message(midi, midi_stream)
-    assert result == [midi, midi]
+    assert result == [(midi, 'TestController'), (midi, None)]
     input_message(Message(type='clock'), midi_stream)
-    assert result == [midi, midi]
+    assert len(result) == 2
     input_message(Message(type='songpos'), midi_stream)
-    assert result == [midi, midi]
+    assert len(result) == 2
     input_message(Message(type='sysex'), midi_stream)
-    assert result == [midi, midi]
+    assert len(result) == 2
+
+
+def test_input_debug_log(monkeypatch):
+    lines = []
+    monkeypatch.setattr(utils, 'sink', LogSink(write=lines.append))
+    pipeline = SimpleNamespace(
+        on_next=lambda _: None, on_raw=lambda data, device: None)
+    midi = Message(type='control_change', channel=0, control=1, value=64)
+    input_message(midi, pipeline, 'Controller')
+    utils.sink.verbosity = DEBUG
+    input_message(midi, pipeline, 'Controller')
+    input_raw(midi.bytes(), pipeline)
+    utils.sink.flush()
+    assert lines == [
+        f'[in] | Controller   | {midi}',
+        f'[in] | -            | {midi}',
+    ]
 
 
 def test_send_midi():
@@ -128,15 +187,15 @@ def test_send_nrpn():
     msg = {
         'type': 'control_change',
         'channel': 0,
-        'status': '12:13',
+        'status': (12, 13),
         'level': 127,
     }
-    status = msg['status'].split(':')
+    status = msg['status']
     midi_notes = create_nrpn(msg)
     assert midi_notes[0] == Message(
-        type='control_change', channel=0, control=99, value=int(status[0]))
+        type='control_change', channel=0, control=99, value=status[0])
     assert midi_notes[1] == Message(
-        type='control_change', channel=0, control=98, value=int(status[1]))
+        type='control_change', channel=0, control=98, value=status[1])
     assert midi_notes[2] == Message(
         type='control_change', channel=0, control=6, value=msg['level'])
     assert midi_notes[3] == Message(
@@ -154,7 +213,102 @@ def test_send_message():
     msg = {
         'type': 'program_change',
         'channel': 0,
-        'status': '12:13',
+        'status': (12, 13),
         'level': 0,
     }
     send_message(msg)
+
+
+@patch.object(store, 'get', lambda _: MultiPort([]))
+def test_send_messages_batch(monkeypatch, recording_port):
+    monkeypatch.setattr(utils, 'nrpn_params', {})
+    port = recording_port('Synth')
+    nrpn = {
+        'type': 'control_change',
+        'channel': 1,
+        'status': (12, 13),
+        'level': 64,
+        'port': port,
+    }
+    send_messages([nrpn])
+    assert port.data == [
+        bytes([0xB1, 99, 12]), bytes([0xB1, 98, 13]),
+        bytes([0xB1, 6, 64]), bytes([0xB1, 38, 0])]
+
+    # parameter is still active so only the data entry is sent
+    port.data = []
+    send_messages([nrpn, {**nrpn, 'status': 14, 'level': 1}])
+    assert port.data == [
+        bytes([0xB1, 6, 64]), bytes([0xB1, 38, 0]), bytes([0xB1, 14, 1])]
+
+    port.data = []
+    monkeypatch.setattr(utils, 'NRPN_RESELECT', True)
+    send_message(nrpn)
+    assert port.data == [
+        bytes([0xB1, 99, 12]), bytes([0xB1, 98, 13]),
+        bytes([0xB1, 6, 64]), bytes([0xB1, 38, 0])]
+
+    send_message({**nrpn, 'level': 1000, 'bits': 14})
+    assert port.data[-2:] == [bytes([0xB1, 6, 7]), bytes([0xB1, 38, 104])]
+
+
+def test_write_rtmidi(recording_port):
+    port = recording_port('Synth')
+    write(port, bytes([0xF8, 0xC0, 5, 0x90, 1, 127, 0xD1, 9, 0xFA]))
+    assert port.data == [
+        bytes([0xF8]), bytes([0xC0, 5]), bytes([0x90, 1, 127]),
+        bytes([0xD1, 9]), bytes([0xFA])]
+
+
+def test_write_split():
+    port = MessagePort()
+    write(MultiPort([port]), bytes([0x90, 1, 127, 0xB0, 7, 64]))
+    assert port.messages == [
+        Message(type='note_on', channel=0, note=1, velocity=127),
+        Message(type='control_change', channel=0, control=7, value=64),
+    ]
+
+
+@patch.object(store, 'get', lambda _: None)
+def test_send_template(recording_port):
+    port = recording_port('Synth')
+    mapping = Mapping.from_dict({
+        'o-type': 'pitchwheel', 'o-channel': '1', 'o-control': '-'})
+    mapping.output_port = port
+    send_template(mapping, -8192)
+    send_template(mapping, 8191)
+    mapping = Mapping.from_dict({
+        'o-type': 'control_change', 'o-channel': '2', 'o-control': '3'})
+    mapping.output_port = port
+    send_template(mapping, 100)
+    assert port.data == [
+        Message(type='pitchwheel', pitch=-8192).bin(),
+        Message(type='pitchwheel', pitch=8191).bin(),
+        Message(type='control_change', channel=1, control=3, value=100).bin(),
+    ]
+
+    # unbound mappings without outports send nothing
+    mapping.output_port = None
+    send_template(mapping, 100)
+    assert len(port.data) == 3
+
+
+@patch.object(store, 'get', lambda _: None)
+def test_send_template_scheduled(recording_port):
+    port = recording_port('Synth')
+    cc = Mapping.from_dict({
+        'o-type': 'control_change', 'o-channel': '1', 'o-control': '3'})
+    note = Mapping.from_dict({
+        'o-type': 'note_on', 'o-channel': '1', 'o-control': '60'})
+    cc.output_port = note.output_port = port
+    utils.scheduler.configure('1')
+    try:
+        send_template(cc, 1)
+        send_template(cc, 2)
+        send_template(cc, 3)
+        assert port.data == [bytes([0xB0, 3, 1])]
+        # notes flush the pending value first
+        send_template(note, 0)
+        assert port.data[1:] == [bytes([0xB0, 3, 3]), bytes([0x90, 60, 127])]
+    finally:
+        utils.scheduler.configure('0')
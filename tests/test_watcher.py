@@ -0,0 +1,67 @@
+"""Test functions related to reloading mapping files."""
+import os
+
+from midi_mapper import mappings
+from midi_mapper.logger import LogSink
+from midi_mapper.store import store
+from midi_mapper.watcher import MappingWatcher
+
+HEADER = 'input-device,type,bank,channel,control,output-device,type,' \
+    'channel,control\n'
+ROW1 = 'In,control_change,1,1,1,Out,control_change,1,10\n'
+ROW2 = 'In,control_change,1,1,2,Out,control_change,1,20\n'
+ROW3 = 'In,control_change,1,1,3,Out,control_change,1,30\n'
+ROW4 = 'In,control_change,1,1,4,Out,control_change,1,40\n'
+
+
+def write(path, *rows, mtime=None):
+    with open(path, 'w') as fd:
+        fd.write(HEADER + ''.join(rows))
+    if mtime is not None:
+        os.utime(path, ns=(mtime, mtime))
+
+
+def test_reload(tmp_path, monkeypatch):
+    lines = []
+    sink = LogSink(write=lines.append)
+    monkeypatch.setattr(mappings, 'MAPPINGS_FOLDER', str(tmp_path))
+    monkeypatch.setattr('midi_mapper.watcher.sink', sink)
+    write(tmp_path / 'a.csv', ROW1, ROW2, mtime=1)
+    write(tmp_path / 'b.csv', ROW3, mtime=1)
+
+    watcher = MappingWatcher()
+    store.update('mappings', watcher.load())
+    first, second, third = store.get('mappings')
+    first.memory = 11
+    second.memory = 22
+    third.memory = 33
+    assert not watcher.poll()
+
+    # second row changed, the others keep their mapping and memory
+    write(tmp_path / 'a.csv', ROW1, ROW2.replace(',20', ',21'), ROW4, mtime=2)
+    assert watcher.poll()
+    loaded = store.get('mappings')
+    assert len(loaded) == 4
+    assert loaded[0] is first and loaded[3] is third
+    assert [m.memory for m in loaded] == [11, 0, 0, 33]
+    assert second.slot == -1
+    assert store.get('index')[('control_change', 1, 2)][1][0].o_control == 21
+    assert ('control_change', 1, 4) in store.get('index')
+
+    # a broken file keeps its mappings
+    with open(tmp_path / 'b.csv', 'w') as fd:
+        fd.write('')
+    assert not watcher.poll()
+    assert store.get('mappings')[3] is third
+
+    os.remove(tmp_path / 'b.csv')
+    assert watcher.poll()
+    assert third not in store.get('mappings')
+    assert ('control_change', 1, 3) not in store.get('index')
+
+    store.update('mappings', [])
+    sink.flush()
+    assert lines[0].startswith('Reloaded a.csv in ')
+    assert lines[0].endswith(': 2 added, 1 removed')
+    assert lines[1].startswith('ERROR: ')
+    assert lines[2].endswith(': 0 added, 1 removed')
@@ -0,0 +1,134 @@
+"""Test functions related to output port workers."""
+import threading
+
+import pytest
+
+from mido import Message
+
+from midi_mapper import utils
+from midi_mapper.workers import BLOCK
+from midi_mapper.workers import COALESCE
+from midi_mapper.workers import DROP_OLDEST
+from midi_mapper.workers import PortWorker
+from midi_mapper.workers import coalesce_key
+from midi_mapper.workers import stats
+
+
+class GatedPort:
+    """Output port whose writes wait until the gate is opened."""
+
+    def __init__(self):
+        self.name = 'Gated'
+        self.data = []
+        self.closed = False
+        self.gate = threading.Event()
+        self.writing = threading.Event()
+
+    def close(self):
+        self.closed = True
+
+
+def create_worker(policy, maxsize=2):
+    port = GatedPort()
+
+    def write(port, data):
+        port.writing.set()
+        port.gate.wait()
+        port.data.append(data)
+
+    worker = PortWorker(port, write, policy, maxsize)
+    # first write is taken by the worker which then waits on the gate
+    worker.send_message([0x90, 1, 127])
+    port.writing.wait()
+    return worker, port
+
+
+def test_block():
+    worker, port = create_worker(BLOCK)
+    worker.send(Message('note_on', note=2))
+    worker.send(Message('note_on', note=3))
+    blocked = threading.Thread(
+        target=worker.send_message, args=([0x90, 4, 127],))
+    blocked.start()
+    blocked.join(0.05)
+    assert blocked.is_alive()
+    assert worker.depth == 2
+
+    port.gate.set()
+    blocked.join()
+    worker.close()
+    assert [data[1] for data in port.data] == [1, 2, 3, 4]
+    assert port.closed
+    assert worker.stats()['max_depth'] == 2
+
+
+def test_drop_oldest():
+    worker, port = create_worker(DROP_OLDEST)
+    for note in (2, 3, 4):
+        worker.send_message([0x90, note, 127])
+    port.gate.set()
+    worker.close()
+    assert [data[1] for data in port.data] == [1, 3, 4]
+    assert worker.stats()['dropped'] == 1
+
+
+def test_coalesce():
+    worker, port = create_worker(COALESCE, maxsize=8)
+    worker.send_message([0xB0, 7, 1])
+    worker.send_message([0xB0, 7, 2])
+    worker.send_message([0x90, 2, 127])
+    # a note keeps later values from moving before it
+    worker.send_message([0xB0, 7, 3])
+    worker.send_message([0xB0, 7, 4])
+    port.gate.set()
+    worker.close()
+    assert port.data == [
+        bytes([0x90, 1, 127]), bytes([0xB0, 7, 2]), bytes([0x90, 2, 127]),
+        bytes([0xB0, 7, 4])]
+    assert worker.stats() == {
+        'depth': 0, 'max_depth': 3, 'sent': 4, 'dropped': 0, 'coalesced': 2}
+
+    # nothing is queued once closed
+    worker.send_message([0xB0, 7, 5])
+    assert len(port.data) == 4
+
+
+def test_coalesce_key():
+    assert coalesce_key(bytes([0xB1, 7, 0])) == (0xB1, 7)
+    assert coalesce_key(bytes([0xE0, 0, 64])) == 0xE0
+    assert coalesce_key(bytes([0xD0, 5])) == 0xD0
+    assert coalesce_key(bytes([0x91, 7, 0])) is None
+    assert coalesce_key(bytes([0xB1, 7, 0, 0xB1, 8, 0])) is None
+    for control in (6, 38, 96, 97, 98, 99, 100, 101):
+        assert coalesce_key(bytes([0xB1, control, 0])) is None
+
+
+def test_policy_and_stats():
+    with pytest.raises(ValueError):
+        PortWorker(GatedPort(), lambda port, data: None, 'unknown')
+    worker = PortWorker(GatedPort(), lambda port, data: None)
+
+    class Ports:
+        ports = [worker, GatedPort()]
+
+    assert list(stats(Ports())) == ['Gated']
+    worker.close()
+
+
+@pytest.mark.parametrize('policy', [COALESCE, DROP_OLDEST])
+def test_nrpn_bursts(monkeypatch, policy):
+    monkeypatch.setattr(utils, 'nrpn_params', {})
+    worker, port = create_worker(policy, maxsize=8)
+    for lsb, level in ((9, 10), (10, 20)):
+        utils.write_now(worker, utils.nrpn_bytes(worker, {
+            'channel': 0, 'status': (1, lsb), 'level': level}))
+    # a lone data entry is never coalesced with the bursts
+    worker.send_message([0xB0, 6, 30])
+    port.gate.set()
+    worker.close()
+    assert b''.join(port.data[1:]) == bytes([
+        0xB0, 99, 1, 0xB0, 98, 9, 0xB0, 6, 10, 0xB0, 38, 0,
+        0xB0, 99, 1, 0xB0, 98, 10, 0xB0, 6, 20, 0xB0, 38, 0,
+        0xB0, 6, 30])
+    assert worker.stats()['coalesced'] == 0
+    assert worker.stats()['dropped'] == 0